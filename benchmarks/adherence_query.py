@@ -0,0 +1,137 @@
+"""
+Query latency of the adherence log over months of history.
+
+A log with the dose dialogues of many patients over several months is generated, with
+random feelings, help requests and box recognition attempts, and the adherence of
+random patients is aggregated per day and per medication over the whole history and
+over the last month. It reports the insert rate, the size of the database and the
+latency percentiles of the queries.
+
+Usage (from the benchmarks folder):
+    python3 adherence_query.py --patients 50 --months 6
+"""
+# Import all the needed libraries
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, '../web_application')
+from adherence_log import AdherenceLog
+
+MEDICATIONS = ['tachipirina', 'aspirina', 'cardioaspirina', 'eutirox', 'lasix', 'coumadin']
+
+
+def generate_history(log, patients, days, doses_per_day, rng):
+    """
+    Write the events of the dose dialogues of every patient for every day of the history.
+
+    Args:
+        log (AdherenceLog): The adherence log.
+        patients (int): The number of patients.
+        days (int): The number of days of the history, up to today.
+        doses_per_day (int): The number of doses of every day.
+        rng (random.Random): The random generator.
+
+    Returns:
+        int: The number of events written.
+    """
+    today = datetime.date.today()
+    written = 0
+    for patient in range(patients):
+        patient_id = f'patient{patient:03d}'
+        medications = rng.sample(MEDICATIONS, 3)
+        events = []
+        for offset in range(days, 0, -1):
+            date = (today - datetime.timedelta(days=offset - 1)).isoformat()
+            for dose in range(doses_per_day):
+                session = f'{date} {8 + dose * 4:02d}:00'
+                at = time.time()
+                dose_medications = rng.sample(medications, rng.randint(1, len(medications)))
+                for medication in dose_medications:
+                    events.append((at, patient_id, date, session, 'dose_start', medication, None, None, None, None))
+                feeling = rng.choice(['bene', 'bene', 'bene', 'male'])
+                events.append((at, patient_id, date, session, 'feeling', None, feeling, None, None, None))
+                if feeling == 'male':
+                    answer = rng.choice(['yes', 'no'])
+                    events.append((at, patient_id, date, session, 'confirmation', None, answer, None, None, None))
+                    if answer == 'yes':
+                        events.append((at, patient_id, date, session, 'help', None, 'confirmation', None, None, None))
+                if rng.random() < 0.05:
+                    # the dialogue was abandoned
+                    continue
+                for medication in dose_medications:
+                    for _ in range(rng.randint(0, 2)):
+                        outcome = rng.choice(['wrong', 'unreadable'])
+                        events.append((at, patient_id, date, session, 'ocr_attempt', medication, outcome,
+                                       rng.uniform(0, 80), rng.uniform(200, 1500), None))
+                    events.append((at, patient_id, date, session, 'ocr_attempt', medication, 'correct',
+                                   rng.uniform(80, 100), rng.uniform(200, 1500), None))
+                    events.append((at, patient_id, date, session, 'taken', medication, None, None, None, None))
+                events.append((at, patient_id, date, session, 'dose_end', None, None, None, None, None))
+        log.record_many(events)
+        written += len(events)
+    return written
+
+
+def measure(log, patients, start, end, queries, rng):
+    """
+    Measure the latency of the aggregation of random patients.
+
+    Args:
+        log (AdherenceLog): The adherence log.
+        patients (int): The number of patients.
+        start (str): The first day of the queries.
+        end (str): The last day of the queries.
+        queries (int): The number of queries.
+        rng (random.Random): The random generator.
+
+    Returns:
+        list: The latency of every query in milliseconds.
+    """
+    latencies = []
+    for _ in range(queries):
+        patient_id = f'patient{rng.randrange(patients):03d}'
+        query_start = time.perf_counter()
+        log.aggregate(patient_id, start, end)
+        latencies.append((time.perf_counter() - query_start) * 1000)
+    return latencies
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name}: median {statistics.median(latencies):.2f} ms, p95 {p95:.2f} ms, max {latencies[-1]:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query latency of the adherence log over months of history")
+    parser.add_argument('--patients', type=int, default=50, help="number of patients")
+    parser.add_argument('--months', type=int, default=6, help="months of history")
+    parser.add_argument('--doses-per-day', type=int, default=3, help="doses of every day")
+    parser.add_argument('--queries', type=int, default=200, help="queries of every kind")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    days = args.months * 30
+    today = datetime.date.today()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'adherence.db')
+        log = AdherenceLog(path)
+        start = time.perf_counter()
+        written = generate_history(log, args.patients, days, args.doses_per_day, rng)
+        elapsed = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder)) / 2 ** 20
+        print(f"{written} events written in {elapsed:.1f} s ({written / elapsed:.0f} events/s), {size:.1f} MB")
+        first_day = (today - datetime.timedelta(days=days - 1)).isoformat()
+        last_month = (today - datetime.timedelta(days=29)).isoformat()
+        report(f"{days} days", measure(log, args.patients, first_day, today.isoformat(), args.queries, rng))
+        report("30 days", measure(log, args.patients, last_month, today.isoformat(), args.queries, rng))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Replay of scripted traces on the dialogue state machine.
+
+Every trace of the folder (a JSON file with the patient, the input 'events' and the
+expected 'states' and 'notifications') is replayed on a new dialogue machine without any
+device, and the states entered and the caregivers notifications are compared with the
+expected ones. The replay is deterministic, so a difference is a change of behaviour.
+With --update the expected values are overwritten with the replayed ones.
+
+Usage (from the benchmarks folder):
+    python3 dialogue_replay.py traces
+"""
+# Import all the needed libraries
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, '../web_application')
+from dialogue import replay
+
+# the actions compared with the expected notifications
+NOTIFICATIONS = ('send_help', 'save_picture', 'send_recap')
+
+
+def replay_trace(trace):
+    """
+    Replay a trace.
+
+    Args:
+        trace (dict): The trace, with the 'patient' and the 'events'.
+
+    Returns:
+        dict: The 'states' entered, the 'notifications' sent and the replay time in milliseconds.
+    """
+    start = time.perf_counter()
+    result = replay(trace['events'], trace['patient'])
+    elapsed = (time.perf_counter() - start) * 1000
+    notifications = [list(action) for action in result['actions'] if action[0] in NOTIFICATIONS]
+    return {'states': result['states'], 'notifications': notifications, 'elapsed_ms': elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay of scripted traces on the dialogue state machine")
+    parser.add_argument('traces', help="folder with the JSON traces")
+    parser.add_argument('--update', action='store_true', help="overwrite the expected states and notifications")
+    args = parser.parse_args()
+    failures = 0
+    for file_name in sorted(os.listdir(args.traces)):
+        if not file_name.endswith('.json'):
+            continue
+        path = os.path.join(args.traces, file_name)
+        with open(path) as f:
+            trace = json.load(f)
+        result = replay_trace(trace)
+        if args.update:
+            trace['states'] = result['states']
+            trace['notifications'] = result['notifications']
+            with open(path, 'w') as f:
+                json.dump(trace, f, indent=2, ensure_ascii=False)
+                f.write('\n')
+            print(f"{file_name}: updated")
+            continue
+        differences = [key for key in ('states', 'notifications') if trace.get(key) != result[key]]
+        if differences:
+            failures += 1
+            print(f"{file_name}: FAILED ({result['elapsed_ms']:.2f} ms)")
+            for key in differences:
+                print(f"  expected {key}: {trace.get(key)}")
+                print(f"  replayed {key}: {result[key]}")
+        else:
+            print(f"{file_name}: ok ({result['elapsed_ms']:.2f} ms)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+Simulation of a whole week of the dose scheduler, with a simulated clock.
+
+A random therapy plan (or the plan of a folder) is scheduled for a week. The simulated
+interaction checks the scheduler, jumps to the next dose, sometimes late, and spends a
+random time in every dose dialogue, sometimes longer than the interval between two
+doses. A second week is simulated with the first dialogue of every day stuck for hours,
+past the grace period of the doses due meanwhile. At the end it checks that every dose
+has been taken exactly once, or recorded as missed only if it was late more than the
+grace period, that the doses of the stuck dialogues have been missed, and reports how
+long it took.
+
+Usage (from the benchmarks folder):
+    python3 dose_scheduler_week.py --doses-per-day 6
+"""
+# Import all the needed libraries
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, '../web_application')
+from therapy_plan_store import DAYS, TherapyPlanStore
+from dose_scheduler import DoseScheduler
+
+
+class SimulatedClock:
+    """
+    Clock whose time moves only when told to.
+    """
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += datetime.timedelta(seconds=seconds)
+
+
+def write_random_plans(folder, doses_per_day, rng):
+    """
+    Write a random therapy plan for every day of the week, in the format of the therapy plan CSV files.
+
+    Args:
+        folder (str): The folder of the CSV files.
+        doses_per_day (int): The number of doses of every day.
+        rng (random.Random): The random generator.
+    """
+    hours = [f'{hour:02d}:{minute:02d}' for hour in range(6, 24) for minute in (0, 30)]
+    for day in DAYS:
+        dose_hours = set(rng.sample(hours, doses_per_day))
+        with open(os.path.join(folder, f'therapy_plan_{day}.csv'), 'w') as f:
+            f.write('hour,medication_1,quantity_medication_1\n')
+            for hour in hours:
+                f.write(f'{hour},tachipirina,1\n' if hour in dose_hours else f'{hour},,\n')
+
+
+def simulate_week(store, start, grace_period, max_late, max_dialogue, rng, stuck_dialogue=None):
+    """
+    Simulate a week of interaction with the scheduler.
+
+    Args:
+        store (TherapyPlanStore): The store with the therapy plans.
+        start (datetime.datetime): The start of the simulation.
+        grace_period (float): The grace period of the scheduler in seconds.
+        max_late (float): The maximum delay in seconds of a check after the time of a dose.
+        max_dialogue (float): The maximum duration in seconds of a dose dialogue.
+        rng (random.Random): The random generator.
+        stuck_dialogue (float, optional): The duration in seconds of the first dialogue of every day.
+            Defaults to None (as long as the others).
+
+    Returns:
+        dict: The doses taken and missed, the number of checks of the scheduler and the (start, end)
+            of the stuck dialogues.
+    """
+    clock = SimulatedClock(start)
+    missed = []
+    scheduler = DoseScheduler(store, grace_period=grace_period, clock=clock, on_missed=missed.append)
+    end = start + datetime.timedelta(days=7)
+    taken = []
+    checks = 0
+    stuck = []
+    while clock.now < end:
+        checks += 1
+        dose = scheduler.due()
+        if dose is not None:
+            taken.append(dose)
+            if stuck_dialogue is not None and (not stuck or stuck[-1][0].date() < clock.now.date()):
+                stuck.append((clock.now, clock.now + datetime.timedelta(seconds=stuck_dialogue)))
+                clock.advance(stuck_dialogue)
+            else:
+                clock.advance(rng.uniform(0, max_dialogue))
+            continue
+        seconds = scheduler.seconds_to_next()
+        if seconds is None:
+            break
+        clock.advance(seconds + rng.uniform(0, max_late))
+    # the doses due at the end of the simulation
+    dose = scheduler.due()
+    while dose is not None:
+        taken.append(dose)
+        dose = scheduler.due()
+    return {'taken': taken, 'missed': missed, 'checks': checks, 'end': clock.now, 'stuck': stuck}
+
+
+def check_week(store, start, end, taken, missed, grace_period, stuck=()):
+    """
+    Check that every dose of the simulated time (and of the grace period before it) has been
+    taken exactly once or missed, and that the doses due during a stuck dialogue, more than the
+    grace period before its end, have been missed.
+
+    Args:
+        store (TherapyPlanStore): The store with the therapy plans.
+        start (datetime.datetime): The start of the simulation.
+        end (datetime.datetime): The end of the simulation.
+        taken (list): The doses returned by the scheduler.
+        missed (list): The doses recorded as missed.
+        grace_period (float): The grace period of the scheduler in seconds.
+        stuck (list, optional): The (start, end) of the stuck dialogues. Defaults to ().
+
+    Returns:
+        list: The errors found, empty if the schedule is correct.
+    """
+    expected = set()
+    date = start.date()
+    while date <= end.date():
+        for hour in store.get_plan(DAYS[date.weekday()]):
+            at = datetime.datetime.combine(date, datetime.time.fromisoformat(hour))
+            if start - datetime.timedelta(seconds=grace_period) <= at <= end:
+                expected.add((date.isoformat(), hour))
+        date += datetime.timedelta(days=1)
+    errors = []
+    taken_keys = [(dose['date'], dose['time']) for dose in taken]
+    missed_keys = [(dose['date'], dose['time']) for dose in missed]
+    all_keys = taken_keys + missed_keys
+    if len(all_keys) != len(set(all_keys)):
+        errors.append("a dose has been returned more than once")
+    if not expected.issubset(all_keys):
+        errors.append(f"doses never returned: {sorted(expected.difference(all_keys))}")
+    if any(dose['delay'] > grace_period for dose in taken):
+        errors.append("a dose has been returned after the grace period")
+    grace = datetime.timedelta(seconds=grace_period)
+    not_missed = sorted(
+        key for key in expected
+        if any(begin < datetime.datetime.combine(datetime.date.fromisoformat(key[0]), datetime.time.fromisoformat(key[1])) < finish - grace
+               for begin, finish in stuck)
+        and key not in missed_keys
+    )
+    if not_missed:
+        errors.append(f"doses due during a stuck dialogue not missed: {not_missed}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated week of the dose scheduler")
+    parser.add_argument('--therapy-plan', help="folder of the therapy plan CSV files, random plans if not given")
+    parser.add_argument('--doses-per-day', type=int, default=6)
+    parser.add_argument('--grace-period', type=float, default=900)
+    parser.add_argument('--max-late', type=float, default=120, help="maximum delay of a check in seconds")
+    parser.add_argument('--max-dialogue', type=float, default=2400, help="maximum duration of a dose dialogue in seconds")
+    parser.add_argument('--stuck-dialogue', type=float, default=4 * 3600, help="duration of the stuck dialogues in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    folder = args.therapy_plan
+    temporary_folder = None
+    if folder is None:
+        temporary_folder = tempfile.TemporaryDirectory()
+        folder = temporary_folder.name
+        write_random_plans(folder, args.doses_per_day, rng)
+    store = TherapyPlanStore(folder)
+    start = datetime.datetime(2024, 1, 1, 0, 0)
+    results = {}
+    for scenario, stuck_dialogue in (('regular', None), ('stuck', args.stuck_dialogue)):
+        # the missed doses are printed by the scheduler, hidden during the simulation
+        with contextlib.redirect_stdout(io.StringIO()):
+            begin = time.perf_counter()
+            simulation = simulate_week(store, start, args.grace_period, args.max_late, args.max_dialogue, rng, stuck_dialogue)
+            elapsed = (time.perf_counter() - begin) * 1000
+        errors = check_week(
+            store, start, simulation['end'], simulation['taken'], simulation['missed'], args.grace_period, simulation['stuck']
+        )
+        print(
+            f"{scenario}: {len(simulation['taken'])} doses taken, {len(simulation['missed'])} missed, "
+            f"{simulation['checks']} checks in {elapsed:.1f} ms"
+        )
+        for error in errors:
+            print(f"Error: {error}")
+        results[scenario] = {
+            'taken': len(simulation['taken']),
+            'missed': len(simulation['missed']),
+            'checks': simulation['checks'],
+            'elapsed_ms': elapsed,
+            'errors': errors
+        }
+    if temporary_folder is not None:
+        temporary_folder.cleanup()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,526 @@
+"""
+End-to-end benchmark of the dose sessions.
+
+The whole application runs in this process through `interaction()`, with the real
+models, against scripted devices: the microphone is replaced by a source playing, at
+the pace of a microphone, the recorded utterance (16 kHz 16 bit mono WAV files named
+'<keyword>_<anything>.wav') answering the state the dialogue is listening in, the
+camera by a source showing the photos of the box of the medication expected (named
+'<medication>_<anything>.jpg'), the audio output by the SDL dummy driver and Telegram
+by the local stub. A patient with a dose of some of the medications of the photos for
+every session is generated, the doses are due at once and are taken one after another.
+
+It reports the wall time of every session and of every stage of the pipeline (from the
+stage metrics of the application), the peak resident memory and the CPU utilization of
+the process and of the OCR worker, and writes them as JSON together with the commit, so
+that the runs of two commits can be compared with --compare.
+
+Usage (from the benchmarks folder):
+    python3 dose_session.py fixtures/commands fixtures/boxes --sessions 3
+"""
+# Import all the needed libraries
+import argparse
+import datetime
+import functools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import cv2
+
+from telegram_stub import start_stub_server
+
+sys.path.insert(0, '../web_application')
+from audio_capture import SAMPLE_RATE, SAMPLE_WIDTH
+from therapy_plan_store import DAYS
+
+# the keyword answered in every state the dialogue listens in
+ANSWERS = {'feelings': 'bene', 'confirmation': 'no', 'photo': 'foto', 'next': 'avanti'}
+CAREGIVER_HANDLE = 'bench_caregiver'
+
+
+class ScriptedAudioSource:
+    """
+    Audio source writing silence at the pace of a microphone, and a recorded utterance of a
+    keyword when asked, after a thinking time.
+    """
+
+    def __init__(self, utterances, think_time=0.5, frames_per_buffer=1600):
+        """
+        Initialize the source.
+
+        Args:
+            utterances (dict): The recordings (16 bit mono audio) of every keyword.
+            think_time (float, optional): Seconds of silence before an utterance. Defaults to 0.5.
+            frames_per_buffer (int, optional): The number of frames written at a time. Defaults to 1600 (100 ms).
+        """
+        self.utterances = utterances
+        self.think_time = think_time
+        self.frames_per_buffer = frames_per_buffer
+        self.spoken = 0
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._pending = None
+        self._stopped = threading.Event()
+
+    def speak(self, keyword):
+        """
+        Say a keyword after the thinking time, replacing the utterance not started yet.
+
+        Args:
+            keyword (str): The keyword.
+        """
+        recordings = self.utterances[keyword]
+        # the recordings of a keyword are used in turn
+        index = self._counters.get(keyword, 0)
+        self._counters[keyword] = index + 1
+        with self._lock:
+            self._pending = (time.monotonic() + self.think_time, recordings[index % len(recordings)])
+        return
+
+    def cancel(self):
+        """
+        Drop the utterance not started yet.
+        """
+        with self._lock:
+            self._pending = None
+        return
+
+    def start(self, ring):
+        threading.Thread(target=self._run, args=(ring,), name='scripted-audio', daemon=True).start()
+        return
+
+    def stop(self):
+        self._stopped.set()
+        return
+
+    def _run(self, ring):
+        chunk_size = self.frames_per_buffer * SAMPLE_WIDTH
+        silence = bytes(chunk_size)
+        period = self.frames_per_buffer / SAMPLE_RATE
+        playing = b''
+        next_write = time.monotonic()
+        while not self._stopped.is_set():
+            with self._lock:
+                if not playing and self._pending is not None and self._pending[0] <= time.monotonic():
+                    playing = self._pending[1]
+                    self._pending = None
+                    self.spoken += 1
+            if playing:
+                chunk, playing = playing[:chunk_size], playing[chunk_size:]
+                ring.write(chunk.ljust(chunk_size, b'\0'))
+            else:
+                ring.write(silence)
+            next_write += period
+            time.sleep(max(0, next_write - time.monotonic()))
+
+
+class ScriptedCameraSource:
+    """
+    Frame source showing the photos of the box of the medication expected, in turn. It has
+    the same interface of cv2.VideoCapture.
+    """
+
+    def __init__(self, photos):
+        """
+        Initialize the source.
+
+        Args:
+            photos (dict): The photos of every medication.
+        """
+        self.photos = photos
+        self.medication = None
+        self._index = 0
+
+    def show(self, medication):
+        """
+        Show the photos of a medication from now on.
+
+        Args:
+            medication (str): The medication.
+        """
+        self.medication = medication
+        return
+
+    def isOpened(self):
+        return bool(self.photos)
+
+    def read(self):
+        photos = self.photos.get(self.medication) or next(iter(self.photos.values()))
+        self._index += 1
+        return True, photos[self._index % len(photos)]
+
+    def release(self):
+        return
+
+
+class ResourceMonitor:
+    """
+    Sampler of the resident memory and of the CPU time of this process and of its children
+    (e.g. the OCR worker), read from /proc.
+    """
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak_rss_mb = 0.0
+        self._ticks = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _pids(self, pid):
+        pids = [pid]
+        try:
+            for task in os.listdir(f'/proc/{pid}/task'):
+                with open(f'/proc/{pid}/task/{task}/children') as f:
+                    for child in f.read().split():
+                        pids.extend(self._pids(int(child)))
+        except OSError:
+            pass
+        return pids
+
+    def sample(self):
+        """
+        Read the memory and the CPU time of the process tree.
+        """
+        rss = 0
+        for pid in self._pids(os.getpid()):
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    # the fields after the command name, which may contain spaces
+                    fields = f.read().rsplit(')', 1)[1].split()
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            rss += int(line.split()[1])
+            except OSError:
+                continue
+            with self._lock:
+                # the CPU time of a process that exits is the last one read
+                self._ticks[pid] = int(fields[11]) + int(fields[12])
+        self.peak_rss_mb = max(self.peak_rss_mb, rss / 1024)
+        return
+
+    def cpu_seconds(self):
+        """
+        Get the CPU time used by the process tree.
+
+        Returns:
+            float: The CPU seconds, user and system, of all the processes seen.
+        """
+        self.sample()
+        with self._lock:
+            return sum(self._ticks.values()) / os.sysconf('SC_CLK_TCK')
+
+    def start(self):
+        def run():
+            while not self._stopped.wait(self.interval):
+                self.sample()
+        self.sample()
+        threading.Thread(target=run, name='resource-monitor', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        return
+
+
+def load_utterances(folder):
+    """
+    Load the recorded utterances of the keywords answered by the patient.
+
+    Args:
+        folder (str): The folder with the '<keyword>_<anything>.wav' recordings.
+
+    Returns:
+        dict: The 16 bit mono audio of the recordings of every keyword.
+    """
+    utterances = {}
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.endswith('.wav'):
+            continue
+        with wave.open(os.path.join(folder, file_name), 'rb') as wav:
+            if wav.getframerate() != SAMPLE_RATE or wav.getnchannels() != 1 or wav.getsampwidth() != SAMPLE_WIDTH:
+                raise ValueError(f"{file_name} must be a {SAMPLE_RATE} Hz 16 bit mono WAV file")
+            utterances.setdefault(file_name.rsplit('_', 1)[0], []).append(wav.readframes(wav.getnframes()))
+    return utterances
+
+
+def load_photos(folder):
+    """
+    Load the photos of the medication boxes.
+
+    Args:
+        folder (str): The folder with the '<medication>_<anything>' photos.
+
+    Returns:
+        dict: The photos of every medication.
+    """
+    photos = {}
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        frame = cv2.imread(os.path.join(folder, file_name))
+        if frame is not None:
+            photos.setdefault(file_name.rsplit('_', 1)[0], []).append(frame)
+    return photos
+
+
+def write_patient(folder, medications, sessions, medications_per_dose, rng):
+    """
+    Write the patient registry with a single patient and therapy plans with a dose in each of the
+    last minutes, the same on every day so that they are due also across midnight.
+
+    Args:
+        folder (str): The folder of the registry and of the therapy plans.
+        medications (list): The medications of the photos.
+        sessions (int): The number of doses.
+        medications_per_dose (int): The number of medications of every dose.
+        rng (random.Random): The random generator.
+
+    Returns:
+        tuple: The path of the registry and the folder of the therapy plans.
+    """
+    plans_folder = os.path.join(folder, 'therapy_plan')
+    os.makedirs(plans_folder)
+    now = datetime.datetime.now()
+    rows = []
+    for i in range(sessions):
+        hour = (now - datetime.timedelta(minutes=sessions - i)).strftime('%H:%M')
+        dose = rng.sample(medications, min(medications_per_dose, len(medications)))
+        rows.append(hour + ''.join(f',{medication},1' for medication in dose))
+    columns = max(row.count(',') for row in rows) // 2
+    header = 'hour' + ''.join(f',medication_{i},quantity_medication_{i}' for i in range(1, columns + 1))
+    rows = [row + ',' * (columns * 2 - row.count(',')) for row in sorted(rows)]
+    for day in DAYS:
+        with open(os.path.join(plans_folder, f'therapy_plan_{day}.csv'), 'w') as f:
+            f.write('\n'.join([header] + rows) + '\n')
+    registry_path = os.path.join(folder, 'patient_registry.csv')
+    with open(registry_path, 'w') as f:
+        f.write('patient_id,name,gender,age,cg_handle_1\n')
+        f.write(f'bench,Mario,M,80,@{CAREGIVER_HANDLE}\n')
+    return registry_path, plans_folder
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_effects(app, audio, camera, monitor, sessions):
+    """
+    Create the effects of the benchmark: the effects of the kiosk, answering the dialogue with
+    the scripted devices and recording the time of every session.
+
+    Args:
+        app (module): The application module.
+        audio (ScriptedAudioSource): The audio source.
+        camera (ScriptedCameraSource): The frame source.
+        monitor (ResourceMonitor): The resource monitor.
+        sessions (list): The list where the finished sessions are appended.
+
+    Returns:
+        type: The class of the effects.
+    """
+    class BenchmarkEffects(app.KioskEffects):
+
+        session = None
+
+        def listen(self, grammar):
+            super().listen(grammar)
+            if grammar in ANSWERS:
+                audio.speak(ANSWERS[grammar])
+
+        def pause_listening(self):
+            super().pause_listening()
+            audio.cancel()
+
+        def record(self, patient, dose, kind, **fields):
+            super().record(patient, dose, kind, **fields)
+            if kind == 'dose_start' and self.session is None:
+                self.session = {
+                    'id': f"{patient['id']}-{dose['date']}T{dose['time']}", 'dose': dose['time'],
+                    'start': time.perf_counter(), 'cpu_start': monitor.cpu_seconds(),
+                    'medications': [medication for medication, _ in dose['medications']]
+                }
+                camera.show(self.session['medications'][0])
+            elif kind == 'taken':
+                medications = self.session['medications']
+                index = medications.index(fields['medication']) + 1
+                if index < len(medications):
+                    camera.show(medications[index])
+            elif kind == 'ocr_attempt':
+                self.session.setdefault('ocr_outcomes', []).append(fields.get('outcome'))
+            elif kind == 'dose_end':
+                session, self.session = self.session, None
+                seconds = time.perf_counter() - session['start']
+                trace = app.stage_metrics.get_trace(session['id']) or {'spans': []}
+                stages = {}
+                for span in trace['spans']:
+                    stages[span['stage']] = stages.get(span['stage'], 0.0) + span['seconds']
+                sessions.append({
+                    'dose': session['dose'], 'medications': session['medications'],
+                    'ocr_outcomes': session.get('ocr_outcomes', []), 'seconds': seconds,
+                    'cpu_seconds': monitor.cpu_seconds() - session['cpu_start'], 'stages': stages
+                })
+                print(f"session {len(sessions)} ({session['dose']}): {seconds:.1f} s")
+
+    return BenchmarkEffects
+
+
+def compare(results, baseline):
+    """
+    Print the changes of the session time, of the resources and of the median of every stage
+    from a previous run.
+
+    Args:
+        results (dict): The results of this run.
+        baseline (dict): The results of the previous run.
+    """
+    def change(name, old, new, unit):
+        if old is None or new is None:
+            return
+        delta = f" ({(new - old) / old * 100:+.0f}%)" if old else ''
+        print(f"  {name}: {old:.3f} -> {new:.3f} {unit}{delta}")
+
+    print(f"compared with {baseline.get('commit')}:")
+    change('median session', baseline.get('median_session_s'), results['median_session_s'], 's')
+    change('peak RSS', baseline.get('peak_rss_mb'), results['peak_rss_mb'], 'MB')
+    change('CPU utilization', baseline.get('cpu_utilization'), results['cpu_utilization'], 'cores')
+    for stage, stats in results['stages'].items():
+        old = baseline.get('stages', {}).get(stage)
+        if old is not None:
+            change(f'{stage} p50', old['p50'], stats['p50'], 's')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the dose sessions")
+    parser.add_argument('utterances', help="folder with the '<keyword>_<anything>.wav' recordings")
+    parser.add_argument('photos', help="folder with the '<medication>_<anything>.jpg' photos of the boxes")
+    parser.add_argument('--sessions', type=int, default=3)
+    parser.add_argument('--medications-per-dose', type=int, default=2)
+    parser.add_argument('--feeling', choices=['bene', 'male'], default='bene', help="the answer about the feeling")
+    parser.add_argument('--think-time', type=float, default=0.5, help="seconds before every answer")
+    parser.add_argument('--telegram-delay', type=float, default=0.0, help="seconds waited by the Telegram stub")
+    parser.add_argument('--timeout', type=float, default=900.0, help="maximum seconds of the whole run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file (default dose_session_<commit>.json)")
+    parser.add_argument('--compare', help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+    ANSWERS['feelings'] = args.feeling
+    rng = random.Random(args.seed)
+    commit = get_commit()
+    output = os.path.abspath(args.output or f"dose_session_{commit or 'unknown'}.json")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    utterances = load_utterances(args.utterances)
+    missing = sorted(set(ANSWERS.values()) - set(utterances))
+    if missing:
+        sys.exit(f"Error: no recordings of {', '.join(missing)} in {args.utterances}")
+    photos = load_photos(args.photos)
+    if not photos:
+        sys.exit(f"Error: no photos in {args.photos}")
+    # all the files of the run are written in a temporary folder, removed at the end
+    temporary_folder = tempfile.TemporaryDirectory()
+    folder = temporary_folder.name
+    registry_path, plans_folder = write_patient(folder, sorted(photos), args.sessions, args.medications_per_dose, rng)
+    updates = [{'update_id': 1, 'message': {'message_id': 1, 'chat': {'id': 1, 'username': CAREGIVER_HANDLE}, 'text': '/start'}}]
+    stub = start_stub_server(delay=args.telegram_delay, updates=updates)
+    os.environ.update({
+        'PATIENT_REGISTRY': registry_path,
+        'THERAPY_PLAN_FOLDER': plans_folder,
+        'KIOSK_ID': 'bench',
+        'TELEGRAM_API_URL': stub.url,
+        # the state of the benchmark is kept apart from the one of the application
+        'ADHERENCE_LOG': os.path.join(folder, 'adherence.db'),
+        'NOTIFICATION_OUTBOX': os.path.join(folder, 'notifications.db'),
+        'CHAT_ID_REGISTRY': os.path.join(folder, 'chat_ids.json'),
+        'TTS_CACHE_FOLDER': os.path.join(folder, 'tts_cache'),
+        'PICTURES_FOLDER': os.path.join(folder, 'medications'),
+        # a silent audio sink
+        'SDL_AUDIODRIVER': 'dummy'
+    })
+    # the models are found relative to the application
+    os.chdir('../web_application')
+    for day in DAYS:
+        os.makedirs(os.path.join(folder, 'medications', day))
+    monitor = ResourceMonitor().start()
+    start = time.perf_counter()
+    import app
+    from dose_scheduler import DoseScheduler
+    audio = ScriptedAudioSource(utterances, think_time=args.think_time)
+    camera = ScriptedCameraSource(photos)
+    sessions = []
+    app.dose_scheduler = DoseScheduler(app.patient_registry.stores, grace_period=args.sessions * 60 + 600)
+    app.setup_speech_recognition = functools.partial(app.setup_speech_recognition, audio)
+    app.setup_camera = functools.partial(app.setup_camera, camera)
+    app.KioskEffects = make_effects(app, audio, camera, monitor, sessions)
+    app.start_loading()
+    app.notification_outbox.start()
+    threading.Thread(target=app.interaction, name='interaction', daemon=True).start()
+    deadline = time.monotonic() + args.timeout
+    # the run ends when the recaps of all the sessions have been delivered to the caregivers
+    while time.monotonic() < deadline:
+        if len(sessions) >= args.sessions and app.notification_outbox.pending_count() == 0:
+            break
+        time.sleep(0.1)
+    wall = time.perf_counter() - start
+    cpu = monitor.cpu_seconds()
+    monitor.stop()
+    status = app.startup.status()
+    results = {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'arguments': vars(args),
+        'completed_sessions': len(sessions),
+        'wall_s': wall,
+        'listening_s': status['milestones'].get('listening'),
+        'modules_s': {name: component['seconds'] for name, component in status['components'].items()},
+        'median_session_s': statistics.median(session['seconds'] for session in sessions) if sessions else None,
+        'sessions': sessions,
+        'stages': app.stage_metrics.summary(),
+        'peak_rss_mb': monitor.peak_rss_mb,
+        'cpu_seconds': cpu,
+        'cpu_utilization': cpu / wall,
+        'telegram_messages': len(stub.messages),
+        'utterances_spoken': audio.spoken
+    }
+    if len(sessions) < args.sessions:
+        print(f"Error: only {len(sessions)} of {args.sessions} sessions completed in {args.timeout:.0f} s.")
+    listening = f"{results['listening_s']:.1f} s" if results['listening_s'] is not None else "not reached"
+    print(f"listening after {listening}, {len(sessions)} sessions in {wall:.1f} s")
+    for stage, stats in results['stages'].items():
+        print(
+            f"  {stage}: {stats['count']} times, p50 {stats['p50'] * 1000:.1f} ms, "
+            f"p95 {stats['p95'] * 1000:.1f} ms, p99 {stats['p99'] * 1000:.1f} ms"
+        )
+    print(
+        f"peak RSS {results['peak_rss_mb']:.1f} MB, CPU {cpu:.1f} s "
+        f"({results['cpu_utilization']:.2f} cores on {os.cpu_count()}), {len(stub.messages)} Telegram messages"
+    )
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, default=float)
+    print(f"results written to {output}")
+    if baseline is not None:
+        compare(results, baseline)
+    if app.startup.is_ready('ocr') and hasattr(app.startup.get('ocr'), 'stop'):
+        app.startup.get('ocr').stop()
+    audio.stop()
+    temporary_folder.cleanup()
+    sys.exit(0 if len(sessions) >= args.sessions else 1)
+
+
+if __name__ == '__main__':
+    main()
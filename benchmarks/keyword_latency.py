@@ -0,0 +1,133 @@
+"""
+Benchmark of the command latency of the speech recognition.
+
+Every recorded WAV fixture (16 kHz 16 bit mono, named '<keyword>_<anything>.wav', e.g.
+'foto_01.wav') is decoded both with the free-form recognizer and with the keyword
+spotter. The latency of a command is the audio time between the end of the speech
+(estimated from the signal energy) and the moment the decoder returns the command.
+
+Usage (from the benchmarks folder):
+    python3 keyword_latency.py fixtures/commands
+"""
+# Import all the needed libraries
+import argparse
+import array
+import json
+import math
+import os
+import statistics
+import sys
+import wave
+
+sys.path.insert(0, '../web_application')
+from audio_capture import SAMPLE_RATE, SAMPLE_WIDTH
+from speech_decoders import GRAMMARS, UtteranceDecoder, KeywordSpotter
+
+
+def find_speech_end(frames, window=0.03, threshold=500):
+    """
+    Estimate when the speech ends as the end of the last window whose energy is above the threshold.
+
+    Args:
+        frames (bytes): The 16 bit mono audio.
+        window (float, optional): The length of the windows in seconds. Defaults to 0.03.
+        threshold (int, optional): The RMS threshold of speech. Defaults to 500.
+
+    Returns:
+        float: The end of the speech in seconds.
+    """
+    samples = array.array('h', frames)
+    size = int(window * SAMPLE_RATE)
+    end = 0
+    for start in range(0, len(samples), size):
+        block = samples[start:start + size]
+        if math.sqrt(sum(sample * sample for sample in block) / len(block)) > threshold:
+            end = start + len(block)
+    return end / SAMPLE_RATE
+
+
+def get_state(keyword):
+    """
+    Get the dialogue state in which a keyword is expected.
+
+    Args:
+        keyword (str): The keyword.
+
+    Returns:
+        str: The first state whose grammar contains the keyword.
+    """
+    for state, words in GRAMMARS.items():
+        if keyword in words:
+            return state
+    raise ValueError(f"'{keyword}' is not a keyword of any dialogue state")
+
+
+def decode(decoder, frames, chunk_seconds=0.1, trailing_silence=1.5):
+    """
+    Feed the audio to a decoder until it returns a text.
+
+    Args:
+        decoder (UtteranceDecoder or KeywordSpotter): The decoder.
+        frames (bytes): The 16 bit mono audio.
+        chunk_seconds (float, optional): The length of the chunks fed to the decoder. Defaults to 0.1.
+        trailing_silence (float, optional): Seconds of silence appended to the audio. Defaults to 1.5.
+
+    Returns:
+        tuple: The decoded text (None if nothing has been decoded) and the audio time in seconds at which it was returned.
+    """
+    frames += bytes(int(trailing_silence * SAMPLE_RATE) * SAMPLE_WIDTH)
+    chunk_size = int(chunk_seconds * SAMPLE_RATE) * SAMPLE_WIDTH
+    for offset in range(0, len(frames), chunk_size):
+        text = decoder.accept(frames[offset:offset + chunk_size])
+        if text:
+            return text, (offset + chunk_size) / SAMPLE_WIDTH / SAMPLE_RATE
+    return None, len(frames) / SAMPLE_WIDTH / SAMPLE_RATE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Command latency of the free-form recognizer and of the keyword spotter")
+    parser.add_argument('fixtures', help="folder with the '<keyword>_<anything>.wav' recordings")
+    parser.add_argument('--model', default='../model/vosk-model-small-it-0.22')
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    from vosk import Model, KaldiRecognizer, SetLogLevel
+    SetLogLevel(-1)
+    model = Model(args.model)
+    decoders = {
+        'free': UtteranceDecoder(KaldiRecognizer(model, SAMPLE_RATE)),
+        'keywords': KeywordSpotter(model, SAMPLE_RATE)
+    }
+    results = {mode: [] for mode in decoders}
+    for file_name in sorted(os.listdir(args.fixtures)):
+        if not file_name.endswith('.wav'):
+            continue
+        keyword = file_name.split('_')[0]
+        with wave.open(os.path.join(args.fixtures, file_name), 'rb') as wav:
+            frames = wav.readframes(wav.getnframes())
+        speech_end = find_speech_end(frames)
+        for mode, decoder in decoders.items():
+            decoder.set_state(get_state(keyword))
+            decoder.reset()
+            text, detected_at = decode(decoder, frames)
+            results[mode].append({
+                'file': file_name,
+                'keyword': keyword,
+                'text': text,
+                'correct': text is not None and keyword in text.split(),
+                'latency_ms': (detected_at - speech_end) * 1000
+            })
+    for mode, mode_results in results.items():
+        latencies = [result['latency_ms'] for result in mode_results if result['correct']]
+        correct = len(latencies)
+        print(f"{mode:>9}: {correct}/{len(mode_results)} correct", end='')
+        if latencies:
+            print(f", median latency {statistics.median(latencies):.0f} ms, max {max(latencies):.0f} ms")
+        else:
+            print()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Load test of a single server process serving many kiosks.
+
+A registry of random patients, each with the therapy plans of its own folder, is
+generated and the application is imported on it, without starting the assistant. Then,
+for a growing number of kiosks, every kiosk loads its page and connects a Socket.IO
+client to its room, the next medications are pushed to all the rooms, and the clients
+disconnect. The cycle is repeated to check that the memory of the process stays bounded
+when the kiosks come and go; it reports the page latency, the push time and the resident
+memory after every cycle.
+
+Usage (from the benchmarks folder):
+    python3 kiosk_load.py --kiosks 60 --cycles 5
+"""
+# Import all the needed libraries
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from dose_scheduler_week import write_random_plans
+
+sys.path.insert(0, '../web_application')
+from memory_usage import rss_mb
+
+
+def write_registry(folder, patients, doses_per_day, rng):
+    """
+    Write a patient registry with random patients, each with its own therapy plans.
+
+    Args:
+        folder (str): The folder of the registry and of the therapy plans.
+        patients (int): The number of patients.
+        doses_per_day (int): The number of doses of every day.
+        rng (random.Random): The random generator.
+
+    Returns:
+        tuple: The path of the registry and the folder of the therapy plans.
+    """
+    plans_folder = os.path.join(folder, 'therapy_plan')
+    registry_path = os.path.join(folder, 'patient_registry.csv')
+    with open(registry_path, 'w') as f:
+        f.write('patient_id,name,gender,age,cg_handle_1\n')
+        for i in range(patients):
+            patient_id = f'p{i:03d}'
+            os.makedirs(os.path.join(plans_folder, patient_id))
+            write_random_plans(os.path.join(plans_folder, patient_id), doses_per_day, rng)
+            f.write(f'{patient_id},Paziente {i},{rng.choice("MF")},{rng.randint(65, 95)},\n')
+    return registry_path, plans_folder
+
+
+def run_cycle(app, kiosks):
+    """
+    Load the page of every kiosk, connect its client, push the next medications and disconnect.
+
+    Args:
+        app (module): The application module.
+        kiosks (list): The kiosk IDs.
+
+    Returns:
+        dict: The median page latency and the push time in milliseconds, and the events received.
+    """
+    http = app.app.test_client()
+    latencies = []
+    clients = []
+    for kiosk_id in kiosks:
+        start = time.perf_counter()
+        response = http.get(f'/kiosk/{kiosk_id}')
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200
+        clients.append(app.socketio.test_client(app.app, query_string=f'kiosk={kiosk_id}'))
+    # the next medications are sent on connection, the push is forced to reach every room
+    app.kiosk_next_medications.clear()
+    start = time.perf_counter()
+    updated = app.push_kiosk_updates()
+    push_ms = (time.perf_counter() - start) * 1000
+    received = 0
+    for client in clients:
+        received += sum(event['name'] == 'next_medication' for event in client.get_received())
+        client.disconnect()
+    return {'page_ms': statistics.median(latencies), 'push_ms': push_ms, 'updated': updated, 'received': received}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of many kiosks on a single server process")
+    parser.add_argument('--kiosks', type=int, default=60)
+    parser.add_argument('--cycles', type=int, default=5)
+    parser.add_argument('--doses-per-day', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    # the registry, the plans and the state written by the application are kept in a
+    # temporary folder until the end, then removed
+    temporary_folder = tempfile.TemporaryDirectory()
+    folder = temporary_folder.name
+    registry_path, plans_folder = write_registry(folder, args.kiosks, args.doses_per_day, rng)
+    os.environ.update({
+        'PATIENT_REGISTRY': registry_path,
+        'THERAPY_PLAN_FOLDER': plans_folder,
+        'ADHERENCE_LOG': os.path.join(folder, 'adherence.db'),
+        'NOTIFICATION_OUTBOX': os.path.join(folder, 'notifications.db'),
+        'CHAT_ID_REGISTRY': os.path.join(folder, 'chat_ids.json'),
+        'TTS_CACHE_FOLDER': os.path.join(folder, 'tts_cache'),
+        'PICTURES_FOLDER': os.path.join(folder, 'medications')
+    })
+    # the templates and the static files are found relative to the application
+    os.chdir('../web_application')
+    import app
+    baseline = rss_mb()
+    print(f"{args.kiosks} patients loaded, {baseline:.1f} MB")
+    results = []
+    kiosks = app.patient_registry.kiosks()
+    for cycle in range(args.cycles):
+        # a growing number of kiosks in the first cycles, then all of them
+        count = min(len(kiosks), len(kiosks) * (cycle + 1) // max(1, args.cycles - 2))
+        result = run_cycle(app, kiosks[:count])
+        gc.collect()
+        result.update({'kiosks': count, 'rss_mb': rss_mb(), 'tracked_kiosks': len(app.kiosk_next_medications)})
+        results.append(result)
+        print(
+            f"cycle {cycle + 1}: {count} kiosks, page {result['page_ms']:.1f} ms, push {result['push_ms']:.1f} ms "
+            f"({result['received']} next medication events), {result['rss_mb']:.1f} MB"
+        )
+    if app.kiosk_clients:
+        print(f"Error: {len(app.kiosk_clients)} clients still tracked after disconnecting.")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'baseline_mb': baseline, 'cycles': results}, f, indent=2)
+    temporary_folder.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark of the latency of a medication box recognition attempt.
+
+For every picture of a folder it compares the previous path (JPEG encode, write to disk,
+OCR on the file path, which decodes it again) with the in-memory path (OCR on the
+captured array). With --skip-ocr only the disk round trip is measured, without PaddleOCR.
+
+Usage (from the benchmarks folder):
+    python3 ocr_attempt_latency.py fixtures/boxes
+"""
+# Import all the needed libraries
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import cv2
+
+
+def measure_attempts(frames, run_ocr, repetitions):
+    """
+    Measure the attempts on disk and in memory.
+
+    Args:
+        frames (list): The pictures of the medication boxes.
+        run_ocr (callable or None): The OCR function, taking a path or an array; None to measure only the disk round trip.
+        repetitions (int): The number of measurements of every picture.
+
+    Returns:
+        dict: The median latency in milliseconds of the two paths.
+    """
+    folder = tempfile.mkdtemp()
+    image_path = os.path.join(folder, 'medication.jpg')
+    on_disk = []
+    in_memory = []
+    for frame in frames:
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            cv2.imwrite(image_path, frame)
+            if run_ocr is None:
+                cv2.imread(image_path)
+            else:
+                run_ocr(image_path)
+            on_disk.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            if run_ocr is not None:
+                run_ocr(frame)
+            in_memory.append((time.perf_counter() - start) * 1000)
+    os.remove(image_path)
+    os.rmdir(folder)
+    return {'on_disk_ms': statistics.median(on_disk), 'in_memory_ms': statistics.median(in_memory)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of a recognition attempt with and without the disk round trip")
+    parser.add_argument('pictures', help="folder with the pictures of the medication boxes")
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--skip-ocr', action='store_true', help="measure only the JPEG encode, write and decode")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    frames = [
+        cv2.imread(os.path.join(args.pictures, file_name)) for file_name in sorted(os.listdir(args.pictures))
+        if file_name.lower().endswith(('.jpg', '.jpeg', '.png'))
+    ]
+    run_ocr = None
+    if not args.skip_ocr:
+        from paddleocr import PaddleOCR
+        run_ocr = PaddleOCR(lang='it', show_log=False).ocr
+    results = measure_attempts(frames, run_ocr, args.repetitions)
+    print(f"{len(frames)} pictures, median latency per attempt:")
+    print(f"  on disk   {results['on_disk_ms']:8.1f} ms")
+    print(f"  in memory {results['in_memory_ms']:8.1f} ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
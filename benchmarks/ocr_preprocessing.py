@@ -0,0 +1,121 @@
+"""
+Benchmark of the preprocessing stages in front of PaddleOCR.
+
+Every picture of the fixture folder (named '<medication>_<anything>.jpg', e.g.
+'tachipirina_01.jpg') is read with every mode of the box reader, plus the previous
+behaviour (the whole frame at full resolution). For every mode it reports the CPU
+latency of a reading and the accuracy, the fraction of pictures whose box is recognized
+as the medication in the file name among all the medications of the fixtures.
+With --skip-ocr only the cost of the text region search is measured, without PaddleOCR.
+
+Usage (from the benchmarks folder):
+    python3 ocr_preprocessing.py fixtures/boxes
+"""
+# Import all the needed libraries
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import cv2
+
+sys.path.insert(0, '../web_application')
+from box_reader import OCR_MODES, BoxReader, find_text_regions
+from medication_matcher import MedicationMatcher
+
+
+def load_fixtures(folder):
+    """
+    Load the pictures of the medication boxes.
+
+    Args:
+        folder (str): The folder with the '<medication>_<anything>' pictures.
+
+    Returns:
+        list: The (file name, medication, frame) of every picture.
+    """
+    fixtures = []
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        frame = cv2.imread(os.path.join(folder, file_name))
+        if frame is not None:
+            fixtures.append((file_name, file_name.rsplit('_', 1)[0], frame))
+    return fixtures
+
+
+def measure_reader(reader, fixtures, matcher, repetitions):
+    """
+    Measure the latency and the accuracy of a box reader.
+
+    Args:
+        reader (BoxReader): The box reader.
+        fixtures (list): The (file name, medication, frame) of every picture.
+        matcher (MedicationMatcher): The matcher of the medications of the fixtures.
+        repetitions (int): The number of measurements of every picture.
+
+    Returns:
+        dict: The median and 95th percentile latency in milliseconds, the accuracy and the outcome of every picture.
+    """
+    latencies = []
+    pictures = []
+    for file_name, medication, frame in fixtures:
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            lines = reader.read_lines(frame)
+            latencies.append((time.perf_counter() - start) * 1000)
+        result = matcher.recognize(lines, medication)
+        pictures.append({'file': file_name, 'outcome': result['outcome'], 'score': result['score'], 'lines': lines})
+    correct = sum(picture['outcome'] == 'correct' for picture in pictures)
+    return {
+        'median_ms': statistics.median(latencies),
+        'p95_ms': statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0],
+        'accuracy': correct / len(pictures),
+        'pictures': pictures
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU latency and accuracy of the OCR preprocessing stages")
+    parser.add_argument('fixtures', help="folder with the '<medication>_<anything>.jpg' pictures")
+    parser.add_argument('--modes', nargs='+', default=['original', *OCR_MODES], choices=['original', *OCR_MODES])
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--skip-ocr', action='store_true', help="measure only the search of the text regions")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        print("Error: No pictures found.")
+        return
+    if args.skip_ocr:
+        latencies = []
+        for _, _, frame in fixtures:
+            for _ in range(args.repetitions):
+                start = time.perf_counter()
+                find_text_regions(frame)
+                latencies.append((time.perf_counter() - start) * 1000)
+        results = {'regions_median_ms': statistics.median(latencies)}
+        print(f"{len(fixtures)} pictures, median text region search {results['regions_median_ms']:.1f} ms")
+    else:
+        from paddleocr import PaddleOCR
+        ocr_model = PaddleOCR(lang='it', show_log=False)
+        matcher = MedicationMatcher([medication for _, medication, _ in fixtures])
+        results = {}
+        for mode in args.modes:
+            # the previous behaviour: the whole frame, as captured
+            reader = BoxReader(ocr_model, 'full', max_side=100000) if mode == 'original' else BoxReader(ocr_model, mode)
+            results[mode] = measure_reader(reader, fixtures, matcher, args.repetitions)
+        print(f"{len(fixtures)} pictures:")
+        for mode, mode_results in results.items():
+            print(
+                f"{mode:>9}: median {mode_results['median_ms']:7.1f} ms, p95 {mode_results['p95_ms']:7.1f} ms, "
+                f"accuracy {mode_results['accuracy']:.0%}"
+            )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark of the stalls of the main process while the medication boxes are read.
+
+A thread of the benchmark ticks every few milliseconds, like the loop reading the
+microphone, while the pictures of a folder are read by the box reader in the same
+process and then by the OCR worker process. For both it reports the latency of a reading
+and the gaps between the ticks: in the same process the inference holds the GIL and the
+gaps grow, with the worker they stay close to the tick interval.
+
+Usage (from the benchmarks folder):
+    python3 ocr_worker_stall.py fixtures/boxes
+"""
+# Import all the needed libraries
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, '../web_application')
+from box_reader import BoxReader
+from ocr_worker import OCRWorker
+from ocr_preprocessing import load_fixtures
+
+
+class Ticker:
+    """
+    Thread recording the gaps between ticks that should be `interval` seconds apart.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.gaps = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self.gaps.append((now - last) * 1000)
+            last = now
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def measure(reader, fixtures, repetitions, interval):
+    """
+    Read every picture while the ticker runs.
+
+    Args:
+        reader (BoxReader or OCRWorker): The box reader.
+        fixtures (list): The (file name, medication, frame) of every picture.
+        repetitions (int): The number of readings of every picture.
+        interval (float): The tick interval in seconds.
+
+    Returns:
+        dict: The median reading latency and the median, 99th percentile and maximum tick gap in milliseconds.
+    """
+    latencies = []
+    with Ticker(interval) as ticker:
+        for _, _, frame in fixtures:
+            for _ in range(repetitions):
+                start = time.perf_counter()
+                reader.read_lines(frame)
+                latencies.append((time.perf_counter() - start) * 1000)
+    gaps = ticker.gaps
+    return {
+        'median_ms': statistics.median(latencies),
+        'gap_median_ms': statistics.median(gaps),
+        'gap_p99_ms': statistics.quantiles(gaps, n=100)[-1] if len(gaps) > 1 else gaps[0],
+        'gap_max_ms': max(gaps)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stalls of the main process while reading the medication boxes")
+    parser.add_argument('folder', help="folder with the pictures of the medication boxes")
+    parser.add_argument('--mode', default='roi', help="preprocessing mode of the box reader")
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--interval', type=float, default=0.01, help="tick interval in seconds")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    fixtures = load_fixtures(args.folder)
+    if not fixtures:
+        print(f"Error: No pictures found in {args.folder}.")
+        sys.exit(1)
+    from paddleocr import PaddleOCR
+    results = {}
+    results['in-process'] = measure(BoxReader(PaddleOCR(lang='it'), mode=args.mode), fixtures, args.repetitions, args.interval)
+    worker = OCRWorker({'mode': args.mode}).start()
+    try:
+        results['worker'] = measure(worker, fixtures, args.repetitions, args.interval)
+    finally:
+        worker.stop()
+    for name, result in results.items():
+        print(
+            f"{name}: reading {result['median_ms']:.0f} ms, tick gaps median {result['gap_median_ms']:.1f} ms, "
+            f"p99 {result['gap_p99_ms']:.1f} ms, max {result['gap_max_ms']:.1f} ms"
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark of the cold start of the application.
+
+The application is started as a separate process and polled until the main page is
+rendered (time to first page) and until the assistant is listening (time to listening,
+read from the /status endpoint), together with the loading time of every module. With
+--sequential the modules are loaded one after another, as before the startup orchestrator.
+
+Usage (from the benchmarks folder):
+    python3 startup_time.py --runs 3
+"""
+# Import all the needed libraries
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def poll(url, timeout):
+    """
+    Get a page, returning None instead of raising if the server is not ready yet.
+
+    Args:
+        url (str): The URL of the page.
+        timeout (float): The timeout of the request in seconds.
+
+    Returns:
+        bytes or None: The body of the page, None if the request failed.
+    """
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.read()
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return None
+
+
+def measure_startup(base_url, env, timeout, interval=0.02):
+    """
+    Start the application and measure its startup milestones.
+
+    Args:
+        base_url (str): The URL the application listens on.
+        env (dict): The environment of the application process.
+        timeout (float): The maximum number of seconds to wait for the assistant to listen.
+        interval (float, optional): The polling interval in seconds. Defaults to 0.02.
+
+    Returns:
+        dict: The seconds to the first page and to listening (None if not reached), and the status of the modules.
+    """
+    start = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, 'app.py'], cwd='../web_application', env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    first_page = None
+    listening = None
+    status = {}
+    try:
+        while time.monotonic() - start < timeout and process.poll() is None:
+            if first_page is None:
+                if poll(base_url + '/', 1.0) is not None:
+                    first_page = time.monotonic() - start
+            else:
+                body = poll(base_url + '/status', 1.0)
+                if body is not None:
+                    status = json.loads(body)
+                    if 'listening' in status['milestones']:
+                        listening = time.monotonic() - start
+                        break
+                    if any(component['state'] == 'failed' for component in status['components'].values()):
+                        break
+            time.sleep(interval)
+    finally:
+        process.terminate()
+        process.wait()
+    return {'first_page_s': first_page, 'listening_s': listening, 'status': status}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to first page and time to listening of the application")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--timeout', type=float, default=180.0)
+    parser.add_argument('--sequential', action='store_true', help="load the modules one after another")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    env = dict(os.environ)
+    if args.sequential:
+        env['STARTUP_WORKERS'] = '1'
+    runs = [measure_startup(args.url, env, args.timeout) for _ in range(args.runs)]
+    for index, run in enumerate(runs):
+        components = ', '.join(
+            f"{name} {component['state']}" + (f" {component['seconds']:.1f} s" if component['seconds'] is not None else '')
+            for name, component in run['status'].get('components', {}).items()
+        )
+        first_page, listening = (
+            f"{run[milestone]:.2f} s" if run[milestone] is not None else "not reached"
+            for milestone in ('first_page_s', 'listening_s')
+        )
+        print(f"run {index + 1}: first page {first_page}, listening {listening} ({components})")
+    results = {'sequential': args.sequential, 'runs': runs}
+    for milestone in ('first_page_s', 'listening_s'):
+        values = [run[milestone] for run in runs if run[milestone] is not None]
+        results[f'median_{milestone}'] = statistics.median(values) if values else None
+        print(f"median {milestone[:-2].replace('_', ' ')}: " + (f"{results[f'median_{milestone}']:.2f} s" if values else "not reached"))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark of the caregivers notification fan-out against the local Telegram stub.
+
+It compares the previous implementation (a new connection per caregiver, one after the
+other) with the shared client (pooled keep-alive connections, concurrent sends).
+
+Usage (from the benchmarks folder):
+    python3 telegram_fanout.py --caregivers 1 2 4 8 --delay 0.1
+"""
+# Import all the needed libraries
+import argparse
+import json
+import statistics
+import sys
+import time
+import requests
+
+sys.path.insert(0, '../web_application')
+from telegram_client import TelegramBotClient
+from telegram_stub import start_stub_server
+
+TOKEN = 'BENCHMARK_TOKEN'
+
+
+def sequential_fanout(base_url, chat_ids, text):
+    """
+    Send the message as the app did before the shared client: one new connection per caregiver, in sequence.
+
+    Args:
+        base_url (str): The URL of the Bot API.
+        chat_ids (list): The chat IDs to send the message to.
+        text (str): The message to be sent.
+    """
+    for chat_id in chat_ids:
+        requests.get(f"{base_url}/bot{TOKEN}/sendMessage?chat_id={chat_id}&parse_mode=Markdown&text={text}").json()
+    return
+
+
+def measure(function, repetitions):
+    """
+    Measure the median wall time of a function.
+
+    Args:
+        function (callable): The function to be measured.
+        repetitions (int): The number of measurements.
+
+    Returns:
+        float: The median wall time in milliseconds.
+    """
+    times = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caregivers notification fan-out benchmark")
+    parser.add_argument('--caregivers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--delay', type=float, default=0.1, help="latency of the stub API in seconds")
+    parser.add_argument('--repetitions', type=int, default=5)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    server = start_stub_server(delay=args.delay)
+    client = TelegramBotClient(TOKEN, server.url, max_workers=max(args.caregivers))
+    text = "/sendhelp<Lucia>"
+    results = []
+    print(f"{'caregivers':>10} {'sequential (ms)':>16} {'shared client (ms)':>19}")
+    for caregivers in args.caregivers:
+        chat_ids = [str(1000 + i) for i in range(caregivers)]
+        sequential = measure(lambda: sequential_fanout(server.url, chat_ids, text), args.repetitions)
+        concurrent = measure(lambda: client.broadcast(chat_ids, text), args.repetitions)
+        results.append({'caregivers': caregivers, 'sequential_ms': sequential, 'shared_client_ms': concurrent})
+        print(f"{caregivers:>10} {sequential:16.1f} {concurrent:19.1f}")
+    server.shutdown()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
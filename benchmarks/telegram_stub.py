@@ -0,0 +1,115 @@
+"""
+Local stub of the Telegram Bot API, used to test and benchmark the notifications offline.
+
+It answers 'sendMessage' and 'getUpdates' for any bot token, optionally after a fixed
+delay and failing a fraction of the requests, and records every message it receives.
+Point the app to it with TELEGRAM_API_URL=http://127.0.0.1:<port>.
+
+Usage (from the benchmarks folder):
+    python3 telegram_stub.py --port 8081 --delay 0.2
+"""
+# Import all the needed libraries
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class TelegramStubHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the stub, the configuration is read from the server.
+    """
+
+    protocol_version = 'HTTP/1.1' # keep-alive, as the real API
+
+    def setup(self):
+        super().setup()
+        # answer without waiting for the delayed ACK of the client, as production servers do
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        return
+
+    def _params(self):
+        params = parse_qs(urlparse(self.path).query)
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            params.update(parse_qs(self.rfile.read(length).decode('utf-8')))
+        return {key: values[0] for key, values in params.items()}
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        params = self._params()
+        method = urlparse(self.path).path.rsplit('/', 1)[-1]
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if random.random() < self.server.failure_rate:
+            self._reply(502, {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'})
+            return
+        if method == 'sendMessage':
+            with self.server.lock:
+                self.server.messages.append(params)
+                message_id = len(self.server.messages)
+            self._reply(200, {'ok': True, 'result': {'message_id': message_id, 'chat': {'id': params.get('chat_id')}, 'text': params.get('text')}})
+        elif method == 'getUpdates':
+            offset = int(params.get('offset', 0))
+            limit = int(params.get('limit', 100))
+            updates = [update for update in self.server.updates if update['update_id'] >= offset][:limit]
+            self._reply(200, {'ok': True, 'result': updates})
+        else:
+            self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+def start_stub_server(port=0, delay=0.0, failure_rate=0.0, updates=None):
+    """
+    Start the stub server in a background thread.
+
+    Args:
+        port (int, optional): The port to listen on, 0 picks a free one. Defaults to 0.
+        delay (float, optional): Seconds waited before answering each request. Defaults to 0.0.
+        failure_rate (float, optional): Fraction of the requests answered with an error. Defaults to 0.0.
+        updates (list, optional): The updates returned by 'getUpdates'. Defaults to None (no updates).
+
+    Returns:
+        ThreadingHTTPServer: The running server, its 'messages' attribute lists the received
+            messages and its 'url' attribute is the base URL to be used by the clients.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), TelegramStubHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.failure_rate = failure_rate
+    server.updates = updates or []
+    server.messages = []
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stub of the Telegram Bot API")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds waited before answering each request")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of the requests answered with an error")
+    args = parser.parse_args()
+    server = start_stub_server(args.port, args.delay, args.failure_rate)
+    print(f"Telegram stub listening on {server.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,85 @@
+"""
+Benchmark of the text-to-speech backends.
+
+For every text that the assistant can speak it reports the time to the first audio chunk
+(when playback can start) and the time to the whole audio, bypassing the phrase cache.
+
+Usage (from the benchmarks folder):
+    python3 tts_latency.py --backends gtts espeak
+"""
+# Import all the needed libraries
+import argparse
+import json
+import statistics
+import sys
+import time
+
+sys.path.insert(0, '../web_application')
+from patient_registry import PatientRegistry
+from therapy_plan_store import TherapyPlanStore
+from tts_backends import TTS_BACKENDS, get_tts_backend
+import prompts
+
+
+def get_benchmark_prompts():
+    """
+    Get every text of the app for the registered patient, with one and with two caregivers.
+
+    Returns:
+        list: The texts without duplicates.
+    """
+    registry = PatientRegistry('../patient_registry.csv', '../therapy_plan')
+    kiosks = registry.kiosks()
+    name = registry.get(registry.patient_for_kiosk(kiosks[0]))['name'] if kiosks else 'Lucia'
+    therapy_plan_store = TherapyPlanStore()
+    texts = []
+    for chat_ids in (['caregiver'], ['caregiver_1', 'caregiver_2']):
+        texts += prompts.get_all_prompts({'name': name, 'chat_ids': chat_ids}, therapy_plan_store)
+    return list(dict.fromkeys(texts))
+
+
+def measure(backend, text):
+    """
+    Measure the synthesis latency of a text.
+
+    Args:
+        backend (TTSBackend): The backend to be measured.
+        text (str): The text to be synthesized.
+
+    Returns:
+        tuple: The time to the first chunk and the time to the whole audio, in milliseconds.
+    """
+    start = time.perf_counter()
+    first_chunk = None
+    for _ in backend.stream(text):
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return first_chunk * 1000, total * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time-to-first-audio benchmark of the TTS backends")
+    parser.add_argument('--backends', nargs='+', default=list(TTS_BACKENDS), choices=list(TTS_BACKENDS))
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+    texts = get_benchmark_prompts()
+    results = {}
+    for name in args.backends:
+        backend = get_tts_backend(name)
+        results[name] = []
+        print(f"\n{name}")
+        print(f"{'first audio (ms)':>17} {'total (ms)':>11}  text")
+        for text in texts:
+            first_chunk, total = measure(backend, text)
+            results[name].append({'text': text, 'first_audio_ms': first_chunk, 'total_ms': total})
+            print(f"{first_chunk:17.1f} {total:11.1f}  {text[:60]}")
+        first_chunks = [result['first_audio_ms'] for result in results[name]]
+        print(f"median time to first audio: {statistics.median(first_chunks):.1f} ms, max: {max(first_chunks):.1f} ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,10 @@ from dotenv import load_dotenv
 from telethon import TelegramClient, events
 import asyncio
 import re
+import sys
+
+sys.path.append('../web_application')
+from chat_id_registry import ChatIdRegistry
 
 load_dotenv()
 API_KEY = os.getenv("API_KEY")
@@ -11,6 +15,7 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 SESSION_NAME = os.getenv("SESSION_NAME")
 
 client = TelegramClient(SESSION_NAME, API_KEY, API_HASH)
+chat_id_registry = ChatIdRegistry()
 italian_days = {
     "monday": "Lunedì",
     "tuesday": "Martedì",
@@ -31,11 +36,14 @@ async def main():
     @client.on(events.NewMessage(pattern="/start"))
     async def handler(event):
         """
-        Handle the /start command by sending a welcome message.
+        Handle the /start command by registering the chat ID of the caregiver and sending a welcome message.
 
         Args:
             event (telethon.events.NewMessage.Event): The event object containing message details.
         """
+        sender = await event.get_sender()
+        if sender is not None and sender.username:
+            chat_id_registry.register(sender.username, event.chat_id)
         await event.respond("Welcome to the patient helper!")
 
     @client.on(events.NewMessage(pattern="/help"))
@@ -65,7 +73,7 @@ async def main():
         await asyncio.sleep(1)
         await event.respond(f"{patient_name} ha bisogno del tuo aiuto!\nMettiti in contatto il prima possible!")
     
-    @client.on(events.NewMessage(pattern="/sendrecap<([a-zA-Z' ]+)><(bene|male)><(monday|tuesday|wednesday|thursday|friday|saturday|sunday)-([01]?[0-9]|2[0-3]):([0-5][0-9])>"))
+    @client.on(events.NewMessage(pattern="/sendrecap<([a-zA-Z' ]+)><(bene|male)><(monday|tuesday|wednesday|thursday|friday|saturday|sunday)-([01]?[0-9]|2[0-3]):([0-5][0-9])>(?:<([^<>]+)>)?"))
     async def handler(event):
         """
         Handle the /sendrecap command by sending a recap of the patient's medication and feelings.
@@ -75,7 +83,7 @@ async def main():
         """
         msg = event.message.text
         await event.delete()
-        pattern = r"/sendrecap<([a-zA-Z' ]+)><(bene|male)><(monday|tuesday|wednesday|thursday|friday|saturday|sunday)-([01]?[0-9]|2[0-3]):([0-5][0-9])>"
+        pattern = r"/sendrecap<([a-zA-Z' ]+)><(bene|male)><(monday|tuesday|wednesday|thursday|friday|saturday|sunday)-([01]?[0-9]|2[0-3]):([0-5][0-9])>(?:<([^<>]+)>)?"
         match = re.match(pattern, msg)
         if match:
             patient_name = match.group(1)
@@ -84,8 +92,11 @@ async def main():
             hour = match.group(4)
             minute = match.group(5)
             image_path = f'../medications/{match.group(3)}'
+            wrong_boxes = match.group(6)
         await asyncio.sleep(1)
         await event.respond(f"Ecco il recap per {patient_name}.\nSi sente {feeling}.\n{day} alle {hour}:{minute} ha preso i seguenti farmaci:")
+        if wrong_boxes:
+            await event.respond(f"Prima di trovare la scatola corretta ha mostrato: {wrong_boxes}.")
         for img in os.listdir(image_path):
             await client.send_file(event.chat_id, f"{image_path}/{img}", caption=img.split(".")[0])
 
@@ -0,0 +1,198 @@
+# Import all the needed libraries
+import datetime
+import sqlite3
+import threading
+import time
+
+# The kinds of the events of a dose dialogue
+DOSE_START = 'dose_start'
+FEELING = 'feeling'
+CONFIRMATION = 'confirmation'
+HELP = 'help'
+OCR_ATTEMPT = 'ocr_attempt'
+TAKEN = 'taken'
+DOSE_END = 'dose_end'
+MISSED = 'missed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    at REAL NOT NULL,
+    patient_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    session TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    medication TEXT,
+    outcome TEXT,
+    score REAL,
+    latency_ms REAL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS events_patient_day ON events (patient_id, date, medication, kind, outcome, score, latency_ms, session);
+"""
+
+MEDICATIONS_QUERY = """
+SELECT date, medication,
+       SUM(kind IN ('dose_start', 'missed')) AS scheduled,
+       SUM(kind = 'taken') AS taken,
+       SUM(kind = 'missed') AS missed,
+       SUM(kind = 'ocr_attempt') AS ocr_attempts,
+       SUM(kind = 'ocr_attempt' AND outcome = 'wrong') AS wrong_boxes,
+       SUM(kind = 'ocr_attempt' AND outcome = 'unreadable') AS unreadable_boxes,
+       AVG(CASE WHEN kind = 'ocr_attempt' THEN score END) AS ocr_score,
+       AVG(CASE WHEN kind = 'ocr_attempt' THEN latency_ms END) AS ocr_latency_ms
+FROM events
+WHERE patient_id = ? AND date BETWEEN ? AND ? AND medication IS NOT NULL {medication}
+GROUP BY date, medication
+ORDER BY date, medication
+"""
+
+DAYS_QUERY = """
+SELECT date,
+       COUNT(DISTINCT CASE WHEN kind = 'dose_start' THEN session END) AS doses,
+       COUNT(DISTINCT CASE WHEN kind = 'dose_end' THEN session END) AS completed_doses,
+       COUNT(DISTINCT CASE WHEN kind = 'missed' THEN session END) AS missed_doses,
+       SUM(kind = 'feeling' AND outcome = 'bene') AS feeling_good,
+       SUM(kind = 'feeling' AND outcome = 'male') AS feeling_bad,
+       SUM(kind = 'confirmation' AND outcome = 'yes') AS help_accepted,
+       SUM(kind = 'help') AS help_requests
+FROM events
+WHERE patient_id = ? AND date BETWEEN ? AND ?
+GROUP BY date
+ORDER BY date
+"""
+
+
+class AdherenceLog:
+    """
+    Append-only log of the events of the dose dialogues.
+
+    Every event (the start of a dose, the feeling of the patient, the answer to the help
+    offer, the help requests, every box recognition attempt with its score and latency,
+    the medications taken, the end of a dose and the doses missed, never started) is a row
+    of a SQLite table, indexed by patient, day and medication so that months of history
+    are aggregated with a scan of the index of a single patient.
+    """
+
+    def __init__(self, path='../adherence.db'):
+        """
+        Initialize the log, creating the database if needed.
+
+        Args:
+            path (str, optional): The path of the SQLite database. Defaults to '../adherence.db'.
+        """
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def record(self, patient_id, dose, kind, medication=None, outcome=None, score=None, latency_ms=None, detail=None):
+        """
+        Append an event to the log.
+
+        Args:
+            patient_id (str): The patient ID.
+            dose (dict or None): The dose of the event (its 'date' and 'time'), None outside of a dose.
+            kind (str): The kind of event (e.g. OCR_ATTEMPT).
+            medication (str, optional): The medication of the event. Defaults to None.
+            outcome (str, optional): The outcome (e.g. the feeling or the recognition outcome). Defaults to None.
+            score (float, optional): The score of a recognition. Defaults to None.
+            latency_ms (float, optional): The latency of a recognition in milliseconds. Defaults to None.
+            detail (str, optional): Any other information (e.g. the medication of a wrong box). Defaults to None.
+        """
+        now = time.time()
+        if dose is not None:
+            date, session = dose['date'], f"{dose['date']} {dose['time']}"
+        else:
+            date, session = datetime.date.today().isoformat(), ''
+        self.record_many([(now, patient_id or '', date, session, kind, medication, outcome, score, latency_ms, detail)])
+
+    def record_missed(self, patient_id, dose):
+        """
+        Append a missed dose to the log, with an event for every medication, so that it counts as
+        scheduled and not taken.
+
+        Args:
+            patient_id (str): The patient ID.
+            dose (dict): The missed dose (its 'date', 'time' and 'medications').
+        """
+        now = time.time()
+        session = f"{dose['date']} {dose['time']}"
+        self.record_many([
+            (now, patient_id or '', dose['date'], session, MISSED, medication, None, None, None, None)
+            for medication, _ in dose['medications']
+        ])
+
+    def record_many(self, events):
+        """
+        Append many events in a single transaction (e.g. to import the history).
+
+        Args:
+            events (list): The (timestamp, patient ID, date, session, kind, medication, outcome,
+                score, latency in milliseconds, detail) of every event.
+        """
+        with self._lock:
+            self._connection.execute('BEGIN')
+            self._connection.executemany(
+                'INSERT INTO events (at, patient_id, date, session, kind, medication, outcome, score, latency_ms, detail) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                events
+            )
+            self._connection.execute('COMMIT')
+
+    def dose_history(self, since):
+        """
+        Get the doses started or missed since a day, e.g. so that a restarted scheduler does not
+        return them again.
+
+        Args:
+            since (str): The first day, in 'YYYY-MM-DD' format.
+
+        Returns:
+            list: The (patient ID, 'YYYY-MM-DD', 'HH:MM') of every dose, the patient ID None for the
+                doses without a patient.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT patient_id, session FROM events WHERE date >= ? AND kind IN (?, ?) AND session != ''",
+                (since, DOSE_START, MISSED)
+            ).fetchall()
+        return [(patient_id or None, *session.split(' ')) for patient_id, session in rows]
+
+    def aggregate(self, patient_id, start, end, medication=None):
+        """
+        Aggregate the adherence of a patient per day and per medication.
+
+        Args:
+            patient_id (str): The patient ID.
+            start (str): The first day, in 'YYYY-MM-DD' format.
+            end (str): The last day, in 'YYYY-MM-DD' format.
+            medication (str, optional): Only this medication. Defaults to None (all the medications).
+
+        Returns:
+            dict: The 'days' (doses started and missed, feelings and help requests of every day), the
+                'medications' (doses scheduled, taken and missed and recognition attempts of every day
+                and medication) and the 'totals' of every medication with its 'adherence', the fraction
+                of the scheduled doses taken, the missed ones included.
+        """
+        parameters = [patient_id, start, end]
+        if medication is not None:
+            parameters.append(medication)
+        with self._lock:
+            cursor = self._connection.execute(
+                MEDICATIONS_QUERY.format(medication='AND medication = ?' if medication is not None else ''), parameters
+            )
+            columns = [column[0] for column in cursor.description]
+            medications = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            cursor = self._connection.execute(DAYS_QUERY, (patient_id, start, end))
+            columns = [column[0] for column in cursor.description]
+            days = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        totals = {}
+        for row in medications:
+            total = totals.setdefault(row['medication'], {'scheduled': 0, 'taken': 0, 'missed': 0, 'ocr_attempts': 0, 'wrong_boxes': 0})
+            for key in total:
+                total[key] += row[key]
+        for total in totals.values():
+            total['adherence'] = total['taken'] / total['scheduled'] if total['scheduled'] else None
+        return {'days': days, 'medications': medications, 'totals': totals}
@@ -1,209 +1,207 @@
 # Import all the needed libraries
-from flask import Flask, render_template, jsonify
-import pandas as pd
+from flask import Flask, Response, render_template, jsonify, request, abort, make_response
+from markupsafe import Markup
 import datetime
-from vosk import Model, KaldiRecognizer
-import pyaudio
-from gtts import gTTS
-from io import BytesIO
-from pygame import mixer
 import time
-from paddleocr import PaddleOCR
-import cv2
-from thefuzz import fuzz
-import requests
 from dotenv import load_dotenv
 import os
 import threading
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+from patient_registry import PatientRegistry
+from tts_cache import TTSCache
+from tts_backends import get_tts_backend
+from audio_player import AudioPlayer
+from audio_capture import MicrophoneSource, WavFileSource, SpeechListener
+from speech_decoders import UtteranceDecoder, KeywordSpotter
+from telegram_client import TelegramBotClient, escape_markdown
+from chat_id_registry import ChatIdRegistry
+from medication_matcher import MedicationMatcher
+from notification_outbox import NotificationOutbox, PRIORITY_HELP, PRIORITY_RECAP
+import prompts
+from startup import StartupOrchestrator
+from dose_scheduler import DoseScheduler
+from adherence_log import AdherenceLog
+from stage_metrics import StageMetrics
+from page_cache import PageCache
+from dialogue import DialogueEffects, DialogueMachine, run_dialogue
 
 ### MULTIMODAL INTERACTION ###
 
-def setup_speech_recognition():
+def setup_speech_recognition(source=None):
     """
-    Setup the speech recognition module by loading the model and creating a recognizer.
+    Setup the speech recognition module by loading the model, creating the decoder and
+    starting the continuous audio capture. The audio is read from the microphone, or from
+    the WAV file in the AUDIO_SOURCE environment variable if set. By default only the
+    keywords of each dialogue state are spotted, setting SPEECH_MODE to 'free' recognizes
+    whole utterances instead.
+
+    Args:
+        source (optional): The audio source (e.g. a scripted source of a benchmark). Defaults to
+            None (the microphone or the AUDIO_SOURCE file).
     
     Returns:
-        tuple: A tuple containing the recognizer and the audio stream.
+        SpeechListener: The speech listener, initially paused.
     """
+    # vosk is imported only when the model is loaded, so that it does not delay the web interface
+    from vosk import Model, KaldiRecognizer
     model = Model("../model/vosk-model-small-it-0.22")
-    recognizer = KaldiRecognizer(model, 16000)
-    mic = pyaudio.PyAudio()
-    stream = mic.open(
-        format=pyaudio.paInt16,
-        channels=1,
-        rate=16000,
-        input=True,
-        frames_per_buffer=8192
-    )
-    return recognizer, stream
+    if os.getenv("SPEECH_MODE", "keywords") == "free":
+        decoder = UtteranceDecoder(KaldiRecognizer(model, 16000))
+    else:
+        decoder = KeywordSpotter(model, 16000)
+    if source is None:
+        wav_path = os.getenv("AUDIO_SOURCE")
+        source = WavFileSource(wav_path) if wav_path else MicrophoneSource()
+    on_result = lambda text, seconds: stage_metrics.observe('asr_final', seconds, text=text)
+    return SpeechListener(decoder, source, on_result=on_result).start()
 
 
 def setup_speech_synthesis():
     """
-    Setup the speech synthesis module by initializing the mixer.
+    Setup the speech synthesis module by initializing the mixer and starting the playback service.
     
     Returns:
-        pygame.mixer: The initialized mixer object.
+        AudioPlayer: The asynchronous audio player.
     """
+    from pygame import mixer
     mixer.init()
-    return mixer
+    return AudioPlayer(mixer)
 
 
 def setup_ocr():
     """
-    Setup the OCR module by initializing the PaddleOCR model for Italian language.
+    Setup the OCR module by initializing the PaddleOCR model for Italian language, behind the
+    preprocessing stage selected by the OCR_MODE, OCR_MAX_SIDE and OCR_TEXT_HEIGHT environment variables.
+    Unless OCR_PROCESS is 0 the model runs in a worker process, so that the inference does not
+    slow down the speech capture and the web interface. When MEMORY_MODE is 'low' the worker
+    process is always used, started only to read a box and stopped after OCR_IDLE_TIMEOUT seconds
+    without boxes, so that the model is not resident between the doses.
     
     Returns:
-        PaddleOCR: The initialized OCR model.
+        OCRWorker or BoxReader: The reader of the medication boxes.
     """
+    reader_options = {
+        'mode': os.getenv("OCR_MODE", "roi"),
+        'max_side': int(os.getenv("OCR_MAX_SIDE", "960")),
+        'text_height': int(os.getenv("OCR_TEXT_HEIGHT", "32"))
+    }
+    low_memory = os.getenv("MEMORY_MODE", "normal") == "low"
+    if os.getenv("OCR_PROCESS", "1") != "0" or low_memory:
+        from ocr_worker import OCRWorker
+        idle_timeout = float(os.getenv("OCR_IDLE_TIMEOUT", "120")) if low_memory else None
+        return OCRWorker(reader_options, timeout=float(os.getenv("OCR_TIMEOUT", "20")), idle_timeout=idle_timeout).start()
+    from paddleocr import PaddleOCR
+    from box_reader import BoxReader
     ocr_model = PaddleOCR(lang='it')
-    return ocr_model
+    return BoxReader(ocr_model, **reader_options)
 
 
-def recognize_speech(recognizer, stream):
+def setup_camera(source=None):
     """
-    Recognize speech from the audio stream.
-    
-    Args:
-        recognizer (KaldiRecognizer): The speech recognizer.
-        stream (pyaudio.Stream): The audio stream.
-    
-    Returns:
-        str or None: The recognized speech as a string, or None if no speech is recognized.
-    """
-    data = stream.read(4096)
-    if len(data) == 0:
-        return None
-    if recognizer.AcceptWaveform(data):
-        return recognizer.Result()[14:-3] # remove the first 14 characters and the last 3 characters, needed to remove the metadata
-    return None
-
+    Setup the camera module by starting the capture service. The frames are read from the
+    camera, or from the video file or the folder of images in the CAMERA_SOURCE environment
+    variable if set.
 
-def synthesize_speech(text):
-    """
-    Synthesize speech from the given text using Google Text-to-Speech.
-    
     Args:
-        text (str): The text to be synthesized.
-    
-    Returns:
-        BytesIO: The synthesized speech as an MP3 file stored in a BytesIO object.
-    """
-    mp3_fp = BytesIO()
-    tts = gTTS(text, lang='it')
-    tts.write_to_fp(mp3_fp)
-    return mp3_fp
-
-
-def play_speech(mixer, mp3_fp):
-    """
-    Play the synthesized speech from the given BytesIO object.
-    
-    Args:
-        mixer (pygame.mixer): The mixer object.
-        mp3_fp (BytesIO): The BytesIO object containing the MP3 file.
-    """
-    mp3_fp.seek(0)
-    mixer.music.load(mp3_fp)
-    mixer.music.play()
-    while mixer.music.get_busy():
-        time.sleep(0.1)
-    return
+        source (optional): The frame source (e.g. a scripted source of a benchmark). Defaults to
+            None (the CAMERA_SOURCE variable).
 
-
-def get_bot_data(bot_token):
-    """
-    Get data from the Telegram bot using the provided bot token.
-    
-    Args:
-        bot_token (str): The Telegram bot token.
-    
     Returns:
-        dict: The data received from the Telegram bot.
+        CameraService: The running camera service.
     """
-    url = f"https://api.telegram.org/bot{bot_token}/getUpdates"
-    response = requests.get(url)
-    data = response.json()
-    return data
+    from camera_service import CameraService
+    if source is None:
+        source = os.getenv("CAMERA_SOURCE", "0")
+    # the files are read at the pace of a camera, the devices at their own pace
+    fps = None if isinstance(source, str) and source.isdigit() else 15
+    with stage_metrics.span('camera_open'):
+        return CameraService(source, fps=fps).start()
 
 
-def get_chat_id(handle, data):
+def get_patient_data(patient_id):
     """
-    Get the chat ID for a specific Telegram handle from the bot data.
+    Get patient data from the patient registry and retrieve Telegram chat IDs for caregivers from the
+    chat ID registry (the bot updates are scanned only for the caregivers not yet known).
     
     Args:
-        handle (str): The Telegram handle.
-        data (dict): The data received from the Telegram bot.
-    
-    Returns:
-        str or None: The chat ID as a string, or None if not found.
-    """
-    for i in data['result']:
-        if 'message' in i.keys():
-            if i['message']['chat']['username'] == handle:
-                return str(i['message']['chat']['id'])
-
+        patient_id (str): The patient ID.
 
-def get_patient_data():
-    """
-    Get patient data from a CSV file and retrieve Telegram chat IDs for caregivers.
-    
     Returns:
         dict: A dictionary containing patient data and chat IDs of caregivers.
     """
-    df_registry = pd.read_csv('../patient_registry.csv')
-    load_dotenv()
-    BOT_TOKEN = os.getenv("BOT_TOKEN")  
-    bot_data = get_bot_data(BOT_TOKEN)
+    registered = patient_registry.get(patient_id)
+    if registered is None:
+        raise ValueError(f"The patient {patient_id} is not in the patient registry")
     patient = {}
-    patient['name'] = df_registry['name'][0]
-    patient['gender'] = df_registry['gender'][0]
-    patient['age'] = int(df_registry['age'][0])
-    handle_columns = [col for col in df_registry.columns if col.startswith('cg_handle_')]
-    handles = df_registry[handle_columns].values.flatten().tolist()
-    patient['chat_ids'] = []
-    for handle in handles:
-        patient['chat_ids'].append(get_chat_id(handle, bot_data))
+    patient['id'] = registered['id']
+    patient['name'] = registered['name']
+    patient['gender'] = registered['gender']
+    patient['age'] = registered['age']
+    patient['chat_ids'] = chat_id_registry.resolve(registered['handles'], telegram_client)
     return patient
 
 
-def get_therapy_plan(day):
+def get_therapy_plan(day, patient_id=None):
     """
-    Get the therapy plan for a specific day from a CSV file.
+    Get the therapy plan of a patient for a specific day from the therapy plan store.
     
     Args:
         day (str): The day of the week.
+        patient_id (str, optional): The patient ID. Defaults to None (the shared therapy plans).
     
     Returns:
         dict: A dictionary containing the therapy plan data.
     """
-    df_therapy_plan = pd.read_csv(f'../therapy_plan/therapy_plan_{day}.csv')
-    therapy_plan = {}
-    for _, row in df_therapy_plan.iterrows():
-        if not pd.isna(row['medication_1']): # meaning that the patient must take at least one medication at that time
-            medications_quantities = row.drop(['hour']).dropna().tolist()
-            therapy = [(x, y) for x, y in zip(medications_quantities[::2], medications_quantities[1::2])]
-            therapy_plan[row['hour']] = therapy
-    return therapy_plan
+    return patient_registry.get_store(patient_id).get_plan(day)
+
+
+def timed_chunks(chunks, stage):
+    """
+    Time the production of the first chunk of a stream of audio chunks.
+
+    Args:
+        chunks (iterable): The audio chunks.
+        stage (str): The name of the stage recorded in the stage metrics.
+
+    Yields:
+        bytes: The audio chunks.
+    """
+    start = time.perf_counter()
+    first = True
+    for chunk in chunks:
+        if first:
+            stage_metrics.observe(stage, time.perf_counter() - start)
+            first = False
+        yield chunk
 
 
-def speech_synthesis(text, mixer):
+def speech_synthesis(text, player, wait=True):
     """
-    Synthesize and play speech from the given text.
+    Synthesize and play speech from the given text, using the cached audio when available.
+    The time to the first audio chunk and the time until the speech ends are recorded in the stage metrics.
     
     Args:
         text (str): The text to be synthesized.
-        mixer (pygame.mixer): The mixer object for playing the synthesized speech.
+        player (AudioPlayer): The audio player for playing the synthesized speech.
+        wait (bool, optional): If True wait until the speech has been played. Defaults to True.
+
+    Returns:
+        concurrent.futures.Future: Resolved with True when the speech has been played to the end,
+            with False if it has been interrupted.
     """
-    mp3_fp = synthesize_speech(text)
-    play_speech(mixer, mp3_fp)
-    return
+    start = time.perf_counter()
+    future = player.say(timed_chunks(tts_cache.stream(text), 'tts_first_chunk'))
+    future.add_done_callback(lambda _: stage_metrics.observe('speech_playback', time.perf_counter() - start))
+    if wait:
+        future.result()
+    return future
 
 
 def send_telegram_message(bot_chat_id, bot_message):
-   """
-    Send a message to a Telegram chat using the bot token.
+    """
+    Send a message to a Telegram chat using the shared bot client.
     
     Args:
         bot_chat_id (str): The chat ID to send the message to.
@@ -212,218 +210,116 @@ def send_telegram_message(bot_chat_id, bot_message):
     Returns:
         dict: The response from the Telegram API.
     """
-   load_dotenv()
-   BOT_TOKEN = os.getenv("BOT_TOKEN") 
-   send_text = 'https://api.telegram.org/bot' + BOT_TOKEN + '/sendMessage?chat_id=' + bot_chat_id + '&parse_mode=Markdown&text=' + bot_message
-   response = requests.get(send_text)
-   return response.json()
+    return telegram_client.send_message(bot_chat_id, bot_message)
 
 
-def send_help_message(patient, mixer):
+def send_caregivers_message(patient, kind, bot_message, priority):
     """
-    Send a help message to the patient's caregivers and synthesize speech for confirmation.
-    
-    Args:
-        patient (dict): The patient data.
-        mixer (pygame.mixer): The mixer object for playing the synthesized speech.
-    """
-    has_multiple_caregivers = len(patient['chat_ids']) > 1
-    if has_multiple_caregivers:
-        text = f"{patient['name']} invio un messaggio ai tuoi caregiver."
-    else:
-        text = f"{patient['name']} invio  un messaggio al tuo caregiver."
-    speech_synthesis(text, mixer)
-    for chat_id in patient['chat_ids']:
-        send_telegram_message(chat_id, f"/sendhelp<{patient['name']}>")
-    if has_multiple_caregivers:
-        text = f"Okay {patient['name']}, ho inviato un messaggio ai tuoi caregiver, ti contatteranno al più presto."
-    else:
-        text = f"Okay {patient['name']}, ho inviato un messaggio al tuo caregiver, ti contatterà al più presto."
-    speech_synthesis(text, mixer)
-    return
-
+    Queue a message for all the caregivers of the patient, it is delivered in background by the outbox.
 
-def greet_patient(patient, mixer):
-    """
-    Greet the patient by name and ask how they are feeling.
-    
     Args:
         patient (dict): The patient data.
-        mixer (pygame.mixer): The mixer object for playing the synthesized speech.
-    """
-    text = f"Ciao {patient['name']}, come ti senti?"
-    speech_synthesis(text, mixer)
-    return
-
+        kind (str): The kind of message (e.g. 'help' or 'recap').
+        bot_message (str): The message to be sent.
+        priority (int): The priority of the message, lower values are delivered first.
 
-def speech_therapy_plan_info(patient, medications, mixer):
+    Returns:
+        list: The identifiers of the queued messages, one for each caregiver.
     """
-    Provide the patient with information about their therapy plan.
-    
-    Args:
-        patient (dict): The patient data.
-        medications (list): A list of medications to be taken.
-        mixer (pygame.mixer): The mixer object for playing the synthesized speech.
-    """
-    text = f"{patient['name']} è il momento di prendere i seguenti farmaci: "
-    for medication in medications:
-        text += medication[0] + ", "
-    speech_synthesis(text, mixer)
-    text = "Per ogni farmaco mi mostrerai la scatola e io ti dirò se è quella corretta;"
-    text += "nel caso in cui lo sia ti dirò quanto prenderne"
-    speech_synthesis(text, mixer)
-    return
+    # the caregivers that never contacted the bot have no chat ID yet
+    chat_ids = [chat_id for chat_id in patient['chat_ids'] if chat_id is not None]
+    return notification_outbox.enqueue(kind, chat_ids, bot_message, priority)
 
 
-def analyze_feelings(patient, feelings, mixer, stream, recognizer):
-    """
-    Analyze the patient's feelings and take appropriate action.
-    
-    Args:
-        patient (dict): The patient data.
-        feelings (str): The patient's stated feelings.
-        mixer (pygame.mixer): The mixer object for playing the synthesized speech.
-        stream (pyaudio.Stream): The audio stream.
-        recognizer (KaldiRecognizer): The speech recognizer.
-    
-    Returns:
-        str: The patient's feelings.
-    """
-    has_multiple_caregivers = len(patient['chat_ids']) > 1
-    if feelings.startswith("ben"):
-        socketio.emit('background_event_change', {'image': 'medication_happy_background.jpg'})
-        text = f"Bene {patient['name']}, sono contento di sentire che ti senti bene!"
-        speech_synthesis(text, mixer)
-        return "bene"
-    elif feelings.startswith("mal"):
-        socketio.emit('background_event_change', {'image': 'medication_sad_background.jpg'})
-        text = f"Mi dispiace {patient['name']}, spero tu ti senta meglio presto."
-        if has_multiple_caregivers:
-            text += "Vuoi inviare un messaggio di aiuto ai tuoi caregiver?"
-        else:
-            text += "Vuoi inviare un messaggio di aiuto al tuo caregiver?"
-        speech_synthesis(text, mixer)
-        while True:
-            speech = None
-            stream.start_stream()
-            while speech == None:
-                speech = recognize_speech(recognizer, stream)
-            stream.stop_stream()
-            if speech.startswith("sì"):
-                socketio.emit('background_event_change', {'image': 'alert_background.jpg'})
-                send_help_message(patient, mixer)
-                break
-            elif speech.startswith("no"):
-                break
-            else:
-                text = "Scusa non ho capito, potresti rispondermi con sì o no?"
-                speech_synthesis(text, mixer)
-        return "male"
-    else:
-        text = "Scusa non ho capito, potresti rispondermi con bene o male?"
-        speech_synthesis(text, mixer)
-        return ""
-    
-    
-def speech_medication_instructions(medication, mixer):
+def take_picture(camera):
     """
-    Provide verbal instructions for taking the medication.
+    Take a picture of the medication box, choosing the sharpest recent frame.
 
     Args:
-        medication (str): The name of the medication.
-        mixer (pygame.mixer): The mixer object for playing the synthesized speech.
+        camera (CameraService): The camera service.
+
+    Returns:
+        numpy.ndarray or None: The picture, or None if no frame could be captured.
     """
-    text = f"Prendi {medication}; quando sei pronto a farmi riconoscere la scatola dimmi foto."
-    speech_synthesis(text, mixer)
-    return
+    with stage_metrics.span('camera_frame'):
+        return camera.best_frame()
 
 
-def take_picture(today, medication):
+def save_picture(today, medication, frame):
     """
-    Take a picture of the medication box and save it.
+    Save the picture of the medication box in background, it is sent to the caregivers with the recap.
 
     Args:
         today (str): The current date.
         medication (str): The name of the medication.
+        frame (numpy.ndarray): The picture of the medication box.
+
+    Returns:
+        concurrent.futures.Future: Resolved when the picture has been written.
     """
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("Error: Could not open video capture device.")
-        return
-    ret, frame = cap.read()
-    cap.release()
-    if not ret:
-        print("Error: Could not read frame from video capture device.")
-        return
-    cv2.imwrite(f'../medications/{today}/{medication}.jpg', frame)
-    return
+    import cv2
+    return picture_writer.submit(cv2.imwrite, os.path.join(pictures_folder, today, f'{medication}.jpg'), frame)
 
 
-def recognize_medication(today, medication, ocr_model, threshold=80):
+def get_medication_matcher():
     """
-    Recognize the medication box using OCR.
+    Get the matcher of all the medications of the week of all the patients, built again only when
+    the therapy plans change.
 
-    Args:
-        today (str): The current day.
-        medication (str): The name of the medication.
-        ocr_model (PaddleOCR): The OCR model for text extraction.
-        threshold (int, optional): The threshold for text similarity. Defaults to 80.
-    
     Returns:
-        bool: True if the medication is recognized, False otherwise.
+        MedicationMatcher: The medication matcher.
     """
-    img_path = f'../medications/{today}/{medication}.jpg'
-    results = ocr_model.ocr(img_path)
-    if results != [None]:
-        for result in results:
-            for item in result:
-                predicted_name, _ = item[1]
-                predicted_name = predicted_name.lower()
-                if fuzz.partial_ratio(medication, predicted_name) >= threshold:
-                    return True
-    return False
+    global medication_matcher, medication_matcher_version
+    medications = patient_registry.get_medications()
+    if medication_matcher is None or medication_matcher_version != patient_registry.plans_version():
+        medication_matcher = MedicationMatcher(medications)
+        medication_matcher_version = patient_registry.plans_version()
+    return medication_matcher
 
 
-def get_medication_instructions(patient, quantity, mixer):
+def recognize_medication(frame, medication, box_reader, threshold=80):
     """
-    Provide verbal instructions for the correct medication and dosage.
+    Recognize the medication box using OCR, directly on the captured picture, comparing the
+    text read with all the medications of the week.
 
     Args:
-        patient (dict): The patient data.
-        quantity (str): The quantity of the medication to be taken.
-        mixer (pygame.mixer): The mixer object for playing the synthesized speech.
+        frame (numpy.ndarray or None): The picture of the medication box.
+        medication (str): The name of the medication that should be shown.
+        box_reader (BoxReader or OCRWorker): The reader of the text on the box.
+        threshold (int, optional): The threshold for text similarity. Defaults to 80.
+    
+    Returns:
+        dict: The recognition result, its 'outcome' is 'correct' if the box is of the expected
+            medication, 'wrong' if it is of another medication of the week (named in 'medication'),
+            'unreadable' otherwise.
     """
-    text = f"Bene {patient['name']} è la scatola corretta, devi prenderne {quantity}."
-    text += "Quando sei pronto a procedere con il prossimo farmaco pronuncia avanti"
-    speech_synthesis(text, mixer)
-    return
+    with stage_metrics.span('ocr', medication=medication):
+        lines = box_reader.read_lines(frame)
+    with stage_metrics.span('matching', medication=medication):
+        return get_medication_matcher().recognize(lines, medication, threshold)
 
 
-def goodbye_patient(patient, mixer):
+def recognize_box(medication):
     """
-    Say goodbye to the patient after all medications have been taken.
+    Take a picture of the medication box and recognize it, waiting for the camera and the ocr
+    modules if they are still loading.
 
     Args:
-        patient (dict): The patient data.
-        mixer (pygame.mixer): The mixer object for playing the synthesized speech.
+        medication (str): The name of the medication that should be shown.
+
+    Returns:
+        dict: The recognition result (see `recognize_medication`) with the picture in 'frame' and
+            the time spent reading it in 'latency_ms'.
     """
-    has_multiple_caregivers = len(patient['chat_ids']) > 1
-    text = f"Bene {patient['name']} hai preso tutti i farmaci necessari."
-    if has_multiple_caregivers:
-        text += "Ora invierò un messaggio di riepilogo ai tuoi caregiver"
-    else:
-        text += "Ora invierò un messaggio di riepilogo al tuo caregiver"
-    text += "Noi ci risentiamo quando dovrai prendere i prossimi farmaci."
-    text += "Intanto, nel caso tu abbia bisogno di aiuto, ricorda di pronunciare aiuto"
-    if has_multiple_caregivers:
-        text += "così invierò un messaggio di aiuto ai tuoi caregiver"
-    else:
-        text += "così invierò un messaggio di aiuto al tuo caregiver"
-    speech_synthesis(text, mixer)
-    return
+    frame = take_picture(startup.get('camera'))
+    start = time.perf_counter()
+    recognition = recognize_medication(frame, medication, startup.get('ocr'))
+    recognition['latency_ms'] = (time.perf_counter() - start) * 1000
+    recognition['frame'] = frame
+    return recognition
 
 
-def send_recap_message(patient, feeling, today, hour, minute):
+def send_recap_message(patient, feeling, today, hour, minute, wrong_boxes=()):
     """
     Send a recap message to the patient's caregivers.
 
@@ -433,9 +329,15 @@ def send_recap_message(patient, feeling, today, hour, minute):
         today (str): The current day.
         hour (str): The current hour.
         minute (str): The current minute.
-    """
-    for chat_id in patient['chat_ids']:
-        send_telegram_message(chat_id, f"/sendrecap<{patient['name']}><{feeling}><{today}-{hour}:{minute}>")
+        wrong_boxes (list, optional): The (shown, expected) medications of the wrong boxes shown. Defaults to ().
+    """
+    message = f"/sendrecap<{patient['name']}><{feeling}><{today}-{hour}:{minute}>"
+    if wrong_boxes:
+        # the names are read on the boxes and written in the plans, they may contain Markdown characters
+        message += "<" + "; ".join(
+            f"{escape_markdown(shown)} invece di {escape_markdown(expected)}" for shown, expected in wrong_boxes
+        ) + ">"
+    send_caregivers_message(patient, 'recap', message, PRIORITY_RECAP)
     return
 
 
@@ -446,112 +348,170 @@ def delete_images(today):
     Args:
         today (str): The current date.
     """
-    if os.listdir(f'../medications/{today}'):
-        for image in os.listdir(f'../medications/{today}'):
-            os.remove(f'../medications/{today}/{image}')
+    folder = os.path.join(pictures_folder, today)
+    if os.listdir(folder):
+        for image in os.listdir(folder):
+            os.remove(os.path.join(folder, image))
+    return
+
+
+def start_loading():
+    """
+    Start loading in background, concurrently, the data of the patient of the local kiosk and all the modules of the system.
+    """
+    startup.load('patient', get_patient_data, patient_registry.patient_for_kiosk(local_kiosk))
+    # the slowest ones first, so that they get a worker at once
+    startup.load('speech_recognition', setup_speech_recognition)
+    startup.load('ocr', setup_ocr)
+    startup.load('speech_synthesis', setup_speech_synthesis)
+    startup.load('camera', setup_camera)
     return
 
 
+class KioskEffects(DialogueEffects):
+    """
+    Actions of the dialogue on the kiosk: the speech through the TTS cache and the audio player,
+    the speech recognition, the backgrounds of the web interface of the kiosk, the camera and the
+    OCR, the pictures, the caregivers messages and the adherence log.
+    """
+
+    def __init__(self, listener, player, kiosk_id):
+        """
+        Initialize the effects.
+
+        Args:
+            listener (SpeechListener): The speech listener.
+            player (AudioPlayer): The audio player.
+            kiosk_id (str): The kiosk whose web interface shows the backgrounds.
+        """
+        self.listener = listener
+        self.player = player
+        self.room = kiosk_room(kiosk_id)
+        # the recognitions and the notifications run here, concurrently with the dialogue
+        self.tasks = ThreadPoolExecutor(max_workers=2, thread_name_prefix='dialogue')
+
+    def say(self, text):
+        return speech_synthesis(text, self.player, wait=False)
+
+    def cancel_speech(self):
+        self.player.cancel()
+
+    def listen(self, grammar):
+        self.listener.set_state(grammar)
+        self.listener.resume()
+
+    def pause_listening(self):
+        self.listener.pause()
+
+    def background(self, image, idle):
+        socketio.emit('background_idle_change' if idle else 'background_event_change', {'image': image}, to=self.room)
+
+    def recognize(self, medication):
+        return self.tasks.submit(recognize_box, medication)
+
+    def save_picture(self, day, medication, recognition):
+        save_picture(day, medication, recognition['frame'])
+
+    def delete_pictures(self, day):
+        picture_writer.submit(delete_images, day)
+
+    def send_help(self, patient):
+        self.tasks.submit(send_caregivers_message, patient, 'help', f"/sendhelp<{patient['name']}>", PRIORITY_HELP)
+
+    def send_recap(self, patient, feeling, day, wrong_boxes):
+        # the recap sends the pictures, it is queued after them
+        picture_writer.submit(
+            send_recap_message, patient, feeling, day, time.strftime('%H'), time.strftime('%M'), wrong_boxes
+        )
+
+    def record(self, patient, dose, kind, **fields):
+        adherence_log.record(patient['id'], dose, kind, **fields)
+        # the dose is also the session of the stage metrics traces
+        if kind == 'dose_start':
+            stage_metrics.open_session(f"{patient['id']}-{dose['date']}T{dose['time']}")
+        elif kind == 'dose_end':
+            stage_metrics.close_session()
+
+
 def interaction():
     """
-    Main function of the system, is an infinite loop that starts all the functionalities
-    of the system.
-    """
-    patient = get_patient_data()
-    # define the starting day
-    last_day = 'monday'
-    today = ''
-    # setup the speech recognition module
-    recognizer, stream = setup_speech_recognition()
-    # setup the speech synthesis module
-    mixer = setup_speech_synthesis()
-    # setup the ocr module
-    ocr_model = setup_ocr()
-    while True:
-        speech = None
-        feeling = None
-        # get the current day and update if needed the therapy plan
-        today = time.strftime('%A').lower()
-        if today != last_day:
-            therapy_plan = get_therapy_plan(today)
-            last_day = today 
-        # start the speech recognition
-        stream.start_stream()
-        # if the user says "aiuto" start the help procedure
-        speech = recognize_speech(recognizer, stream)
-        if speech != None and 'aiuto' in speech:
-            stream.stop_stream()
-            socketio.emit('background_event_change', {'image': 'alert_background.jpg'})
-            send_help_message(patient, mixer)
-            speech = None
-            stream.start_stream()
-            socketio.emit('background_idle_change', {'image': 'background.jpg'})
-        # if the helper finds out that is time to take a medication start the therapy plan procedure
-        current_time = time.strftime('%H:%M', time.localtime())
-        if current_time in therapy_plan.keys():
-            stream.stop_stream()
-            socketio.emit('background_event_change', {'image': 'medication_background.jpg'})
-            delete_images(today)
-            # greet the patient and ask them how they are feeling
-            greet_patient(patient, mixer)
-            # to simulate a do while loop
-            while True:
-                speech = None
-                stream.start_stream()
-                while speech == None:
-                # wait for the patient to say something
-                    speech = recognize_speech(recognizer, stream)
-                stream.stop_stream()
-                feeling = analyze_feelings(patient, speech, mixer, stream, recognizer)
-                if feeling != "":
-                    break
-            socketio.emit('background_event_change', {'image': 'medication_background.jpg'})
-            # get the current medications to take
-            medications = therapy_plan[current_time]
-            # pronunce the therapy plan rules
-            speech_therapy_plan_info(patient, medications, mixer)
-            for medication, quantity in medications:
-                socketio.emit('background_event_change', {'image': 'medication_background.jpg'})
-                speech_medication_instructions(medication, mixer)
-                box_recognized = False
-                # while the box is not recognized
-                while not box_recognized:
-                    socketio.emit('background_event_change', {'image': 'photo_background.jpg'})
-                    stream.start_stream()
-                    while True:
-                        speech = None
-                        speech = recognize_speech(recognizer, stream)
-                        if speech != None and 'foto' in speech:
-                            break
-                    stream.stop_stream()
-                    take_picture(today, medication)
-                    # recognize the medication box
-                    box_recognized = recognize_medication(today, medication, ocr_model)
-                    if box_recognized:
-                        socketio.emit('background_event_change', {'image': 'medication_happy_background.jpg'})
-                        get_medication_instructions(patient, quantity, mixer)
-                        stream.start_stream()
-                        while True:
-                            speech = None
-                            speech = recognize_speech(recognizer, stream)
-                            if speech != None and 'avanti' in speech:
-                                break
-                    else:
-                        socketio.emit('background_event_change', {'image': 'medication_sad_background.jpg'})
-                        text = "Scusa non è la scatola corretta, potresti riprovare?"
-                        speech_synthesis(text, mixer)
-            stream.stop_stream()
-            socketio.emit('background_event_change', {'image': 'medication_background.jpg'})
-            goodbye_patient(patient, mixer)
-            current_hour = time.strftime('%H')
-            current_minute = time.strftime('%M') 
-            send_recap_message(patient, feeling, today, current_hour, current_minute)
-            socketio.emit('background_idle_change', {'image': 'background.jpg'})
+    Main function of the system, runs the dialogue with the patient of the local kiosk on an
+    asyncio event loop. It starts listening as soon as the speech modules are loaded, the camera
+    and the ocr modules are waited for only when a medication box has to be recognized.
+    """
+    patient = startup.get('patient')
+    # the speech recognition and synthesis modules
+    listener = startup.get('speech_recognition')
+    player = startup.get('speech_synthesis')
+    # pre-render in background all the phrases that can be spoken to the patient
+    therapy_plan_store = patient_registry.get_store(patient['id'])
+    threading.Thread(target=tts_cache.warm_up, args=(prompts.get_all_prompts(patient, therapy_plan_store),), daemon=True).start()
+    machine = DialogueMachine(patient, KioskEffects(listener, player, local_kiosk))
+    startup.mark('listening')
+    asyncio.run(run_dialogue(machine, listener, dose_scheduler, patient_id=patient['id']))
 
 
 ### UI ###
 app = Flask(__name__)
 socketio = SocketIO(app)
+load_dotenv()
+patient_registry = PatientRegistry(
+    os.getenv("PATIENT_REGISTRY", "../patient_registry.csv"),
+    os.getenv("THERAPY_PLAN_FOLDER", "../therapy_plan")
+)
+# the kiosk with the microphone, the speakers and the camera of this machine
+local_kiosk = os.getenv("KIOSK_ID") or next(iter(patient_registry.kiosks()), None)
+stage_metrics = StageMetrics(trace_folder=os.getenv("METRICS_TRACE_FOLDER") or None)
+# in low memory mode only a few phrases are kept in memory, the others are read again from disk
+tts_cache = TTSCache(
+    get_tts_backend(),
+    folder=os.getenv("TTS_CACHE_FOLDER", "../tts_cache"),
+    max_items=16 if os.getenv("MEMORY_MODE", "normal") == "low" else 128
+)
+telegram_client = TelegramBotClient(
+    on_call=lambda method, seconds, error: stage_metrics.observe(f'telegram_{method}', seconds, error=error)
+)
+notification_outbox = NotificationOutbox(telegram_client, path=os.getenv("NOTIFICATION_OUTBOX", "../notifications.db"))
+chat_id_registry = ChatIdRegistry(os.getenv("CHAT_ID_REGISTRY", "../chat_ids.json"))
+adherence_log = AdherenceLog(os.getenv("ADHERENCE_LOG", "../adherence.db"))
+# a single scheduler for the doses of all the patients
+# the doses missed, also while the system was off after the last dose of the log, count in the
+# adherence as not taken, and the doses of the log are not returned again after a restart
+dose_scheduler = DoseScheduler(
+    patient_registry.stores,
+    on_missed=lambda dose: adherence_log.record_missed(dose['patient_id'], dose),
+    fired=adherence_log.dose_history((datetime.date.today() - datetime.timedelta(days=7)).isoformat())
+)
+# the pictures of the boxes, read by the Telegram bot from the medications folder of the project
+pictures_folder = os.getenv("PICTURES_FOLDER", "../medications")
+# in low memory mode the modules are loaded one after another, so that the memory of each one is measured
+startup = StartupOrchestrator(
+    max_workers=1 if os.getenv("MEMORY_MODE", "normal") == "low" else int(os.getenv("STARTUP_WORKERS", "4")),
+    # only the local kiosk has the assistant whose modules are loaded
+    on_change=lambda status: socketio.emit('readiness', status, to=kiosk_room(local_kiosk))
+)
+# the pictures are written, deleted and sent in order by a single thread
+picture_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='picture-writer')
+medication_matcher = None
+medication_matcher_version = None
+# the rendered pages and therapy tables
+page_cache = PageCache()
+# the kiosk of every connected client and the next medication last sent to every kiosk
+kiosk_clients = {}
+kiosk_next_medications = {}
+
+
+def kiosk_room(kiosk_id):
+    """
+    Get the Socket.IO room of the clients of a kiosk.
+
+    Args:
+        kiosk_id (str): The kiosk ID.
+
+    Returns:
+        str: The name of the room.
+    """
+    return f'kiosk-{kiosk_id}'
 
 
 def translate_day(day):
@@ -586,40 +546,183 @@ def get_current_day():
     return datetime.datetime.now().strftime('%A').lower()
 
 
-def get_therapy_plan_display(day):
+def get_therapy_plan_display(day, patient_id=None):
     """
-    Read the CSV file for the given day and format it for display.
+    Get the therapy plan of a patient for the given day formatted for display.
 
     Args:
         day (str): The day of the week in lowercase (e.g., 'monday').
+        patient_id (str, optional): The patient ID. Defaults to None (the shared therapy plans).
 
     Returns:
-        pandas.DataFrame: The therapy plan for the given day, with columns renamed and NaN values replaced.
+        tuple: The column names (renamed for display) and the rows of the therapy plan, with NaN values replaced.
     """
-    file_path = f'../therapy_plan/therapy_plan_{day}.csv'
-    df = pd.read_csv(file_path)
-    df = df.dropna(subset=df.columns.difference(['hour']), how='all')
-    df = df.fillna('')
-    column_mapping = {'hour': 'Orario'}
-    for i in range(1, (len(df.columns) - 1) // 2 + 1):
-        column_mapping[f'medication_{i}'] = f'Medicinale {i}'
-        column_mapping[f'quantity_medication_{i}'] = f'Quantità {i}'
-    df = df.rename(columns=column_mapping)
-    return df
+    return patient_registry.get_store(patient_id).get_display(day)
+
+
+def render_therapy_table(day, patient_id):
+    """
+    Render the table of the therapy plan of a patient for the given day, shared by all the pages
+    showing the same therapy plans.
+
+    Args:
+        day (str): The day of the week in lowercase (e.g., 'monday').
+        patient_id (str or None): The patient ID.
+
+    Returns:
+        RenderedPage: The rendered HTML fragment of the table.
+    """
+    store = patient_registry.get_store(patient_id)
+    store.refresh()
+
+    def render():
+        columns, therapy_plan_display = get_therapy_plan_display(day, patient_id)
+        return render_template('therapy_table.html', therapy_plan_display=therapy_plan_display, columns=columns, display_day=translate_day(day))
+
+    return page_cache.get(('therapy_table', store.folder, store.version, day), render)
+
+
+def render_kiosk(kiosk_id):
+    """
+    Render the index page of a kiosk with the therapy plan of its patient for the current day.
+    The page is rendered again only when the day or the therapy plans change, and a client
+    that already has it (its ETag in If-None-Match) gets an empty 304 response.
+
+    Args:
+        kiosk_id (str): The kiosk ID.
+
+    Returns:
+        flask.Response: The rendered HTML for the index page, or a 304 response.
+    """
+    current_day = get_current_day()
+    table = render_therapy_table(current_day, patient_registry.patient_for_kiosk(kiosk_id))
+
+    def render():
+        # only the local kiosk has an assistant, whose loading status is shown
+        return render_template(
+            'index.html', therapy_table=Markup(table.body), current_day=current_day, display_day=translate_day(current_day),
+            kiosk_id=kiosk_id or '', local_assistant=kiosk_id == local_kiosk
+        )
+
+    # the page depends on the table, whose ETag identifies the day and the version of the plans
+    page = page_cache.get(('index', kiosk_id, table.etag), render)
+    if request.if_none_match.contains(page.etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(page.body)
+    response.set_etag(page.etag)
+    # the kiosks revalidate the page at every load
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/')
 def index():
     """
-    Render the main index page with the therapy plan for the current day.
+    Render the main index page of the local kiosk.
 
     Returns:
-        str: The rendered HTML for the index page.
+        flask.Response: The rendered HTML for the index page, or a 304 response.
     """
-    current_day = get_current_day()
-    display_day = translate_day(get_current_day())
-    therapy_plan_display = get_therapy_plan_display(current_day)
-    return render_template('index.html', therapy_plan_display=therapy_plan_display.to_dict(orient='records'), columns=therapy_plan_display.columns, current_day=current_day, display_day=display_day)
+    return render_kiosk(local_kiosk)
+
+
+@app.route('/kiosk/<kiosk_id>')
+def kiosk(kiosk_id):
+    """
+    Render the index page of a kiosk of the patient registry.
+
+    Args:
+        kiosk_id (str): The kiosk ID.
+
+    Returns:
+        flask.Response: The rendered HTML for the index page, or a 304 response.
+    """
+    if patient_registry.patient_for_kiosk(kiosk_id) is None:
+        abort(404)
+    return render_kiosk(kiosk_id)
+
+
+@app.route('/status')
+def status():
+    """
+    Get the loading status of the modules of the system.
+
+    Returns:
+        flask.Response: JSON response containing the state and the resident memory of every module,
+            the startup milestones, the resident memory of the process and the counters of the OCR
+            worker (e.g. its queue depth and its resident memory) once loaded, and the hits and
+            misses of the cache of the rendered pages.
+    """
+    status = startup.status()
+    if startup.is_ready('ocr') and hasattr(startup.get('ocr'), 'stats'):
+        status['ocr'] = startup.get('ocr').stats()
+    status['page_cache'] = {'hits': page_cache.hits, 'misses': page_cache.misses}
+    return jsonify(**status)
+
+
+@app.route('/adherence/<patient_id>')
+def adherence(patient_id):
+    """
+    Get the adherence of a patient per day and per medication, between the 'start' and 'end' days
+    ('YYYY-MM-DD', by default the last 30 days), only for the 'medication' parameter if given.
+
+    Args:
+        patient_id (str): The patient ID.
+
+    Returns:
+        flask.Response: JSON response containing the aggregated adherence (see `AdherenceLog.aggregate`).
+    """
+    if patient_registry.get(patient_id) is None:
+        abort(404)
+    today = datetime.date.today()
+    start = request.args.get('start', (today - datetime.timedelta(days=29)).isoformat())
+    end = request.args.get('end', today.isoformat())
+    try:
+        datetime.date.fromisoformat(start)
+        datetime.date.fromisoformat(end)
+    except ValueError:
+        abort(400)
+    return jsonify(**adherence_log.aggregate(patient_id, start, end, request.args.get('medication')))
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Get the duration quantiles of every stage of the dose sessions.
+
+    Returns:
+        flask.Response: The metrics in the Prometheus text format.
+    """
+    return Response(stage_metrics.to_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/metrics/sessions')
+def metrics_sessions():
+    """
+    Get the IDs of the recent dose sessions with a trace.
+
+    Returns:
+        flask.Response: JSON response containing the session IDs, the oldest first.
+    """
+    return jsonify(sessions=stage_metrics.sessions())
+
+
+@app.route('/metrics/sessions/<session_id>')
+def metrics_session(session_id):
+    """
+    Get the trace of a recent dose session.
+
+    Args:
+        session_id (str): The session ID ('<patient_id>-<date>T<time>').
+
+    Returns:
+        flask.Response: JSON response containing the spans of the session (see `StageMetrics.get_trace`).
+    """
+    trace = stage_metrics.get_trace(session_id)
+    if trace is None:
+        abort(404)
+    return jsonify(**trace)
 
 
 @app.route('/current_time')
@@ -641,27 +744,144 @@ def current_time():
 @app.route('/next_medication')
 def next_medication():
     """
-    Get the next medication time and details.
+    Get the next medication time and details of the kiosk in the 'kiosk' parameter, or of the local kiosk.
 
     Returns:
         flask.Response: JSON response containing the next medication time and details.
     """
+    kiosk_id = request.args.get('kiosk', local_kiosk)
+    return jsonify(**get_next_medication(patient_registry.patient_for_kiosk(kiosk_id)))
+
+
+def get_next_medication(patient_id=None):
+    """
+    Get the next medication time and details of a patient from the therapy plan store.
+
+    Args:
+        patient_id (str, optional): The patient ID. Defaults to None (the shared therapy plans).
+
+    Returns:
+        dict: A dictionary containing the next medication time and details, both None if
+            there are no more medications for the current day.
+    """
     now = datetime.datetime.now().strftime('%H:%M')
-    therapy_plan_alert = get_therapy_plan(get_current_day())
-    next_time = None
-    next_medications = None
-    for time in sorted(therapy_plan_alert.keys()):
-        if time > now:
-            next_time = time
-            next_medications = therapy_plan_alert[time]
-            break
-    if next_time:
-        return jsonify(time=next_time, medications=next_medications)
-    else:
-        return jsonify(time=None, medications=None)
+    next_time, next_medications = patient_registry.get_store(patient_id).next_dose(get_current_day(), now)
+    return {'time': next_time, 'medications': next_medications}
+
+
+def get_server_time():
+    """
+    Get the current server time, used by the clients to synchronize their local clock.
+
+    Returns:
+        dict: A dictionary containing the current time as milliseconds since the epoch.
+    """
+    return {'timestamp': int(time.time() * 1000)}
+
+
+def push_kiosk_updates():
+    """
+    Emit the next medication to the room of every kiosk with connected clients, if it changed.
+    The next medication is computed once for the patients sharing the same therapy plans.
+
+    Returns:
+        int: The number of kiosks updated.
+    """
+    kiosks = set(kiosk_clients.values())
+    # the kiosks without clients are forgotten, so the memory does not grow with every kiosk ever connected
+    for kiosk_id in list(kiosk_next_medications):
+        if kiosk_id not in kiosks:
+            kiosk_next_medications.pop(kiosk_id, None)
+    next_medications = {}
+    updated = 0
+    for kiosk_id in kiosks:
+        store = patient_registry.get_store(patient_registry.patient_for_kiosk(kiosk_id))
+        if id(store) not in next_medications:
+            now = datetime.datetime.now().strftime('%H:%M')
+            next_time, medications = store.next_dose(get_current_day(), now)
+            next_medications[id(store)] = {'time': next_time, 'medications': medications}
+        next_medication = next_medications[id(store)]
+        if next_medication != kiosk_next_medications.get(kiosk_id):
+            socketio.emit('next_medication', next_medication, to=kiosk_room(kiosk_id))
+            kiosk_next_medications[kiosk_id] = next_medication
+            updated += 1
+    return updated
+
+
+def push_next_medication():
+    """
+    Background task pushing the next medication to the kiosks over Socket.IO.
+
+    The next medication is recomputed at every minute boundary (which also covers the day
+    rollover) and at every therapy plan check, and the 'next_medication' event is emitted
+    only to the kiosks where it changes.
+    """
+    while True:
+        push_kiosk_updates()
+        # sleep until the next minute boundary, waking up earlier to notice therapy plan reloads
+        seconds_to_next_minute = 60 - time.time() % 60
+        socketio.sleep(min(seconds_to_next_minute, patient_registry.check_interval))
+
+
+def dispatch_doses():
+    """
+    Background task delivering the due doses of the patients without a dialogue on this machine
+    to their kiosks, with the 'dose_due' event. The doses of the patient of the local kiosk are
+    delivered to its dialogue.
+    """
+    while True:
+        local_patient = patient_registry.patient_for_kiosk(local_kiosk)
+        for patient_id in list(patient_registry.stores):
+            if patient_id == local_patient:
+                continue
+            dose = dose_scheduler.due(patient_id)
+            while dose is not None:
+                registered = patient_registry.get(patient_id)
+                if registered is not None:
+                    socketio.emit('dose_due', {'time': dose['time'], 'medications': dose['medications']}, to=kiosk_room(registered['kiosk']))
+                dose = dose_scheduler.due(patient_id)
+        socketio.sleep(patient_registry.check_interval)
+
+
+@socketio.on('connect')
+def handle_connect():
+    """
+    Add a newly connected client to the room of its kiosk (the 'kiosk' query parameter, or the
+    local kiosk) and send it the current time, the next medication and, to the clients of the
+    local kiosk, the loading status of the assistant.
+    """
+    kiosk_id = request.args.get('kiosk') or local_kiosk
+    join_room(kiosk_room(kiosk_id))
+    kiosk_clients[request.sid] = kiosk_id
+    next_medication = get_next_medication(patient_registry.patient_for_kiosk(kiosk_id))
+    kiosk_next_medications[kiosk_id] = next_medication
+    emit('current_time', get_server_time())
+    emit('next_medication', next_medication)
+    if kiosk_id == local_kiosk:
+        emit('readiness', startup.status())
+
+
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    """
+    Forget a disconnected client.
+    """
+    kiosk_clients.pop(request.sid, None)
+
+
+@socketio.on('sync_time')
+def handle_sync_time():
+    """
+    Send the current time to a client that wants to re-synchronize its local clock.
+    """
+    emit('current_time', get_server_time())
 
 
 if __name__ == '__main__':
+    start_loading()
     background_thread = threading.Thread(target=interaction)
     background_thread.start()
+    notification_outbox.start()
+    socketio.start_background_task(push_next_medication)
+    socketio.start_background_task(dispatch_doses)
     socketio.run(app, debug=False)
@@ -0,0 +1,363 @@
+# Import all the needed libraries
+import queue
+import threading
+from array import array
+import time
+import wave
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2 # 16 bit mono audio
+
+
+class RingBuffer:
+    """
+    Single-producer single-consumer ring buffer of raw audio bytes.
+
+    The producer and the consumer never take a lock: each one owns its own monotonic
+    position and only reads the position of the other. When the consumer falls behind by
+    more than the capacity, the oldest audio is overwritten and skipped.
+    """
+
+    def __init__(self, capacity):
+        """
+        Initialize the buffer.
+
+        Args:
+            capacity (int): The capacity of the buffer in bytes.
+        """
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._write_pos = 0
+        self._read_pos = 0
+        self.data_available = threading.Event()
+
+    def write(self, data):
+        """
+        Append audio to the buffer, overwriting the oldest audio if it is full.
+
+        Args:
+            data (bytes): The audio to be appended.
+        """
+        data = data[-self.capacity:]
+        start = self._write_pos % self.capacity
+        end = start + len(data)
+        if end <= self.capacity:
+            self._buffer[start:end] = data
+        else:
+            split = self.capacity - start
+            self._buffer[start:] = data[:split]
+            self._buffer[:end - self.capacity] = data[split:]
+        # publish the new position only once the data has been copied
+        self._write_pos += len(data)
+        self.data_available.set()
+        return
+
+    def available(self):
+        """
+        Get the number of bytes that can be read.
+
+        Returns:
+            int: The number of unread bytes still in the buffer.
+        """
+        return min(self._write_pos - self._read_pos, self.capacity)
+
+    def read(self, size, timeout=None):
+        """
+        Read audio from the buffer, waiting for it if needed.
+
+        Args:
+            size (int): The maximum number of bytes to be read.
+            timeout (float, optional): The maximum number of seconds to wait for audio. Defaults to None (wait forever).
+
+        Returns:
+            bytes: The audio read, empty if the timeout expired.
+        """
+        while self._write_pos == self._read_pos:
+            self.data_available.clear()
+            # check again, the producer may have written before the event was cleared
+            if self._write_pos != self._read_pos:
+                break
+            if not self.data_available.wait(timeout):
+                return b''
+        write_pos = self._write_pos
+        # skip the audio that has been overwritten
+        read_pos = max(self._read_pos, write_pos - self.capacity)
+        size = min(size, write_pos - read_pos)
+        start = read_pos % self.capacity
+        end = start + size
+        if end <= self.capacity:
+            data = bytes(self._buffer[start:end])
+        else:
+            data = bytes(self._buffer[start:]) + bytes(self._buffer[:end - self.capacity])
+        self._read_pos = read_pos + size
+        return data
+
+    def skip(self, seconds=None):
+        """
+        Discard the unread audio.
+
+        Args:
+            seconds (float, optional): If given, keep the last `seconds` of audio unread. Defaults to None (discard everything).
+        """
+        keep = 0 if seconds is None else int(seconds * SAMPLE_RATE) * SAMPLE_WIDTH
+        self._read_pos = max(self._read_pos, self._write_pos - keep)
+        return
+
+
+class MicrophoneSource:
+    """
+    Audio source capturing from the default microphone, the audio is written to the ring
+    buffer by the PyAudio callback thread.
+    """
+
+    def __init__(self, frames_per_buffer=1600):
+        """
+        Initialize the source.
+
+        Args:
+            frames_per_buffer (int, optional): The number of frames of each capture. Defaults to 1600 (100 ms).
+        """
+        self.frames_per_buffer = frames_per_buffer
+        self._mic = None
+        self._stream = None
+
+    def start(self, ring):
+        """
+        Open the microphone and start writing to the ring buffer.
+
+        Args:
+            ring (RingBuffer): The ring buffer to be fed.
+        """
+        import pyaudio
+
+        def callback(in_data, frame_count, time_info, status):
+            ring.write(in_data)
+            return None, pyaudio.paContinue
+
+        self._mic = pyaudio.PyAudio()
+        self._stream = self._mic.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=SAMPLE_RATE,
+            input=True,
+            frames_per_buffer=self.frames_per_buffer,
+            stream_callback=callback
+        )
+        self._stream.start_stream()
+        return
+
+    def stop(self):
+        """
+        Stop the capture and release the microphone.
+        """
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._mic.terminate()
+            self._stream = None
+        return
+
+
+class WavFileSource:
+    """
+    Audio source reading a 16 kHz 16 bit mono WAV file, used to test and benchmark the
+    pipeline without a microphone.
+    """
+
+    def __init__(self, path, realtime=True, frames_per_buffer=1600, trailing_silence=1.0):
+        """
+        Initialize the source.
+
+        Args:
+            path (str): The path of the WAV file.
+            realtime (bool, optional): If True the audio is written at the pace of a real microphone,
+                otherwise as fast as possible. Defaults to True.
+            frames_per_buffer (int, optional): The number of frames written at a time. Defaults to 1600 (100 ms).
+            trailing_silence (float, optional): Seconds of silence appended to the file, so that the
+                recognizer can close the last utterance. Defaults to 1.0.
+        """
+        self.path = path
+        self.realtime = realtime
+        self.frames_per_buffer = frames_per_buffer
+        self.trailing_silence = trailing_silence
+        self.finished = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, ring):
+        """
+        Start writing the file to the ring buffer from a dedicated thread.
+
+        Args:
+            ring (RingBuffer): The ring buffer to be fed.
+        """
+        self._thread = threading.Thread(target=self._run, args=(ring,), name='wav-source', daemon=True)
+        self._thread.start()
+        return
+
+    def _run(self, ring):
+        with wave.open(self.path, 'rb') as wav:
+            if wav.getframerate() != SAMPLE_RATE or wav.getnchannels() != 1 or wav.getsampwidth() != SAMPLE_WIDTH:
+                raise ValueError(f"{self.path} must be a {SAMPLE_RATE} Hz 16 bit mono WAV file")
+            frames = wav.readframes(wav.getnframes())
+        frames += bytes(int(self.trailing_silence * SAMPLE_RATE) * SAMPLE_WIDTH)
+        chunk_size = self.frames_per_buffer * SAMPLE_WIDTH
+        start = time.monotonic()
+        for i, offset in enumerate(range(0, len(frames), chunk_size)):
+            if self._stopped.is_set():
+                break
+            if self.realtime:
+                delay = start + i * self.frames_per_buffer / SAMPLE_RATE - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            ring.write(frames[offset:offset + chunk_size])
+        self.finished.set()
+
+    def stop(self):
+        """
+        Stop writing the file.
+        """
+        self._stopped.set()
+        return
+
+
+class SpeechListener:
+    """
+    Continuous speech recognition pipeline.
+
+    The audio source keeps capturing into a ring buffer for the whole lifetime of the
+    listener, while a consumer thread feeds the decoder and publishes the recognized
+    utterances. Pausing gates the consumer, the device is never stopped.
+    """
+
+    def __init__(self, decoder, source, buffer_seconds=10, read_size=3200, on_result=None, speech_level=500):
+        """
+        Initialize the listener.
+
+        Args:
+            decoder (UtteranceDecoder or KeywordSpotter): The decoder turning audio into text.
+            source (MicrophoneSource or WavFileSource): The audio source.
+            buffer_seconds (int, optional): The seconds of audio kept in the ring buffer. Defaults to 10.
+            read_size (int, optional): The number of bytes fed to the decoder at a time. Defaults to 3200 (100 ms).
+            on_result (callable, optional): Called with every recognized utterance and the seconds from
+                the start of the speech, or from the resume if no speech was heard, to its recognition
+                (e.g. to collect metrics). Defaults to None.
+            speech_level (int, optional): The peak amplitude of the 16 bit samples above which the
+                audio is speech and not silence, for the timing of `on_result`. Defaults to 500.
+        """
+        self.decoder = decoder
+        self.source = source
+        self.read_size = read_size
+        self.on_result = on_result
+        self.speech_level = speech_level
+        self.ring = RingBuffer(buffer_seconds * SAMPLE_RATE * SAMPLE_WIDTH)
+        self.utterances = queue.Queue()
+        self._active = threading.Event()
+        self._reset = False
+        self._rewind_seconds = None
+        self._speech_start = None
+        self.state = None
+        self._state = None
+        self._thread = threading.Thread(target=self._run, name='speech-listener', daemon=True)
+
+    def start(self):
+        """
+        Start the audio capture and the recognition, the listener starts paused.
+        """
+        self.source.start(self.ring)
+        self._thread.start()
+        return self
+
+    def pause(self):
+        """
+        Stop recognizing speech, the audio keeps being captured in the ring buffer.
+        The utterances recognized and not read yet are dropped.
+        """
+        self._active.clear()
+        self._drop_utterances()
+        return
+
+    def resume(self, rewind_seconds=None):
+        """
+        Start recognizing speech again.
+
+        Args:
+            rewind_seconds (float, optional): Seconds of audio captured while paused that are
+                recognized as well. Defaults to None (only the audio from now on is recognized).
+        """
+        if not self._active.is_set():
+            # the consumer thread owns the read position, it skips the audio before reading again
+            self._rewind_seconds = rewind_seconds
+            self._reset = True
+            # drop the utterances recognized before the pause
+            self._drop_utterances()
+            self._active.set()
+        return
+
+    def set_state(self, state):
+        """
+        Set the state of the dialogue, so that the decoder listens only to the words expected in it.
+
+        Args:
+            state (str): The state of the dialogue (e.g. 'feelings').
+        """
+        if state == self.state:
+            return
+        self.state = state
+        # the consumer thread owns the decoder, it switches state before decoding again
+        self._state = state
+        self._drop_utterances()
+        return
+
+    def _drop_utterances(self):
+        while True:
+            try:
+                self.utterances.get_nowait()
+            except queue.Empty:
+                break
+        return
+
+    def listen(self, timeout=None):
+        """
+        Get the next recognized utterance.
+
+        Args:
+            timeout (float, optional): The maximum number of seconds to wait. Defaults to None (wait forever).
+
+        Returns:
+            str or None: The recognized utterance, or None if the timeout expired.
+        """
+        try:
+            return self.utterances.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _run(self):
+        resumed_at = time.perf_counter()
+        while True:
+            self._active.wait()
+            if self._state is not None:
+                state, self._state = self._state, None
+                self.decoder.set_state(state)
+            if self._reset:
+                self._reset = False
+                self.ring.skip(self._rewind_seconds)
+                self.decoder.reset()
+                self._speech_start = None
+                resumed_at = time.perf_counter()
+            data = self.ring.read(self.read_size, timeout=0.5)
+            if not data or not self._active.is_set():
+                continue
+            if self._speech_start is None:
+                samples = array('h', data[:len(data) - len(data) % SAMPLE_WIDTH])
+                if samples and max(max(samples), -min(samples)) >= self.speech_level:
+                    # when the chunk was captured, the audio still in the ring buffer came after it
+                    captured_at = time.perf_counter() - (self.ring.available() + len(data)) / (SAMPLE_RATE * SAMPLE_WIDTH)
+                    self._speech_start = max(captured_at, resumed_at)
+            text = self.decoder.accept(data)
+            if text:
+                self.utterances.put(text)
+                if self.on_result is not None:
+                    start = self._speech_start if self._speech_start is not None else resumed_at
+                    self.on_result(text, time.perf_counter() - start)
+                self._speech_start = None
@@ -0,0 +1,116 @@
+# Import all the needed libraries
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from io import BytesIO
+
+
+class AudioPlayer:
+    """
+    Asynchronous audio playback service.
+
+    The utterances are queued and played back to back by a dedicated thread, so that the
+    caller can keep listening to the microphone while the assistant is speaking. Every
+    utterance gets a future which is resolved with True when it has been played to the end
+    and with False when it has been cancelled (barge-in).
+    """
+
+    def __init__(self, mixer, poll_interval=0.005):
+        """
+        Initialize the player and start its playback thread.
+
+        Args:
+            mixer (pygame.mixer): The initialized mixer object.
+            poll_interval (float, optional): Seconds between two checks of the mixer state. Defaults to 0.005.
+        """
+        self.mixer = mixer
+        self.poll_interval = poll_interval
+        # set when nothing is playing and nothing is queued
+        self.idle = threading.Event()
+        self.idle.set()
+        self._queue = queue.Queue()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='audio-player', daemon=True)
+        self._thread.start()
+
+    def say(self, audio_chunks):
+        """
+        Queue an utterance for playback.
+
+        Args:
+            audio_chunks (iterable): The audio chunks (bytes) of the utterance, in playback order.
+                A generator is consumed by the playback thread, so that synthesis does not block the caller.
+
+        Returns:
+            concurrent.futures.Future: Resolved with True when the utterance has been played
+                to the end, with False if it has been cancelled.
+        """
+        future = Future()
+        with self._lock:
+            self.idle.clear()
+            self._queue.put((self._generation, audio_chunks, future))
+        return future
+
+    def cancel(self):
+        """
+        Stop the current utterance immediately and drop all the queued ones.
+        """
+        with self._lock:
+            self._generation += 1
+            self.mixer.music.stop()
+            while True:
+                try:
+                    _, _, future = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if future.set_running_or_notify_cancel():
+                    future.set_result(False)
+        return
+
+    def is_busy(self):
+        """
+        Check whether an utterance is playing or queued.
+
+        Returns:
+            bool: True if the player is not idle, False otherwise.
+        """
+        return not self.idle.is_set()
+
+    def _is_cancelled(self, generation):
+        return generation != self._generation
+
+    def _wait_playback(self, generation):
+        while self.mixer.music.get_busy():
+            if self._is_cancelled(generation):
+                return False
+            time.sleep(self.poll_interval)
+        return not self._is_cancelled(generation)
+
+    def _play(self, generation, audio_chunks):
+        for chunk in audio_chunks:
+            if not self._wait_playback(generation):
+                return False
+            with self._lock:
+                if self._is_cancelled(generation):
+                    return False
+                self.mixer.music.load(BytesIO(chunk))
+                self.mixer.music.play()
+        return self._wait_playback(generation)
+
+    def _run(self):
+        while True:
+            generation, audio_chunks, future = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            if self._is_cancelled(generation):
+                future.set_result(False)
+            else:
+                try:
+                    future.set_result(self._play(generation, audio_chunks))
+                except Exception as e:
+                    future.set_exception(e)
+            with self._lock:
+                if self._queue.empty():
+                    self.idle.set()
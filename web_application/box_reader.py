@@ -0,0 +1,203 @@
+# Import all the needed libraries
+import cv2
+import numpy as np
+
+# full: the whole frame, only downscaled; roi: the region with text, scaled to the text height;
+# crops: every text line found, recognized without the detection model
+OCR_MODES = ('full', 'roi', 'crops')
+
+
+def downscale(image, max_side):
+    """
+    Downscale an image so that its longest side is at most `max_side` pixels.
+
+    Args:
+        image (numpy.ndarray): The image.
+        max_side (int): The maximum length of the longest side.
+
+    Returns:
+        numpy.ndarray: The downscaled image, or the image itself if already small enough.
+    """
+    scale = max_side / max(image.shape[:2])
+    if scale >= 1:
+        return image
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def find_text_regions(frame, work_width=640, min_height=6, max_regions=16):
+    """
+    Find the regions of a frame that probably contain lines of text, without any model: the
+    strokes of the characters are joined horizontally into lines and the line-shaped blobs are kept.
+
+    Args:
+        frame (numpy.ndarray): The BGR frame.
+        work_width (int, optional): The width the frame is downscaled to for the search. Defaults to 640.
+        min_height (int, optional): The minimum height of a line, in pixels of the downscaled frame. Defaults to 6.
+        max_regions (int, optional): The maximum number of regions returned. Defaults to 16.
+
+    Returns:
+        list: The (x, y, width, height) boxes in pixels of the frame, the largest first.
+    """
+    scale = min(1.0, work_width / frame.shape[1])
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    # thin strokes darker (black hat) or lighter (top hat) than their surroundings, the edges of
+    # the box and of the large shapes are ignored
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (13, 7))
+    strokes = np.maximum(
+        cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, kernel),
+        cv2.morphologyEx(gray, cv2.MORPH_TOPHAT, kernel)
+    )
+    _, mask = cv2.threshold(strokes, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    # join the characters of a word and the words of a line, without joining the lines
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 3)))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    height, width = gray.shape
+    regions = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        # lines are wider than tall, and neither tiny nor as large as the whole frame
+        if h < min_height or w < 1.5 * h or h > height / 3 or w * h > 0.5 * width * height:
+            continue
+        # strokes are dense inside text, sparse inside large shapes and photos
+        if cv2.countNonZero(mask[y:y + h, x:x + w]) < 0.45 * w * h:
+            continue
+        regions.append((x, y, w, h))
+    regions.sort(key=lambda region: region[2] * region[3], reverse=True)
+    return [
+        (int(x / scale), int(y / scale), int(w / scale), int(h / scale))
+        for x, y, w, h in regions[:max_regions]
+    ]
+
+
+def expand_region(region, shape, margin):
+    """
+    Expand a region by a margin proportional to its height, within the frame.
+
+    Args:
+        region (tuple): The (x, y, width, height) box.
+        shape (tuple): The shape of the frame.
+        margin (float): The margin, as a fraction of the height of the region.
+
+    Returns:
+        tuple: The (x0, y0, x1, y1) corners of the expanded region.
+    """
+    x, y, w, h = region
+    pad = int(margin * h)
+    return max(0, x - pad), max(0, y - pad), min(shape[1], x + w + pad), min(shape[0], y + h + pad)
+
+
+def parse_ocr_result(results):
+    """
+    Get the lines of text from the result of PaddleOCR, with or without the detection model.
+
+    Args:
+        results (list): The result of `PaddleOCR.ocr` for a single image.
+
+    Returns:
+        list: The (text, confidence) of every line.
+    """
+    lines = []
+    for result in results or []:
+        for item in result or []:
+            # with detection every item is [box, (text, confidence)], without it is (text, confidence)
+            text, confidence = item[1] if isinstance(item[1], (tuple, list)) else item
+            lines.append((text, float(confidence)))
+    return lines
+
+
+class BoxReader:
+    """
+    Reader of the text on a medication box, a preprocessing stage in front of PaddleOCR.
+
+    The detection model of PaddleOCR runs on every pixel it receives, so on a full webcam
+    frame most of its time is spent on the background. The reader finds the text lines
+    with a cheap OpenCV pass and either runs the OCR only on the region containing them,
+    scaled so that the text has the height the models are trained on, or skips the
+    detection model and runs only the recognition on every line.
+    """
+
+    def __init__(self, ocr_model, mode='roi', max_side=960, text_height=32, rec_height=48, max_crops=8,
+                 margin=0.3, min_confidence=0.5):
+        """
+        Initialize the reader.
+
+        Args:
+            ocr_model (PaddleOCR): The OCR model.
+            mode (str, optional): One of OCR_MODES. Defaults to 'roi'.
+            max_side (int, optional): The maximum length of the longest side of the image given to the
+                detection model. Defaults to 960.
+            text_height (int, optional): The height in pixels of the largest text line in the region,
+                in the 'roi' mode. Defaults to 32.
+            rec_height (int, optional): The height in pixels of the lines given to the recognition model,
+                in the 'crops' mode. Defaults to 48.
+            max_crops (int, optional): The maximum number of lines recognized, the largest first, in the
+                'crops' mode. Defaults to 8.
+            margin (float, optional): The margin around the text, as a fraction of the line height. Defaults to 0.3.
+            min_confidence (float, optional): The minimum confidence of a recognized line. Defaults to 0.5.
+        """
+        if mode not in OCR_MODES:
+            raise ValueError(f"Unknown OCR mode '{mode}', expected one of {', '.join(OCR_MODES)}")
+        self.ocr_model = ocr_model
+        self.mode = mode
+        self.max_side = max_side
+        self.text_height = text_height
+        self.rec_height = rec_height
+        self.max_crops = max_crops
+        self.margin = margin
+        self.min_confidence = min_confidence
+
+    def read_lines(self, frame):
+        """
+        Read the lines of text on the box.
+
+        Args:
+            frame (numpy.ndarray or None): The picture of the medication box.
+
+        Returns:
+            list: The lines of text read.
+        """
+        if frame is None:
+            return []
+        if self.mode == 'full':
+            lines = self._read_full(frame)
+        else:
+            regions = find_text_regions(frame)
+            if not regions:
+                # nothing that looks like text, let the detection model look at the whole frame
+                lines = self._read_full(frame)
+            elif self.mode == 'roi':
+                lines = self._read_roi(frame, regions)
+            else:
+                lines = self._read_crops(frame, regions)
+        return [text for text, confidence in lines if confidence >= self.min_confidence]
+
+    def _read_full(self, frame):
+        return parse_ocr_result(self.ocr_model.ocr(downscale(frame, self.max_side)))
+
+    def _read_roi(self, frame, regions):
+        corners = [expand_region(region, frame.shape, self.margin) for region in regions]
+        x0 = min(corner[0] for corner in corners)
+        y0 = min(corner[1] for corner in corners)
+        x1 = max(corner[2] for corner in corners)
+        y1 = max(corner[3] for corner in corners)
+        roi = frame[y0:y1, x0:x1]
+        # the largest line is usually the name of the medication
+        largest_line = max(region[3] for region in regions)
+        scale = min(self.text_height / largest_line, self.max_side / max(roi.shape[:2]), 2.0)
+        if scale != 1:
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+            roi = cv2.resize(roi, None, fx=scale, fy=scale, interpolation=interpolation)
+        return parse_ocr_result(self.ocr_model.ocr(np.ascontiguousarray(roi)))
+
+    def _read_crops(self, frame, regions):
+        lines = []
+        for region in regions[:self.max_crops]:
+            x0, y0, x1, y1 = expand_region(region, frame.shape, self.margin)
+            crop = frame[y0:y1, x0:x1]
+            scale = self.rec_height / crop.shape[0]
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+            crop = cv2.resize(crop, (max(1, int(crop.shape[1] * scale)), self.rec_height), interpolation=interpolation)
+            lines.extend(parse_ocr_result(self.ocr_model.ocr(crop, det=False, cls=False)))
+        return lines
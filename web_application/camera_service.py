@@ -0,0 +1,180 @@
+# Import all the needed libraries
+import os
+import threading
+import time
+from collections import deque
+import cv2
+
+
+def focus_measure(frame, size=320):
+    """
+    Compute a cheap sharpness score of a frame, the variance of the Laplacian of its
+    downscaled grayscale version.
+
+    Args:
+        frame (numpy.ndarray): The BGR frame.
+        size (int, optional): The width the frame is downscaled to before the measure. Defaults to 320.
+
+    Returns:
+        float: The sharpness score, higher is sharper.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if gray.shape[1] > size:
+        gray = cv2.resize(gray, (size, int(gray.shape[0] * size / gray.shape[1])), interpolation=cv2.INTER_AREA)
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
+
+
+class ImageDirectorySource:
+    """
+    Frame source reading the images of a folder in alphabetical order, used to test the
+    recognition without a camera. It has the same interface of cv2.VideoCapture.
+    """
+
+    EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+    def __init__(self, folder, loop=True):
+        """
+        Initialize the source.
+
+        Args:
+            folder (str): The folder containing the images.
+            loop (bool, optional): If True start again from the first image after the last one. Defaults to True.
+        """
+        self.paths = sorted(
+            os.path.join(folder, file_name) for file_name in os.listdir(folder)
+            if file_name.lower().endswith(self.EXTENSIONS)
+        )
+        self.loop = loop
+        self._index = 0
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def read(self):
+        if self._index >= len(self.paths):
+            if not self.loop:
+                return False, None
+            self._index = 0
+        frame = cv2.imread(self.paths[self._index])
+        self._index += 1
+        return frame is not None, frame
+
+    def release(self):
+        return
+
+
+def open_source(source):
+    """
+    Open a frame source.
+
+    Args:
+        source (int or str or object): A camera index, the path of a video file or of a folder of
+            images, or an object with the interface of cv2.VideoCapture that is used as it is.
+
+    Returns:
+        cv2.VideoCapture or ImageDirectorySource: The opened source.
+    """
+    if hasattr(source, 'read'):
+        return source
+    if isinstance(source, str) and os.path.isdir(source):
+        return ImageDirectorySource(source)
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    return cv2.VideoCapture(source)
+
+
+class CameraService:
+    """
+    Long-lived capture service.
+
+    The device is opened once and a dedicated thread keeps reading frames, so that the
+    exposure is always settled, and keeps the most recent ones in a small ring. When a
+    picture is requested the sharpest of the recent frames is returned.
+    """
+
+    def __init__(self, source=0, ring_size=8, fps=None):
+        """
+        Initialize the service.
+
+        Args:
+            source (int or str or object, optional): A camera index, the path of a video file or of a folder of images,
+                or a frame source (see `open_source`). Defaults to 0.
+            ring_size (int, optional): The number of recent frames kept. Defaults to 8.
+            fps (float, optional): The maximum reading rate, needed for the file and folder sources
+                that would otherwise be read as fast as possible. Defaults to None (the pace of the device).
+        """
+        self.source = source
+        self.fps = fps
+        self._frames = deque(maxlen=ring_size)
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._stopped = threading.Event()
+        self._capture = None
+        self._thread = None
+
+    def start(self):
+        """
+        Open the source and start reading frames in background.
+
+        Returns:
+            CameraService: The service itself.
+        """
+        self._capture = open_source(self.source)
+        if not self._capture.isOpened():
+            print("Error: Could not open video capture device.")
+        self._thread = threading.Thread(target=self._run, name='camera', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop reading frames and release the device.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._capture is not None:
+            self._capture.release()
+        return
+
+    def _run(self):
+        period = 1 / self.fps if self.fps else 0
+        while not self._stopped.is_set():
+            start = time.monotonic()
+            ret, frame = self._capture.read()
+            if not ret:
+                # end of a video file (start it again) or device error, retry later without spinning
+                if isinstance(self.source, str) and os.path.isfile(self.source):
+                    self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                time.sleep(0.1)
+                continue
+            with self._new_frame:
+                self._frames.append((time.monotonic(), frame))
+                self._new_frame.notify_all()
+            if period:
+                time.sleep(max(0, period - (time.monotonic() - start)))
+
+    def best_frame(self, max_age=1.0, timeout=2.0):
+        """
+        Get the sharpest recent frame.
+
+        Args:
+            max_age (float, optional): Only the frames captured in the last `max_age` seconds are
+                considered, so that the picture shows what is in front of the camera now. Defaults to 1.0.
+            timeout (float, optional): The maximum number of seconds to wait for a recent frame. Defaults to 2.0.
+
+        Returns:
+            numpy.ndarray or None: The sharpest recent frame, or None if no frame has been captured.
+        """
+        deadline = time.monotonic() + timeout
+        with self._new_frame:
+            while True:
+                now = time.monotonic()
+                recent = [frame for captured_at, frame in self._frames if now - captured_at <= max_age]
+                if recent or now >= deadline:
+                    break
+                self._new_frame.wait(deadline - now)
+        if not recent:
+            print("Error: Could not read frame from video capture device.")
+            return None
+        return max(recent, key=focus_measure)
@@ -0,0 +1,131 @@
+# Import all the needed libraries
+import json
+import os
+import threading
+
+
+def normalize_handle(handle):
+    """
+    Normalize a Telegram handle, handles are case insensitive and may be written with a leading '@'.
+
+    Args:
+        handle (str): The Telegram handle.
+
+    Returns:
+        str: The handle in lowercase without the leading '@'.
+    """
+    return handle.strip().lstrip('@').lower()
+
+
+class ChatIdRegistry:
+    """
+    Persistent map from the Telegram handles of the caregivers to their chat IDs.
+
+    The map is filled incrementally, by the patient helper bot when a caregiver sends
+    /start and by scanning the bot updates from the last processed offset, so that at
+    startup the chat IDs of the known caregivers are resolved without any network access.
+    """
+
+    def __init__(self, path='../chat_ids.json'):
+        """
+        Initialize the registry, loading the map from disk if it exists.
+
+        Args:
+            path (str, optional): The path of the JSON file. Defaults to '../chat_ids.json'.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.chat_ids, self.update_offset = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}, None
+        return data.get('chat_ids', {}), data.get('update_offset')
+
+    def _save(self):
+        # merge with the entries written in the meantime by the other process (e.g. the bot)
+        chat_ids, update_offset = self._load()
+        chat_ids.update(self.chat_ids)
+        self.chat_ids = chat_ids
+        if update_offset is not None and (self.update_offset is None or update_offset > self.update_offset):
+            self.update_offset = update_offset
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'chat_ids': self.chat_ids, 'update_offset': self.update_offset}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        return
+
+    def get(self, handle):
+        """
+        Get the chat ID of a handle.
+
+        Args:
+            handle (str): The Telegram handle.
+
+        Returns:
+            str or None: The chat ID, or None if the handle is not known yet.
+        """
+        return self.chat_ids.get(normalize_handle(handle))
+
+    def register(self, handle, chat_id):
+        """
+        Store the chat ID of a handle.
+
+        Args:
+            handle (str): The Telegram handle.
+            chat_id (int or str): The chat ID.
+        """
+        with self._lock:
+            self.chat_ids[normalize_handle(handle)] = str(chat_id)
+            self._save()
+        return
+
+    def scan_updates(self, client, handles=None):
+        """
+        Register the chats found in the bot updates, page by page from the last processed offset.
+
+        Args:
+            client (TelegramBotClient): The client of the Bot API.
+            handles (list, optional): If given, stop as soon as all these handles are known. Defaults to None.
+
+        Returns:
+            int: The number of updates processed.
+        """
+        processed = 0
+        with self._lock:
+            while True:
+                updates = client.get_updates(self.update_offset).get('result', [])
+                if not updates:
+                    break
+                for update in updates:
+                    message = update.get('message')
+                    if message and message['chat'].get('username'):
+                        self.chat_ids[normalize_handle(message['chat']['username'])] = str(message['chat']['id'])
+                    self.update_offset = update['update_id'] + 1
+                processed += len(updates)
+                if handles is not None and all(normalize_handle(handle) in self.chat_ids for handle in handles):
+                    break
+            if processed:
+                self._save()
+        return processed
+
+    def resolve(self, handles, client):
+        """
+        Get the chat IDs of the given handles, scanning the bot updates only if some handle is unknown.
+
+        Args:
+            handles (list): The Telegram handles.
+            client (TelegramBotClient): The client of the Bot API.
+
+        Returns:
+            list: The chat IDs, in the same order of the handles (None for the handles still unknown).
+        """
+        if any(self.get(handle) is None for handle in handles):
+            try:
+                self.scan_updates(client, handles)
+            except Exception as e:
+                print(f"Error: Could not get the bot updates: {e}")
+        return [self.get(handle) for handle in handles]
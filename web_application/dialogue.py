@@ -0,0 +1,612 @@
+# Import all the needed libraries
+import asyncio
+from collections import deque
+from concurrent.futures import Future
+import prompts
+
+# The states of the dialogue. Every state declares:
+# - background: the image shown when entering the state
+# - ask: the method called when entering the state, usually asking a question
+# - grammar: the words listened to once the question has been asked (None does not listen)
+# - words: the prefixes of the accepted answers and the methods handling them
+# - other: the method handling any other answer
+# - timeout: the seconds of silence after which `on_timeout` is called (by default the question is asked again)
+# "aiuto" is accepted in every state, also while the assistant is speaking, unless it is
+# saying "aiuto" itself.
+STATES = {
+    'idle': {
+        'background': 'background.jpg',
+        'ask': 'wait_dose',
+        'grammar': 'idle'
+    },
+    'feelings': {
+        'background': 'medication_background.jpg',
+        'ask': 'ask_feelings',
+        'grammar': 'feelings',
+        'words': {'ben': 'feel_good', 'mal': 'feel_bad'},
+        'other': 'not_understood_feelings',
+        'timeout': 60
+    },
+    'confirmation': {
+        'background': 'medication_sad_background.jpg',
+        'ask': 'ask_help',
+        'grammar': 'confirmation',
+        'words': {'sì': 'accept_help', 'no': 'refuse_help'},
+        'other': 'not_understood_yes_no',
+        'timeout': 60
+    },
+    'plan_info': {
+        'background': 'medication_background.jpg',
+        'ask': 'tell_plan'
+    },
+    'photo': {
+        'background': 'photo_background.jpg',
+        'ask': 'ask_box',
+        'grammar': 'photo',
+        'words': {'foto': 'take_picture'},
+        'timeout': 60
+    },
+    'recognition': {
+        'background': 'photo_background.jpg',
+        'ask': 'recognize_box',
+        'grammar': 'idle',
+        'timeout': 30,
+        'on_timeout': 'recognition_timeout'
+    },
+    'next': {
+        'background': 'medication_happy_background.jpg',
+        'ask': 'tell_quantity',
+        'grammar': 'next',
+        'words': {'avanti': 'next_medication'},
+        'timeout': 60
+    },
+    'goodbye': {
+        'background': 'medication_background.jpg',
+        'ask': 'say_goodbye'
+    },
+    'recap': {
+        'ask': 'send_recap'
+    }
+}
+
+
+class Event:
+    """
+    An input of the dialogue: a recognized utterance ('speech'), a due dose ('dose'), the end
+    of a speech ('speech_done'), the result of a box recognition ('recognition') or an expired
+    timer ('timeout'). The internal events carry the token of the action that produced them,
+    so that the results of the actions that are no longer awaited are ignored.
+    """
+
+    def __init__(self, kind, value=None, token=None):
+        self.kind = kind
+        self.value = value
+        self.token = token
+
+    def __repr__(self):
+        return f"Event({self.kind!r}, {self.value!r})"
+
+
+class DialogueEffects:
+    """
+    Interface of the actions of the dialogue on the outside world. The slow actions return a
+    concurrent.futures.Future, so that the dialogue keeps handling the inputs while they run.
+    """
+
+    def say(self, text):
+        """Queue a speech, the future is resolved with True when played to the end, False if cancelled."""
+        raise NotImplementedError
+
+    def cancel_speech(self):
+        """Stop the speech being played and drop the queued ones."""
+        raise NotImplementedError
+
+    def listen(self, grammar):
+        """Listen to the words of a grammar."""
+        raise NotImplementedError
+
+    def pause_listening(self):
+        """Stop listening."""
+        raise NotImplementedError
+
+    def background(self, image, idle):
+        """Show a background image, with the therapy plan if idle."""
+        raise NotImplementedError
+
+    def recognize(self, medication):
+        """Take a picture and recognize the box, the future is resolved with the result of the recognition."""
+        raise NotImplementedError
+
+    def save_picture(self, day, medication, recognition):
+        """Save the picture of a recognized box."""
+        raise NotImplementedError
+
+    def delete_pictures(self, day):
+        """Delete the pictures of a day."""
+        raise NotImplementedError
+
+    def send_help(self, patient):
+        """Send a help message to the caregivers."""
+        raise NotImplementedError
+
+    def send_recap(self, patient, feeling, day, wrong_boxes):
+        """Send the recap of a dose to the caregivers."""
+        raise NotImplementedError
+
+    def record(self, patient, dose, kind, **fields):
+        """Append an event of the dose (None outside of a dose) to the adherence log."""
+        raise NotImplementedError
+
+
+class DialogueMachine:
+    """
+    State machine of the dialogue with the patient.
+
+    The states are declared in STATES, the machine only reacts to one event at a time and
+    never blocks: speeches, recognitions and notifications are started through the effects
+    and their results come back as events. The events are posted through `post` and the
+    timers started through `call_later`, both set by whoever drives the machine (the asyncio
+    runner or the replay harness).
+    """
+
+    def __init__(self, patient, effects):
+        """
+        Initialize the machine, in the idle state.
+
+        Args:
+            patient (dict): The patient data.
+            effects (DialogueEffects): The actions on the outside world.
+        """
+        self.patient = patient
+        self.effects = effects
+        self.post = None
+        self.call_later = None
+        self.state = None
+        self.history = []
+        self.pending_doses = deque()
+        self.dose = None
+        self.index = 0
+        self.feeling = None
+        self.wrong_boxes = []
+        self._token = 0
+        self._speech_token = None
+        self._then = None
+        self._self_hearing = False
+        self._timer_token = None
+        self._recognition_token = None
+
+    def attach(self, post, call_later):
+        """
+        Attach the machine to its driver and enter the idle state.
+
+        Args:
+            post (callable): Called with an Event to deliver it to `handle`, from any thread.
+            call_later (callable): Called with a number of seconds and an Event to deliver it later.
+        """
+        self.post = post
+        self.call_later = call_later
+        self.enter('idle')
+
+    def _next_token(self):
+        self._token += 1
+        return self._token
+
+    def _resolve(self, future, kind):
+        """Post the result of a future as an event, with a new token that is returned."""
+        token = self._next_token()
+
+        def done(future):
+            if future.cancelled():
+                result = None
+            elif future.exception() is not None:
+                print(f"Error: {kind} failed: {future.exception()}")
+                result = None
+            else:
+                result = future.result()
+            self.post(Event(kind, result, token))
+        future.add_done_callback(done)
+        return token
+
+    def record(self, kind, **fields):
+        """Append an event of the current dose to the adherence log."""
+        self.effects.record(self.patient, self.dose, kind, **fields)
+
+    @property
+    def speaking(self):
+        return self._speech_token is not None
+
+    def enter(self, state):
+        """
+        Enter a state: show its background and call its `ask` method.
+
+        Args:
+            state (str): The name of the state.
+        """
+        self.state = state
+        self.history.append(state)
+        self._timer_token = None
+        spec = STATES[state]
+        if 'background' in spec:
+            self.effects.background(spec['background'], state == 'idle')
+        getattr(self, spec['ask'])()
+
+    def say(self, *texts, then=None):
+        """
+        Say some texts, then enter the state `then`, or listen in the current state if None.
+        While speaking only "aiuto" is listened to, unless one of the texts contains it.
+
+        Args:
+            *texts (str): The texts to be said, queued back to back.
+            then (str, optional): The state entered when the last text has been said. Defaults to None.
+        """
+        self._timer_token = None
+        # the assistant would hear itself, and send a help message to the caregivers
+        self._self_hearing = any('aiuto' in text.lower() for text in texts)
+        if self._self_hearing:
+            self.effects.pause_listening()
+        else:
+            self.effects.listen('idle')
+        for text in texts:
+            future = self.effects.say(text)
+        self._then = then
+        self._speech_token = self._resolve(future, 'speech_done')
+
+    def listen(self):
+        """
+        Listen to the answers of the current state, starting its timer.
+        """
+        spec = STATES[self.state]
+        if spec.get('grammar') is None:
+            self.effects.pause_listening()
+            return
+        self.effects.listen(spec['grammar'])
+        if 'timeout' in spec:
+            self._timer_token = self._next_token()
+            self.call_later(spec['timeout'], Event('timeout', self.state, self._timer_token))
+
+    def handle(self, event):
+        """
+        Handle an event.
+
+        Args:
+            event (Event): The event.
+        """
+        if event.kind == 'speech':
+            self._handle_speech(event.value or '')
+        elif event.kind == 'dose':
+            self.pending_doses.append(event.value)
+            if self.state == 'idle' and not self.speaking:
+                self.wait_dose()
+        elif event.kind == 'speech_done':
+            if event.token != self._speech_token:
+                return
+            self._speech_token = None
+            then, self._then = self._then, None
+            if then is not None:
+                self.enter(then)
+            else:
+                self.listen()
+        elif event.kind == 'recognition':
+            if event.token == self._recognition_token:
+                self._recognition_token = None
+                self.check_box(event.value or {'outcome': 'unreadable', 'medication': None})
+        elif event.kind == 'timeout':
+            if event.token == self._timer_token and not self.speaking:
+                self._timer_token = None
+                spec = STATES[self.state]
+                if 'on_timeout' in spec:
+                    getattr(self, spec['on_timeout'])()
+                else:
+                    self.enter(self.state)
+
+    def _handle_speech(self, text):
+        words = text.lower().split()
+        if self.speaking and self._self_hearing:
+            # recognized from the speech of the assistant, before the listening was paused
+            return
+        if 'aiuto' in words:
+            self.help()
+            return
+        spec = STATES[self.state]
+        if self.speaking or spec.get('grammar') is None or not words:
+            return
+        for prefix, action in spec.get('words', {}).items():
+            if any(word.startswith(prefix) for word in words):
+                getattr(self, action)()
+                return
+        if 'other' in spec:
+            getattr(self, spec['other'])()
+
+    def help(self, then=None):
+        """
+        Send a help message and tell the patient, interrupting the assistant. Then continue from
+        where the dialogue was: the state that would have been entered after the interrupted
+        speech, or the current one (asking its question again). A recognition in progress goes on.
+
+        Args:
+            then (str, optional): The state entered after the help instead. Defaults to None.
+        """
+        if then is None and self.speaking:
+            then = self._then
+        if then is None and self.state != 'recognition':
+            then = self.state
+        self.effects.cancel_speech()
+        self.effects.send_help(self.patient)
+        self.record('help', outcome=self.state)
+        self.effects.background('alert_background.jpg', False)
+        self.say(prompts.help_request_text(self.patient), prompts.help_sent_text(self.patient), then=then)
+
+    # idle
+
+    def wait_dose(self):
+        if self.pending_doses:
+            self.start_dose(self.pending_doses.popleft())
+        else:
+            self.listen()
+
+    def start_dose(self, dose):
+        self.dose = dose
+        self.index = 0
+        self.feeling = None
+        self.wrong_boxes = []
+        self.effects.delete_pictures(dose['day'])
+        for medication, _ in dose['medications']:
+            self.record('dose_start', medication=medication)
+        self.enter('feelings')
+
+    # feelings
+
+    def ask_feelings(self):
+        self.say(prompts.greeting_text(self.patient))
+
+    def feel_good(self):
+        self.feeling = 'bene'
+        self.record('feeling', outcome='bene')
+        self.effects.background('medication_happy_background.jpg', False)
+        self.say(prompts.feeling_good_text(self.patient), then='plan_info')
+
+    def feel_bad(self):
+        self.feeling = 'male'
+        self.record('feeling', outcome='male')
+        self.enter('confirmation')
+
+    def not_understood_feelings(self):
+        self.say(prompts.NOT_UNDERSTOOD_FEELINGS)
+
+    # confirmation
+
+    def ask_help(self):
+        self.say(prompts.feeling_bad_text(self.patient))
+
+    def accept_help(self):
+        self.record('confirmation', outcome='yes')
+        self.help(then='plan_info')
+
+    def refuse_help(self):
+        self.record('confirmation', outcome='no')
+        self.enter('plan_info')
+
+    def not_understood_yes_no(self):
+        self.say(prompts.NOT_UNDERSTOOD_YES_NO)
+
+    # plan_info
+
+    def tell_plan(self):
+        self.say(prompts.therapy_plan_info_text(self.patient, self.dose['medications']), prompts.THERAPY_PLAN_RULES, then='photo')
+
+    # photo
+
+    def ask_box(self):
+        medication, _ = self.dose['medications'][self.index]
+        self.say(prompts.medication_instructions_text(medication))
+
+    def take_picture(self):
+        self.enter('recognition')
+
+    # recognition
+
+    def recognize_box(self):
+        medication, _ = self.dose['medications'][self.index]
+        self._recognition_token = self._resolve(self.effects.recognize(medication), 'recognition')
+        self.listen()
+
+    def recognition_timeout(self):
+        self._recognition_token = None
+        self.check_box({'outcome': 'unreadable', 'medication': None, 'timeout': True})
+
+    def check_box(self, recognition):
+        medication, _ = self.dose['medications'][self.index]
+        self.record(
+            'ocr_attempt', medication=medication, outcome=recognition['outcome'], score=recognition.get('score'),
+            latency_ms=recognition.get('latency_ms'),
+            detail='timeout' if recognition.get('timeout') else recognition['medication'] if recognition['outcome'] == 'wrong' else None
+        )
+        if recognition['outcome'] == 'correct':
+            self.record('taken', medication=medication)
+            self.effects.save_picture(self.dose['day'], medication, recognition)
+            self.enter('next')
+            return
+        self.effects.background('medication_sad_background.jpg', False)
+        # back to the photo state, without repeating the instructions
+        self.state = 'photo'
+        self.history.append('photo')
+        if recognition['outcome'] == 'wrong':
+            if recognition['medication'] is None:
+                # a dosage that is not in the therapy plans, its name is not known
+                self.wrong_boxes.append((prompts.OTHER_DOSAGE, medication))
+                self.say(prompts.WRONG_DOSAGE_BOX)
+            else:
+                self.wrong_boxes.append((recognition['medication'], medication))
+                self.say(prompts.wrong_box_text(recognition['medication'], medication))
+        else:
+            self.say(prompts.UNREADABLE_BOX)
+
+    # next
+
+    def tell_quantity(self):
+        _, quantity = self.dose['medications'][self.index]
+        self.say(prompts.correct_box_text(self.patient, quantity))
+
+    def next_medication(self):
+        self.index += 1
+        if self.index < len(self.dose['medications']):
+            self.enter('photo')
+        else:
+            self.enter('goodbye')
+
+    # goodbye
+
+    def say_goodbye(self):
+        self.say(prompts.goodbye_text(self.patient), then='recap')
+
+    def send_recap(self):
+        self.effects.send_recap(self.patient, self.feeling or 'bene', self.dose['day'], list(self.wrong_boxes))
+        self.record('dose_end')
+        self.dose = None
+        self.enter('idle')
+
+
+async def run_dialogue(machine, listener, scheduler, listen_timeout=0.5, check_interval=5.0, patient_id=None):
+    """
+    Drive the dialogue machine with an asyncio event loop: the utterances of the listener and
+    the doses of the scheduler are read by concurrent tasks and delivered as events, together
+    with the results of the actions of the machine and its timers, one at a time.
+
+    Args:
+        machine (DialogueMachine): The dialogue machine.
+        listener (SpeechListener): The speech listener.
+        scheduler (DoseScheduler): The dose scheduler.
+        listen_timeout (float, optional): The maximum seconds of a single read of the listener. Defaults to 0.5.
+        check_interval (float, optional): The maximum seconds between two checks of the scheduler,
+            so that changes of the therapy plans are noticed. Defaults to 5.0.
+        patient_id (str, optional): The patient whose doses are delivered. Defaults to None (any patient).
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def post(event):
+        loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def call_later(seconds, event):
+        loop.call_later(seconds, queue.put_nowait, event)
+
+    async def read_speech():
+        while True:
+            text = await loop.run_in_executor(None, listener.listen, listen_timeout)
+            if text:
+                queue.put_nowait(Event('speech', text))
+
+    async def watch_doses():
+        # the checks may reload the therapy plans and write the missed doses, out of the loop
+        while True:
+            dose = await loop.run_in_executor(None, scheduler.due, patient_id)
+            if dose is not None:
+                queue.put_nowait(Event('dose', dose))
+                continue
+            seconds = await loop.run_in_executor(None, scheduler.seconds_to_next, patient_id)
+            await asyncio.sleep(check_interval if seconds is None else min(seconds, check_interval))
+
+    machine.attach(post, call_later)
+    tasks = [asyncio.create_task(read_speech()), asyncio.create_task(watch_doses())]
+    try:
+        while True:
+            event = await queue.get()
+            machine.handle(event)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class ScriptedEffects(DialogueEffects):
+    """
+    Effects of the replay harness: every action is recorded, the speeches end at once and the
+    recognitions wait for the results written in the trace.
+    """
+
+    def __init__(self):
+        self.actions = []
+        self.recognitions = deque()
+
+    def _done(self, result):
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def say(self, text):
+        self.actions.append(('say', text))
+        return self._done(True)
+
+    def cancel_speech(self):
+        self.actions.append(('cancel_speech',))
+
+    def listen(self, grammar):
+        self.actions.append(('listen', grammar))
+
+    def pause_listening(self):
+        self.actions.append(('pause_listening',))
+
+    def background(self, image, idle):
+        self.actions.append(('background', image))
+
+    def recognize(self, medication):
+        self.actions.append(('recognize', medication))
+        future = Future()
+        self.recognitions.append(future)
+        return future
+
+    def save_picture(self, day, medication, recognition):
+        self.actions.append(('save_picture', day, medication))
+
+    def delete_pictures(self, day):
+        self.actions.append(('delete_pictures', day))
+
+    def send_help(self, patient):
+        self.actions.append(('send_help', patient['name']))
+
+    def send_recap(self, patient, feeling, day, wrong_boxes):
+        self.actions.append(('send_recap', patient['name'], feeling, day, [list(box) for box in wrong_boxes]))
+
+    def record(self, patient, dose, kind, **fields):
+        self.actions.append(('record', kind, fields.get('medication'), fields.get('outcome')))
+
+
+def replay(trace, patient):
+    """
+    Replay a scripted trace of inputs on a new dialogue machine, deterministically and without
+    any device: after every input all the events it produces are handled before the next one.
+
+    Args:
+        trace (list): The inputs, dicts with one key among 'speech' (the recognized text), 'dose'
+            (the due dose), 'recognition' (the result of the pending box recognition) and 'timeout'
+            (the last timer started expires).
+        patient (dict): The patient data.
+
+    Returns:
+        dict: The 'states' entered and the 'actions' done by the machine.
+    """
+    effects = ScriptedEffects()
+    machine = DialogueMachine(patient, effects)
+    events = deque()
+    timers = []
+    machine.attach(events.append, lambda seconds, event: timers.append(event))
+
+    def drain():
+        while events:
+            machine.handle(events.popleft())
+
+    drain()
+    for step in trace:
+        if 'speech' in step:
+            events.append(Event('speech', step['speech']))
+        elif 'dose' in step:
+            events.append(Event('dose', step['dose']))
+        elif 'recognition' in step:
+            # the last recognition started, the previous ones are no longer awaited
+            if effects.recognitions:
+                effects.recognitions.pop().set_result(step['recognition'])
+                effects.recognitions.clear()
+        elif 'timeout' in step:
+            if timers:
+                events.append(timers[-1])
+        drain()
+    return {'states': machine.history, 'actions': effects.actions}
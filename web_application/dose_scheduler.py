@@ -0,0 +1,175 @@
+# Import all the needed libraries
+import datetime
+import heapq
+import threading
+from collections import deque
+from therapy_plan_store import DAYS, TherapyPlanStore, hour_to_minute
+
+
+class DoseScheduler:
+    """
+    Scheduler of the doses of the therapy plans of all the patients.
+
+    The upcoming doses of today and tomorrow of every patient are kept in a priority
+    queue ordered by time, so checking whether a dose is due is a look at the head of
+    the queue. Every dose is returned exactly once, also if it is checked late, as long
+    as it is not later than the grace period: a dose missed by more than that (e.g. while
+    the system was off) is dropped and reported as missed. The queue of a patient is
+    rebuilt when its therapy plans change, and extended at every day rollover. The doses
+    already returned by a previous run (e.g. in the adherence log) can be given at start,
+    so that a restart within the grace period does not return them again, and the doses
+    after the last of them, missed while the system was off, are reported as missed.
+    """
+
+    def __init__(self, therapy_plan_stores, grace_period=900, clock=datetime.datetime.now, on_missed=None, max_missed=100, fired=(), max_catch_up=7 * 86400):
+        """
+        Initialize the scheduler, the doses of the last `grace_period` seconds are still due.
+
+        Args:
+            therapy_plan_stores (dict or TherapyPlanStore): The stores with the therapy plans of the week
+                by patient ID, read again at every check so that the patients can be added and removed.
+                A single store is the store of the patient None.
+            grace_period (float, optional): The maximum delay in seconds of a due dose. Defaults to 900.
+            clock (callable, optional): The function returning the current local time as a naive
+                datetime, replaced to simulate the time. Defaults to datetime.datetime.now.
+            on_missed (callable, optional): Called with every missed dose (its 'patient_id', 'day',
+                'date', 'time' and 'medications'), e.g. to record it in the adherence log. Defaults to None.
+            max_missed (int, optional): The number of recent missed doses kept in `missed`. Defaults to 100.
+            fired (iterable, optional): The (patient ID, 'YYYY-MM-DD', 'HH:MM') of the doses already
+                returned or missed, e.g. before a restart, that are not returned again. Defaults to ().
+            max_catch_up (float, optional): The maximum seconds before the start of the doses reported as
+                missed after the last fired dose of a patient. Defaults to 7 days.
+        """
+        if isinstance(therapy_plan_stores, TherapyPlanStore):
+            therapy_plan_stores = {None: therapy_plan_stores}
+        self.stores = therapy_plan_stores
+        self.grace_period = datetime.timedelta(seconds=grace_period)
+        self.clock = clock
+        self.on_missed = on_missed
+        self.missed = deque(maxlen=max_missed)
+        self._lock = threading.Lock()
+        self._events = {}
+        self._fired = set(fired)
+        self.max_catch_up = datetime.timedelta(seconds=max_catch_up)
+        # the last fired dose of every patient, the doses after it were missed while the system was off
+        self._resume_at = {}
+        for patient_id, date, hour in self._fired:
+            minute = hour_to_minute(hour)
+            at = datetime.datetime.combine(datetime.date.fromisoformat(date), datetime.time(minute // 60, minute % 60))
+            self._resume_at[patient_id] = max(at, self._resume_at.get(patient_id, at))
+        self._versions = {}
+        self._scheduled_until = {}
+        self._start = self.clock() - self.grace_period
+
+    def _schedule_day(self, patient_id, date, start):
+        day = DAYS[date.weekday()]
+        for hour in self.stores[patient_id].get_plan(day):
+            minute = hour_to_minute(hour)
+            at = datetime.datetime.combine(date, datetime.time(minute // 60, minute % 60))
+            key = (patient_id, date.isoformat(), hour)
+            if at >= start and key not in self._fired:
+                heapq.heappush(self._events[patient_id], (at, key, day, hour))
+
+    def _update(self, now):
+        tomorrow = now.date() + datetime.timedelta(days=1)
+        stores = dict(self.stores)
+        for patient_id in list(self._events):
+            if patient_id not in stores:
+                del self._events[patient_id], self._versions[patient_id], self._scheduled_until[patient_id]
+        for patient_id, store in stores.items():
+            # the store reloads the changed files, a new version means new doses
+            store.refresh()
+            if self._versions.get(patient_id) != store.version:
+                first = patient_id not in self._versions
+                self._versions[patient_id] = store.version
+                self._events[patient_id] = []
+                start = max(self._start, now - self.grace_period)
+                if first and patient_id in self._resume_at:
+                    # from the last dose of the previous run, the ones before the grace period are missed
+                    start = min(start, max(self._resume_at.pop(patient_id), now - self.max_catch_up))
+                date = start.date()
+                while date <= tomorrow:
+                    self._schedule_day(patient_id, date, start)
+                    date += datetime.timedelta(days=1)
+                self._scheduled_until[patient_id] = tomorrow
+            while self._scheduled_until[patient_id] < tomorrow:
+                self._scheduled_until[patient_id] += datetime.timedelta(days=1)
+                self._schedule_day(patient_id, self._scheduled_until[patient_id], self._start)
+        # the doses fired before the grace period, or the catch up at start, can not be scheduled again
+        horizon = (now - max(self.grace_period, self.max_catch_up) - datetime.timedelta(days=1)).date().isoformat()
+        self._fired = {key for key in self._fired if key[1] >= horizon}
+
+    def _queues(self, patient_id):
+        if patient_id is None:
+            return list(self._events.items())
+        return [(patient_id, self._events[patient_id])] if patient_id in self._events else []
+
+    def due(self, patient_id=None):
+        """
+        Get the next dose to be taken, if its time has come.
+
+        Args:
+            patient_id (str, optional): The patient of the dose. Defaults to None (any patient).
+
+        Returns:
+            dict or None: The 'patient_id', 'day', 'date', 'time' ('HH:MM'), 'medications' and 'delay'
+                in seconds of the due dose, or None if no dose is due.
+        """
+        missed = []
+        try:
+            with self._lock:
+                return self._next_due(patient_id, missed)
+        finally:
+            # reported outside of the lock, so that a slow callback does not block the other checks
+            for dose in missed:
+                self.missed.append(dose)
+                if self.on_missed is not None:
+                    self.on_missed(dose)
+
+    def _next_due(self, patient_id, missed):
+        now = self.clock()
+        self._update(now)
+        while True:
+            heads = [(events[0][0], patient) for patient, events in self._queues(patient_id) if events]
+            if not heads:
+                return None
+            at, patient = min(heads, key=lambda head: head[0])
+            if at > now:
+                return None
+            at, key, day, hour = heapq.heappop(self._events[patient])
+            if key in self._fired:
+                continue
+            self._fired.add(key)
+            medications = self.stores[patient].get_plan(day).get(hour)
+            if not medications:
+                continue
+            if now - at > self.grace_period:
+                print(f"Error: The dose of {day} at {hour} has been missed.")
+                missed.append({'patient_id': patient, 'day': day, 'date': key[1], 'time': hour, 'medications': medications})
+                continue
+            return {
+                'patient_id': patient,
+                'day': day,
+                'date': key[1],
+                'time': hour,
+                'medications': medications,
+                'delay': (now - at).total_seconds()
+            }
+
+    def seconds_to_next(self, patient_id=None):
+        """
+        Get the time left before the next dose.
+
+        Args:
+            patient_id (str, optional): The patient of the dose. Defaults to None (any patient).
+
+        Returns:
+            float or None: The seconds to the next dose (0 if one is due), or None if no dose is scheduled.
+        """
+        with self._lock:
+            now = self.clock()
+            self._update(now)
+            heads = [events[0][0] for _, events in self._queues(patient_id) if events]
+            if not heads:
+                return None
+            return max(0.0, (min(heads) - now).total_seconds())
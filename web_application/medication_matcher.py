@@ -0,0 +1,186 @@
+# Import all the needed libraries
+import re
+import unicodedata
+import numpy as np
+from rapidfuzz import fuzz, process
+
+# dosages printed on the boxes next to the name (e.g. '500 mg', '2,5ml', '1000 UI')
+DOSAGE_PATTERN = re.compile(r'\b\d+(?:[.,]\d+)?\s*(?:mg|g|ml|mcg|ug|ui|iu|%)(?=\s|$)')
+# any number, with its unit if printed (e.g. '1000' in 'tachipirina 1000')
+NUMBER_PATTERN = re.compile(r'\b(\d+(?:[.,]\d+)?)\s*(mg|g|ml|mcg|ug|ui|iu|%)?(?=\s|$)')
+
+
+def normalize_text(text):
+    """
+    Normalize a text for the comparison: lowercase, without accents and punctuation.
+
+    Args:
+        text (str): The text to be normalized.
+
+    Returns:
+        str: The normalized text, words separated by a single space.
+    """
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r'[^a-z0-9%., ]+', ' ', text)
+    return ' '.join(text.split())
+
+
+def get_dosages(text):
+    """
+    Get the dosages in a text, as the numbers without their unit.
+
+    Args:
+        text (str): The text, normalized.
+
+    Returns:
+        set: The numbers (e.g. {'1000'} for 'tachipirina 1000 mg'), with '.' as decimal separator.
+    """
+    return {number.replace(',', '.') for number, _ in NUMBER_PATTERN.findall(text)}
+
+
+def get_base_name(medication):
+    """
+    Get the normalized name of a medication without any dosage, the same for all its dosages.
+
+    Args:
+        medication (str): The name of the medication as written in the therapy plan.
+
+    Returns:
+        str: The base name (e.g. 'tachipirina' for 'Tachipirina 1000 mg').
+    """
+    return ' '.join(NUMBER_PATTERN.sub(' ', normalize_text(medication)).replace(',', ' ').replace('.', ' ').split())
+
+
+def get_name_variants(medication):
+    """
+    Get the normalized variants of a medication name that can be read on its box.
+
+    Args:
+        medication (str): The name of the medication as written in the therapy plan.
+
+    Returns:
+        list: The variants without duplicates: the full name, the name without the dosage and without spaces.
+    """
+    full_name = normalize_text(medication)
+    without_dosage = ' '.join(DOSAGE_PATTERN.sub(' ', full_name).replace(',', ' ').replace('.', ' ').split())
+    variants = [full_name, without_dosage, without_dosage.replace(' ', '')]
+    return list(dict.fromkeys(variant for variant in variants if variant))
+
+
+class MedicationMatcher:
+    """
+    Matcher of the text read on a box against all the medications of the week.
+
+    The name variants of every medication are computed once, and all the lines read by
+    the OCR are scored against all the variants in a single batched pass, so that the
+    box shown can be identified even when it is not the expected one. The dosages of the
+    same medication have the same name, they are told apart by the dosages read on any
+    line of the box.
+    """
+
+    def __init__(self, medications, min_length_ratio=0.6):
+        """
+        Initialize the matcher.
+
+        Args:
+            medications (list): The names of the medications.
+            min_length_ratio (float, optional): The minimum ratio between the length of a line and
+                of a variant for them to be compared, so that short fragments (e.g. 'mg') do not
+                match inside a long name. Defaults to 0.6.
+        """
+        self.medications = list(dict.fromkeys(medications))
+        self.min_length_ratio = min_length_ratio
+        self._dosages = {medication: get_dosages(normalize_text(medication)) for medication in self.medications}
+        self._base_names = {medication: get_base_name(medication) for medication in self.medications}
+        self._variants = []
+        self._owners = []
+        for index, medication in enumerate(self.medications):
+            for variant in get_name_variants(medication):
+                self._variants.append(variant)
+                self._owners.append(index)
+        self._owners = np.array(self._owners, dtype=np.intp)
+        self._variant_lengths = np.array([len(variant) for variant in self._variants], dtype=np.float32)
+
+    def match(self, lines):
+        """
+        Find the medication whose name best matches the lines read on the box.
+
+        Args:
+            lines (list): The lines of text read by the OCR.
+
+        Returns:
+            dict: The best 'medication' (None if nothing matches), its 'score' (0-100), the
+                matching 'text' and the best score of every medication in 'scores'.
+        """
+        lines = [line for line in (normalize_text(line) for line in lines) if line]
+        scores = {medication: 0.0 for medication in self.medications}
+        if not lines or not self._variants:
+            return {'medication': None, 'score': 0.0, 'text': None, 'scores': scores}
+        # one row for every line, one column for every variant
+        matrix = process.cdist(lines, self._variants, scorer=fuzz.partial_ratio, dtype=np.float32, workers=-1)
+        line_lengths = np.array([len(line) for line in lines], dtype=np.float32)
+        matrix[line_lengths[:, None] < self.min_length_ratio * self._variant_lengths[None, :]] = 0
+        best_per_variant = matrix.max(axis=0)
+        best_per_medication = np.zeros(len(self.medications), dtype=np.float32)
+        np.maximum.at(best_per_medication, self._owners, best_per_variant)
+        for index, medication in enumerate(self.medications):
+            scores[medication] = float(best_per_medication[index])
+        best_line, best_variant = np.unravel_index(np.argmax(matrix), matrix.shape)
+        return {
+            'medication': self.medications[self._owners[best_variant]] if matrix[best_line, best_variant] > 0 else None,
+            'score': float(matrix[best_line, best_variant]),
+            'text': lines[best_line],
+            'scores': scores
+        }
+
+    def recognize(self, lines, expected, threshold=80):
+        """
+        Tell whether the lines read on the box show the expected medication.
+
+        Args:
+            lines (list): The lines of text read by the OCR.
+            expected (str): The medication that should be shown.
+            threshold (int, optional): The minimum score of a match. Defaults to 80.
+
+        Returns:
+            dict: The result of `match` with the 'outcome': 'correct' if the expected medication
+                matches, 'wrong' if another medication or another dosage of the expected one
+                matches, 'unreadable' otherwise. The 'medication' of a box of a dosage that is not
+                in the therapy plans is None, a box without any dosage is 'unreadable' when the
+                week has several dosages of the expected medication.
+        """
+        result = self.match(lines)
+        expected_dosages = self._dosages.get(expected, get_dosages(normalize_text(expected)))
+        # only the numbers with a unit, the boxes print other numbers too (e.g. '20 compresse')
+        read_dosages = {
+            number.replace(',', '.')
+            for line in lines for number, unit in NUMBER_PATTERN.findall(normalize_text(line)) if unit
+        }
+        # a box of another dosage has the same name, only the dosage tells it apart
+        other_dosage = bool(expected_dosages) and bool(read_dosages) and not expected_dosages & read_dosages
+        base_name = self._base_names.get(expected, get_base_name(expected))
+        # without any dosage read, the box may be of any dosage of the week
+        ambiguous = result['scores'].get(expected, 0) >= threshold and not read_dosages and any(
+            medication != expected and self._base_names[medication] == base_name for medication in self.medications
+        )
+        if ambiguous:
+            result['outcome'] = 'unreadable'
+        elif result['scores'].get(expected, 0) >= threshold and not other_dosage:
+            result['outcome'] = 'correct'
+            result['medication'] = expected
+            result['score'] = result['scores'][expected]
+        elif result['scores'].get(expected, 0) >= threshold and other_dosage:
+            # the dosage of the week with the dosage read, the other numbers may be of the excipients
+            result['outcome'] = 'wrong'
+            result['medication'] = next((
+                medication for medication in self.medications
+                if medication != expected and self._base_names[medication] == base_name
+                and self._dosages[medication] & (read_dosages - expected_dosages)
+            ), None)
+            result['score'] = result['scores'][expected]
+        elif result['medication'] is not None and result['medication'] != expected and result['score'] >= threshold:
+            result['outcome'] = 'wrong'
+        else:
+            result['outcome'] = 'unreadable'
+        return result
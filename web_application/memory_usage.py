@@ -0,0 +1,19 @@
+def rss_mb(pid=None):
+    """
+    Get the resident memory of a process, read from /proc.
+
+    Args:
+        pid (int, optional): The process ID. Defaults to None (this process).
+
+    Returns:
+        float or None: The resident set size in MB, None if it can not be read (e.g. the
+            process exited, or the system has no /proc).
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        return None
+    return None
@@ -0,0 +1,186 @@
+# Import all the needed libraries
+import sqlite3
+import threading
+import time
+
+PRIORITY_HELP = 0
+PRIORITY_RECAP = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    chat_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    delivered_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_due ON messages (status, priority, next_attempt_at);
+"""
+
+
+class NotificationOutbox:
+    """
+    Durable queue of the messages to the caregivers.
+
+    The messages are stored in SQLite before being sent, so the caller returns immediately
+    and a restart never loses a pending alert. A background worker delivers the due
+    messages, help requests before recaps, retrying the failures with exponential backoff
+    and keeping the delivery state of every message.
+    """
+
+    def __init__(self, client, path='../notifications.db', max_attempts=10, base_delay=2.0, max_delay=300.0, batch_size=16):
+        """
+        Initialize the outbox, creating the database if needed.
+
+        Args:
+            client (TelegramBotClient): The client used to deliver the messages.
+            path (str, optional): The path of the SQLite database. Defaults to '../notifications.db'.
+            max_attempts (int, optional): The number of attempts before a message is marked as failed. Defaults to 10.
+            base_delay (float, optional): The delay in seconds before the first retry, doubled at every attempt. Defaults to 2.0.
+            max_delay (float, optional): The maximum delay in seconds between two attempts. Defaults to 300.0.
+            batch_size (int, optional): The maximum number of messages sent concurrently. Defaults to 16.
+        """
+        self.client = client
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._thread = None
+
+    def enqueue(self, kind, chat_ids, text, priority=PRIORITY_RECAP):
+        """
+        Store a message for each chat, to be delivered by the worker.
+
+        Args:
+            kind (str): The kind of message (e.g. 'help' or 'recap').
+            chat_ids (list): The chat IDs to send the message to.
+            text (str): The message to be sent.
+            priority (int, optional): The priority, lower values are delivered first. Defaults to PRIORITY_RECAP.
+
+        Returns:
+            list: The identifiers of the stored messages.
+        """
+        now = time.time()
+        ids = []
+        with self._lock:
+            self._connection.execute('BEGIN')
+            for chat_id in chat_ids:
+                cursor = self._connection.execute(
+                    'INSERT INTO messages (kind, priority, chat_id, text, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                    (kind, priority, str(chat_id), text, now, now)
+                )
+                ids.append(cursor.lastrowid)
+            self._connection.execute('COMMIT')
+        self._wake_up.set()
+        return ids
+
+    def get_status(self, message_id):
+        """
+        Get the delivery state of a message.
+
+        Args:
+            message_id (int): The identifier of the message.
+
+        Returns:
+            dict or None: The message with its status, attempts and last error, or None if it does not exist.
+        """
+        with self._lock:
+            cursor = self._connection.execute('SELECT * FROM messages WHERE id = ?', (message_id,))
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+        return dict(zip(columns, row)) if row else None
+
+    def pending_count(self):
+        """
+        Get the number of messages still to be delivered.
+
+        Returns:
+            int: The number of pending messages.
+        """
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM messages WHERE status = 'pending'").fetchone()[0]
+
+    def start(self):
+        """
+        Start the background worker delivering the messages.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='notification-outbox', daemon=True)
+            self._thread.start()
+        return self
+
+    def _next_batch(self):
+        # only the most urgent priority among the due messages is sent, so help requests never wait for recaps
+        with self._lock:
+            return self._connection.execute(
+                """SELECT id, chat_id, text, attempts FROM messages
+                   WHERE status = 'pending' AND next_attempt_at <= ? AND priority = (
+                       SELECT MIN(priority) FROM messages WHERE status = 'pending' AND next_attempt_at <= ?)
+                   ORDER BY id LIMIT ?""",
+                (time.time(), time.time(), self.batch_size)
+            ).fetchall()
+
+    def _seconds_to_next_attempt(self):
+        with self._lock:
+            next_attempt_at = self._connection.execute(
+                "SELECT MIN(next_attempt_at) FROM messages WHERE status = 'pending'"
+            ).fetchone()[0]
+        if next_attempt_at is None:
+            return None
+        return max(0.0, next_attempt_at - time.time())
+
+    def _record(self, message_id, attempts, response=None, error=None):
+        attempts += 1
+        now = time.time()
+        with self._lock:
+            if error is None and response.get('ok'):
+                self._connection.execute(
+                    "UPDATE messages SET status = 'delivered', attempts = ?, delivered_at = ?, last_error = NULL WHERE id = ?",
+                    (attempts, now, message_id)
+                )
+                return
+            if error is None:
+                error = response.get('description', 'unknown error')
+                # a request rejected by the API (e.g. unknown chat) will never succeed, except for rate limiting
+                permanent = 400 <= response.get('error_code', 500) < 500 and response.get('error_code') != 429
+            else:
+                permanent = False
+            status = 'failed' if permanent or attempts >= self.max_attempts else 'pending'
+            if status == 'failed':
+                # the message is never sent again, the caregivers will not receive it
+                print(f"Error: Notification {message_id} failed after {attempts} attempts and will not be retried: {error}")
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+            self._connection.execute(
+                'UPDATE messages SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?',
+                (status, attempts, now + delay, str(error), message_id)
+            )
+        return
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                self._wake_up.wait(self._seconds_to_next_attempt())
+                self._wake_up.clear()
+                continue
+            futures = [
+                (message_id, attempts, self.client.send_message_async(chat_id, text))
+                for message_id, chat_id, text, attempts in batch
+            ]
+            for message_id, attempts, future in futures:
+                try:
+                    self._record(message_id, attempts, response=future.result())
+                except Exception as e:
+                    print(f"Error: Could not deliver notification {message_id}: {e}")
+                    self._record(message_id, attempts, error=e)
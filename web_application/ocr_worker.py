@@ -0,0 +1,390 @@
+# Import all the needed libraries
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from memory_usage import rss_mb
+
+
+class OCRWorker:
+    """
+    Box reader running in a dedicated worker process.
+
+    PaddleOCR is loaded once in the worker, so the inference does not hold the GIL of
+    the main process and the speech capture and the web interface keep running while a
+    box is read. The frames are copied into a block of shared memory, divided into slots,
+    and only their slot and shape are sent through the pipe of the worker; the lines
+    read come back as JSON. A request that takes longer than its timeout, or a worker
+    that crashes, makes the worker restart; a worker that keeps crashing is restarted
+    with an exponential backoff, and given up after a few times in a row, failing the
+    frames instead of starting it forever. With an idle timeout the worker is started
+    only when a frame has to be read, and stopped, returning all the memory of the model
+    to the system, when no frame has been read for that long.
+    """
+
+    def __init__(self, reader_options=None, slots=2, max_frame_shape=(1080, 1920, 3), timeout=20.0, start_timeout=300.0,
+                 idle_timeout=None, max_restarts=5, restart_delay=1.0, max_restart_delay=60.0):
+        """
+        Initialize the worker, that is started by `start`.
+
+        Args:
+            reader_options (dict, optional): The keyword arguments of the BoxReader of the worker. Defaults to None.
+            slots (int, optional): The number of frames that can be read at the same time. Defaults to 2.
+            max_frame_shape (tuple, optional): The largest frame, the larger ones are downscaled. Defaults to (1080, 1920, 3).
+            timeout (float, optional): The default number of seconds to wait for the lines of a frame. Defaults to 20.0.
+            start_timeout (float, optional): The number of seconds to wait for the model to be loaded. Defaults to 300.0.
+            idle_timeout (float, optional): The number of seconds without frames after which the worker
+                is stopped. Defaults to None (the worker is started at once and kept running).
+            max_restarts (int, optional): The number of crashes in a row, without any frame read, after
+                which the worker is not restarted anymore. Defaults to 5.
+            restart_delay (float, optional): The seconds before restarting a crashed worker, doubled at
+                every crash in a row. Defaults to 1.0.
+            max_restart_delay (float, optional): The maximum seconds before restarting a crashed worker. Defaults to 60.0.
+        """
+        self.reader_options = reader_options or {}
+        self.max_frame_shape = max_frame_shape
+        self.slot_size = int(np.prod(max_frame_shape))
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.idle_timeout = idle_timeout
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.loads = 0
+        self.unloads = 0
+        self.restarts = 0
+        self.completed = 0
+        self.timeouts = 0
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slot_size * slots)
+        self._free_slots = queue.Queue()
+        for slot in range(slots):
+            self._free_slots.put(slot)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stopped = False
+        self._crashes = 0
+        self._restarting = False
+        self._failed = None
+        self._process = None
+        self._generation = 0
+        self._next_id = 0
+        self._waiting = 0
+        self._in_flight = {}
+        self._last_used = time.monotonic()
+
+    def start(self):
+        """
+        Start the worker process and wait until its model is loaded. With an idle timeout the
+        process is started by the first frame instead.
+
+        Returns:
+            OCRWorker: The worker itself.
+        """
+        if self.idle_timeout is not None:
+            threading.Thread(target=self._unload_when_idle, name='ocr-worker-idle', daemon=True).start()
+            return self
+        self._spawn()
+        if not self._ready.wait(self.start_timeout):
+            print("Error: The OCR worker did not start in time.")
+        return self
+
+    def _spawn(self):
+        with self._lock:
+            self._spawn_locked()
+
+    def _spawn_locked(self):
+        self._ready.clear()
+        self._generation += 1
+        self.loads += 1
+        self._process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), self._shm.name, str(self.slot_size), json.dumps(self.reader_options)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1
+        )
+        threading.Thread(
+            target=self._read_responses, args=(self._process, self._generation), name='ocr-worker', daemon=True
+        ).start()
+
+    def _unload_when_idle(self):
+        while not self._stopped:
+            time.sleep(min(self.idle_timeout, 5.0))
+            with self._lock:
+                idle = time.monotonic() - self._last_used >= self.idle_timeout
+                if self._process is None or self._waiting or self._in_flight or not idle:
+                    continue
+                process, self._process = self._process, None
+                self._ready.clear()
+                # the exit of the stopped worker is not a crash
+                self._generation += 1
+                self.unloads += 1
+            process.stdin.close()
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def _read_responses(self, process, generation):
+        for line in process.stdout:
+            response = json.loads(line)
+            if response.get('ready'):
+                self._ready.set()
+                continue
+            with self._lock:
+                request = self._in_flight.pop(response['id'], None)
+            if request is None:
+                continue
+            future, slot = request
+            self._free_slots.put(slot)
+            # a worker that reads a frame is working, its next crash is not one in a row
+            self._crashes = 0
+            self.completed += 1
+            self._last_used = time.monotonic()
+            if 'error' in response:
+                future.set_exception(RuntimeError(response['error']))
+            else:
+                future.set_result(response['lines'])
+        # the worker exited: unless it has been replaced or stopped on purpose, it crashed
+        process.wait()
+        with self._lock:
+            crashed = generation == self._generation and not self._stopped
+            if crashed:
+                self._crashes += 1
+            crashes = self._crashes
+        if not crashed:
+            return
+        if crashes > self.max_restarts:
+            print(f"Error: The OCR worker exited with code {process.returncode} {crashes} times in a row, it is not restarted.")
+            self._fail(f"The OCR worker exited {crashes} times in a row (last exit code {process.returncode})")
+            return
+        delay = min(self.max_restart_delay, self.restart_delay * 2 ** (crashes - 1))
+        print(f"Error: The OCR worker exited with code {process.returncode}, restarting it in {delay:.1f} s.")
+        self.restart(delay)
+
+    def _take_in_flight(self):
+        # called with the lock held: the responses of the current worker are ignored from now on
+        in_flight, self._in_flight = self._in_flight, {}
+        self._generation += 1
+        return in_flight
+
+    def _fail_in_flight(self, in_flight, message):
+        for future, slot in in_flight.values():
+            self._free_slots.put(slot)
+            if not future.done():
+                future.set_exception(RuntimeError(message))
+
+    def restart(self, delay=0.0):
+        """
+        Kill the worker process, fail the frames being read and start a new worker.
+
+        Args:
+            delay (float, optional): The seconds to wait before starting the new worker, the frames
+                submitted meanwhile wait for it. Defaults to 0.0.
+        """
+        with self._lock:
+            process = self._process
+            in_flight = self._take_in_flight()
+            self.restarts += 1
+            if delay:
+                # the frames submitted meanwhile do not start the worker before the delay
+                self._process = None
+                self._restarting = True
+                self._ready.clear()
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+        self._fail_in_flight(in_flight, "The OCR worker has been restarted")
+        if delay:
+            time.sleep(delay)
+            with self._lock:
+                self._restarting = False
+        if not self._stopped and self._failed is None:
+            self._spawn()
+
+    def _fail(self, message):
+        """
+        Give up the worker: fail the frames being read and all the next ones.
+
+        Args:
+            message (str): The error of the frames.
+        """
+        with self._lock:
+            self._failed = message
+            self._process = None
+            in_flight = self._take_in_flight()
+        self._fail_in_flight(in_flight, message)
+        # the frames waiting for the model are woken up, and fail
+        self._ready.set()
+
+    def submit(self, frame):
+        """
+        Send a frame to the worker, waiting for a free slot.
+
+        Args:
+            frame (numpy.ndarray): The BGR frame.
+
+        Returns:
+            concurrent.futures.Future: Resolved with the lines of text read.
+        """
+        future = Future()
+        if self._failed is not None:
+            future.set_exception(RuntimeError(self._failed))
+            return future
+        if frame.shape[0] > self.max_frame_shape[0] or frame.shape[1] > self.max_frame_shape[1]:
+            import cv2
+            scale = min(self.max_frame_shape[0] / frame.shape[0], self.max_frame_shape[1] / frame.shape[1])
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        with self._lock:
+            self._waiting += 1
+            self._last_used = time.monotonic()
+            # an unloaded worker is started again, the frame waits for its model
+            if self._process is None and not self._stopped and not self._restarting and self._failed is None:
+                self._spawn_locked()
+        try:
+            if not self._ready.wait(self.start_timeout):
+                raise TimeoutError("The OCR worker is not ready")
+            if self._failed is not None:
+                raise RuntimeError(self._failed)
+            slot = self._free_slots.get(timeout=self.timeout)
+        except RuntimeError as e:
+            with self._lock:
+                self._waiting -= 1
+            future.set_exception(e)
+            return future
+        except (queue.Empty, TimeoutError) as e:
+            with self._lock:
+                self._waiting -= 1
+            future.set_exception(TimeoutError(str(e) or "No free slot for the frame"))
+            return future
+        view = np.ndarray(frame.shape, dtype=np.uint8, buffer=self._shm.buf, offset=slot * self.slot_size)
+        view[...] = frame
+        del view
+        with self._lock:
+            # the frame stays counted as waiting until it is in flight, so the worker is not unloaded meanwhile
+            self._waiting -= 1
+            if self._process is None:
+                # the worker crashed after it was ready
+                self._free_slots.put(slot)
+                future.set_exception(RuntimeError(self._failed or "The OCR worker has been restarted"))
+                return future
+            request_id = self._next_id
+            self._next_id += 1
+            self._in_flight[request_id] = (future, slot)
+            process = self._process
+        try:
+            process.stdin.write(json.dumps({'id': request_id, 'slot': slot, 'shape': list(frame.shape)}) + '\n')
+            process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            # the worker is restarting, the reader of its responses fails the future
+            pass
+        return future
+
+    def read_lines(self, frame, timeout=None):
+        """
+        Read the lines of text on the box, with the same interface of BoxReader.
+
+        Args:
+            frame (numpy.ndarray or None): The picture of the medication box.
+            timeout (float, optional): The maximum number of seconds to wait, the worker is restarted
+                if it is exceeded. Defaults to None (the timeout of the worker).
+
+        Returns:
+            list: The lines of text read.
+        """
+        if frame is None:
+            return []
+        future = self.submit(frame)
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except TimeoutError:
+            if not future.done():
+                # the inference can not be interrupted, the worker is replaced
+                self.timeouts += 1
+                print("Error: The OCR worker did not answer in time, restarting it.")
+                self.restart()
+            raise
+
+    @property
+    def queue_depth(self):
+        """
+        The number of frames waiting for a slot or being read.
+        """
+        with self._lock:
+            return self._waiting + len(self._in_flight)
+
+    def stats(self):
+        """
+        Get the counters of the worker.
+
+        Returns:
+            dict: The 'queue_depth', the frames 'completed', the 'timeouts', the 'restarts', whether
+                the worker is 'loaded', the 'loads' and 'unloads' of the worker, its resident memory
+                ('rss_mb') and the error of a worker that has been given up ('failed', None otherwise).
+        """
+        with self._lock:
+            process = self._process
+        return {
+            'queue_depth': self.queue_depth,
+            'completed': self.completed,
+            'timeouts': self.timeouts,
+            'restarts': self.restarts,
+            'loaded': process is not None,
+            'loads': self.loads,
+            'unloads': self.unloads,
+            'rss_mb': rss_mb(process.pid) if process is not None else 0.0,
+            'failed': self._failed
+        }
+
+    def stop(self):
+        """
+        Stop the worker process and release the shared memory.
+        """
+        with self._lock:
+            self._stopped = True
+            process = self._process
+            self._process = None
+        if process is not None:
+            process.stdin.close()
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._shm.close()
+        self._shm.unlink()
+
+
+def main():
+    """
+    Entry point of the worker process: load the box reader, then read the frames whose slot
+    and shape are sent on the standard input and write the lines read on the standard output.
+    """
+    shm_name, slot_size, reader_options = sys.argv[1], int(sys.argv[2]), json.loads(sys.argv[3])
+    # the standard output is kept for the responses, the messages of the libraries go to the standard error
+    responses = os.fdopen(os.dup(1), 'w', buffering=1)
+    os.dup2(2, 1)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # the block belongs to the main process, the worker must not release it when exiting
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    from paddleocr import PaddleOCR
+    from box_reader import BoxReader
+    reader = BoxReader(PaddleOCR(lang='it'), **reader_options)
+    responses.write(json.dumps({'ready': True}) + '\n')
+    for line in sys.stdin:
+        request = json.loads(line)
+        frame = np.ndarray(tuple(request['shape']), dtype=np.uint8, buffer=shm.buf, offset=request['slot'] * slot_size)
+        try:
+            response = {'id': request['id'], 'lines': reader.read_lines(frame)}
+        except Exception as e:
+            response = {'id': request['id'], 'error': str(e)}
+        del frame
+        responses.write(json.dumps(response) + '\n')
+    shm.close()
+
+
+if __name__ == '__main__':
+    main()
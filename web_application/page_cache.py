@@ -0,0 +1,65 @@
+# Import all the needed libraries
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class RenderedPage:
+    """
+    A rendered page or fragment, with the entity tag of its content.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+class PageCache:
+    """
+    Cache of rendered pages and fragments.
+
+    A page is keyed by everything its content depends on (e.g. the kiosk, the day and the
+    version of the therapy plans), so that it is rendered only when one of them changes
+    and an entry never has to be invalidated. The least recently used entries are dropped,
+    so that the memory does not grow with the kiosks and the days.
+    """
+
+    def __init__(self, max_items=256):
+        """
+        Initialize the cache.
+
+        Args:
+            max_items (int, optional): The maximum number of pages kept. Defaults to 256.
+        """
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, render):
+        """
+        Get a page, rendering it if it is not cached.
+
+        Args:
+            key (tuple): The key of the page.
+            render (callable): The function rendering the page, returning its body.
+
+        Returns:
+            RenderedPage: The page.
+        """
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return page
+            self.misses += 1
+        # rendered outside of the lock, two requests of a new page may both render it
+        page = RenderedPage(render())
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_items:
+                self._pages.popitem(last=False)
+        return page
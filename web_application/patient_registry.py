@@ -0,0 +1,168 @@
+# Import all the needed libraries
+import csv
+import os
+import threading
+import time
+from therapy_plan_store import TherapyPlanStore
+
+
+class PatientRegistry:
+    """
+    Registry of the patients of the facility, keyed by patient ID.
+
+    Every patient has a kiosk (with the patient ID, unless the 'kiosk_id' column says
+    otherwise) and the therapy plans of the '<plans folder>/<patient ID>' folder, or of
+    the plans folder itself if the patient has no folder of its own. The therapy plan
+    stores are created once per folder and shared by the scheduler, the web interface
+    and the dialogues. The registry file is loaded again when it changes.
+    """
+
+    def __init__(self, path='../patient_registry.csv', plans_folder='../therapy_plan', check_interval=5.0):
+        """
+        Initialize the registry and load the patients.
+
+        Args:
+            path (str, optional): The path of the patient registry CSV file. Defaults to '../patient_registry.csv'.
+            plans_folder (str, optional): The folder of the therapy plans. Defaults to '../therapy_plan'.
+            check_interval (float, optional): Seconds between two checks of the file modification time. Defaults to 5.0.
+        """
+        self.path = path
+        self.plans_folder = plans_folder
+        self.check_interval = check_interval
+        # the therapy plan store of every patient, read by the dose scheduler
+        self.stores = {}
+        self._patients = {}
+        self._kiosks = {}
+        self._folder_stores = {}
+        self._mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def _get_folder_store(self, folder):
+        if folder not in self._folder_stores:
+            self._folder_stores[folder] = TherapyPlanStore(folder)
+        return self._folder_stores[folder]
+
+    def refresh(self, force=False):
+        """
+        Reload the registry if its file changed since the last load.
+
+        Args:
+            force (bool, optional): If True the modification time is checked even if
+                `check_interval` has not elapsed yet. Defaults to False.
+
+        Returns:
+            bool: True if the registry has been reloaded, False otherwise.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return False
+        with self._lock:
+            self._last_check = now
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime
+            with open(self.path, newline='', encoding='utf-8-sig') as f:
+                reader = csv.DictReader(f)
+                registry = list(reader)
+                columns = reader.fieldnames or []
+            handle_columns = [col for col in columns if col.startswith('cg_handle_')]
+            patients = {}
+            kiosks = {}
+            for index, row in enumerate(registry):
+                # the registries without IDs number their patients from 1
+                patient_id = row['patient_id'].strip() if 'patient_id' in columns else str(index + 1)
+                kiosk_id = (row.get('kiosk_id') or '').strip() or patient_id
+                patients[patient_id] = {
+                    'id': patient_id,
+                    'kiosk': kiosk_id,
+                    'name': row['name'],
+                    'gender': row['gender'],
+                    'age': int(row['age']),
+                    'handles': [row[col] for col in handle_columns if row.get(col)]
+                }
+                kiosks[kiosk_id] = patient_id
+            self._patients = patients
+            self._kiosks = kiosks
+            for patient_id in patients:
+                self.stores[patient_id] = self.get_store(patient_id)
+            for patient_id in list(self.stores):
+                if patient_id not in patients:
+                    del self.stores[patient_id]
+            return True
+
+    def get(self, patient_id):
+        """
+        Get the data of a patient.
+
+        Args:
+            patient_id (str): The patient ID.
+
+        Returns:
+            dict or None: The 'id', 'kiosk', 'name', 'gender', 'age' and caregivers 'handles' of
+                the patient, or None if the patient is not registered.
+        """
+        self.refresh()
+        return self._patients.get(patient_id)
+
+    def patient_for_kiosk(self, kiosk_id):
+        """
+        Get the patient of a kiosk.
+
+        Args:
+            kiosk_id (str): The kiosk ID.
+
+        Returns:
+            str or None: The patient ID, or None if the kiosk is not registered.
+        """
+        self.refresh()
+        return self._kiosks.get(kiosk_id)
+
+    def kiosks(self):
+        """
+        Get all the kiosks.
+
+        Returns:
+            list: The kiosk IDs, in the order of the registry.
+        """
+        self.refresh()
+        return list(self._kiosks)
+
+    def get_store(self, patient_id):
+        """
+        Get the therapy plan store of a patient.
+
+        Args:
+            patient_id (str or None): The patient ID.
+
+        Returns:
+            TherapyPlanStore: The store of the plans of the patient, or of the shared plans if
+                the patient has no folder of its own or is not registered.
+        """
+        folder = os.path.join(self.plans_folder, patient_id) if patient_id is not None else None
+        if folder is None or not os.path.isdir(folder):
+            folder = self.plans_folder
+        return self._get_folder_store(folder)
+
+    def get_medications(self):
+        """
+        Get all the medications of the week of all the patients.
+
+        Returns:
+            list: The names of the medications, sorted and without duplicates.
+        """
+        medications = set()
+        for store in list(self._folder_stores.values()):
+            medications.update(store.get_medications())
+        return sorted(medications)
+
+    def plans_version(self):
+        """
+        Get the version of all the therapy plans, that changes whenever one of them is reloaded.
+
+        Returns:
+            tuple: The version of every therapy plan store.
+        """
+        return tuple(store.version for store in list(self._folder_stores.values()))
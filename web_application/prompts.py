@@ -0,0 +1,221 @@
+# Texts spoken by the assistant, kept in one place so that they can be pre-rendered
+from therapy_plan_store import DAYS
+
+NOT_UNDERSTOOD_YES_NO = "Scusa non ho capito, potresti rispondermi con sì o no?"
+NOT_UNDERSTOOD_FEELINGS = "Scusa non ho capito, potresti rispondermi con bene o male?"
+THERAPY_PLAN_RULES = "Per ogni farmaco mi mostrerai la scatola e io ti dirò se è quella corretta;" \
+    "nel caso in cui lo sia ti dirò quanto prenderne"
+UNREADABLE_BOX = "Scusa non riesco a leggere la scatola, potresti avvicinarla alla fotocamera e riprovare?"
+WRONG_DOSAGE_BOX = "Scusa questa scatola ha un dosaggio diverso da quello da prendere; potresti mostrarmi quella corretta?"
+# the box of a wrong dosage in the recap, when it is not in the therapy plans
+OTHER_DOSAGE = "un altro dosaggio"
+
+
+def has_multiple_caregivers(patient):
+    """
+    Check whether the patient has more than one caregiver.
+
+    Args:
+        patient (dict): The patient data.
+
+    Returns:
+        bool: True if the patient has more than one caregiver, False otherwise.
+    """
+    return len(patient['chat_ids']) > 1
+
+
+def help_request_text(patient):
+    """
+    Text announcing that a help message is being sent.
+
+    Args:
+        patient (dict): The patient data.
+
+    Returns:
+        str: The text to be spoken.
+    """
+    if has_multiple_caregivers(patient):
+        return f"{patient['name']} invio un messaggio ai tuoi caregiver."
+    return f"{patient['name']} invio  un messaggio al tuo caregiver."
+
+
+def help_sent_text(patient):
+    """
+    Text confirming that the help message has been sent.
+
+    Args:
+        patient (dict): The patient data.
+
+    Returns:
+        str: The text to be spoken.
+    """
+    if has_multiple_caregivers(patient):
+        return f"Okay {patient['name']}, ho inviato un messaggio ai tuoi caregiver, ti contatteranno al più presto."
+    return f"Okay {patient['name']}, ho inviato un messaggio al tuo caregiver, ti contatterà al più presto."
+
+
+def greeting_text(patient):
+    """
+    Text greeting the patient and asking how they are feeling.
+
+    Args:
+        patient (dict): The patient data.
+
+    Returns:
+        str: The text to be spoken.
+    """
+    return f"Ciao {patient['name']}, come ti senti?"
+
+
+def therapy_plan_info_text(patient, medications):
+    """
+    Text listing the medications to be taken.
+
+    Args:
+        patient (dict): The patient data.
+        medications (list): A list of (medication, quantity) to be taken.
+
+    Returns:
+        str: The text to be spoken.
+    """
+    text = f"{patient['name']} è il momento di prendere i seguenti farmaci: "
+    for medication in medications:
+        text += medication[0] + ", "
+    return text
+
+
+def feeling_good_text(patient):
+    """
+    Text answering a patient that feels good.
+
+    Args:
+        patient (dict): The patient data.
+
+    Returns:
+        str: The text to be spoken.
+    """
+    return f"Bene {patient['name']}, sono contento di sentire che ti senti bene!"
+
+
+def feeling_bad_text(patient):
+    """
+    Text answering a patient that feels bad and asking whether to send a help message.
+
+    Args:
+        patient (dict): The patient data.
+
+    Returns:
+        str: The text to be spoken.
+    """
+    text = f"Mi dispiace {patient['name']}, spero tu ti senta meglio presto."
+    if has_multiple_caregivers(patient):
+        text += "Vuoi inviare un messaggio di aiuto ai tuoi caregiver?"
+    else:
+        text += "Vuoi inviare un messaggio di aiuto al tuo caregiver?"
+    return text
+
+
+def medication_instructions_text(medication):
+    """
+    Text asking the patient to show the box of a medication.
+
+    Args:
+        medication (str): The name of the medication.
+
+    Returns:
+        str: The text to be spoken.
+    """
+    return f"Prendi {medication}; quando sei pronto a farmi riconoscere la scatola dimmi foto."
+
+
+def correct_box_text(patient, quantity):
+    """
+    Text confirming the box and telling the quantity to take.
+
+    Args:
+        patient (dict): The patient data.
+        quantity (str): The quantity of the medication to be taken.
+
+    Returns:
+        str: The text to be spoken.
+    """
+    text = f"Bene {patient['name']} è la scatola corretta, devi prenderne {quantity}."
+    text += "Quando sei pronto a procedere con il prossimo farmaco pronuncia avanti"
+    return text
+
+
+def wrong_box_text(shown, expected):
+    """
+    Text telling the patient that the box shown is of another medication.
+
+    Args:
+        shown (str): The name of the medication whose box has been shown.
+        expected (str): The name of the medication to be taken.
+
+    Returns:
+        str: The text to be spoken.
+    """
+    return f"Scusa questa è la scatola di {shown}, non di {expected}; potresti mostrarmi quella corretta?"
+
+
+def goodbye_text(patient):
+    """
+    Text saying goodbye after all the medications have been taken.
+
+    Args:
+        patient (dict): The patient data.
+
+    Returns:
+        str: The text to be spoken.
+    """
+    multiple = has_multiple_caregivers(patient)
+    text = f"Bene {patient['name']} hai preso tutti i farmaci necessari."
+    if multiple:
+        text += "Ora invierò un messaggio di riepilogo ai tuoi caregiver"
+    else:
+        text += "Ora invierò un messaggio di riepilogo al tuo caregiver"
+    text += "Noi ci risentiamo quando dovrai prendere i prossimi farmaci."
+    text += "Intanto, nel caso tu abbia bisogno di aiuto, ricorda di pronunciare aiuto"
+    if multiple:
+        text += "così invierò un messaggio di aiuto ai tuoi caregiver"
+    else:
+        text += "così invierò un messaggio di aiuto al tuo caregiver"
+    return text
+
+
+def get_all_prompts(patient, therapy_plan_store):
+    """
+    Get every text that the assistant can speak for the patient during the week.
+
+    Args:
+        patient (dict): The patient data.
+        therapy_plan_store (TherapyPlanStore): The store with the therapy plans of the week.
+
+    Returns:
+        list: The texts without duplicates, static ones first.
+    """
+    texts = [
+        NOT_UNDERSTOOD_YES_NO,
+        NOT_UNDERSTOOD_FEELINGS,
+        THERAPY_PLAN_RULES,
+        UNREADABLE_BOX,
+        WRONG_DOSAGE_BOX,
+        help_request_text(patient),
+        help_sent_text(patient),
+        greeting_text(patient),
+        feeling_good_text(patient),
+        feeling_bad_text(patient),
+        goodbye_text(patient)
+    ]
+    for day in DAYS:
+        for medications in therapy_plan_store.get_plan(day).values():
+            texts.append(therapy_plan_info_text(patient, medications))
+            for medication, quantity in medications:
+                texts.append(medication_instructions_text(medication))
+                texts.append(correct_box_text(patient, quantity))
+    medications = therapy_plan_store.get_medications()
+    for expected in medications:
+        for shown in medications:
+            if shown != expected:
+                texts.append(wrong_box_text(shown, expected))
+    return list(dict.fromkeys(texts))
@@ -0,0 +1,164 @@
+# Import all the needed libraries
+import json
+
+# words the patient can say in each state of the dialogue, "aiuto" is always accepted
+GRAMMARS = {
+    'idle': ['aiuto'],
+    'feelings': ['bene', 'male', 'aiuto'],
+    'confirmation': ['sì', 'no', 'aiuto'],
+    'photo': ['foto', 'aiuto'],
+    'next': ['avanti', 'aiuto']
+}
+
+
+def parse_result(result, field='text'):
+    """
+    Extract the recognized text from a Vosk JSON result.
+
+    Args:
+        result (str): The JSON result returned by the recognizer.
+        field (str, optional): The field containing the text, 'text' for final results and
+            'partial' for partial results. Defaults to 'text'.
+
+    Returns:
+        str: The recognized text, empty if nothing has been recognized.
+    """
+    return json.loads(result).get(field, '')
+
+
+class UtteranceDecoder:
+    """
+    Free-form decoder, it returns the text of each utterance once the recognizer has
+    detected its end.
+    """
+
+    def __init__(self, recognizer):
+        """
+        Initialize the decoder.
+
+        Args:
+            recognizer (KaldiRecognizer): The speech recognizer.
+        """
+        self.recognizer = recognizer
+
+    def set_state(self, state):
+        """
+        Set the state of the dialogue, the free-form decoder listens to every word in all the states.
+
+        Args:
+            state (str): The state of the dialogue.
+        """
+        return
+
+    def reset(self):
+        """
+        Discard the audio of the current utterance.
+        """
+        self.recognizer.Reset()
+        return
+
+    def accept(self, data):
+        """
+        Feed audio to the recognizer.
+
+        Args:
+            data (bytes): The audio to be recognized.
+
+        Returns:
+            str or None: The text of the utterance if it has ended, None otherwise.
+        """
+        if self.recognizer.AcceptWaveform(data):
+            return parse_result(self.recognizer.Result()) or None
+        return None
+
+
+class KeywordSpotter:
+    """
+    Keyword-spotting decoder.
+
+    Each state of the dialogue has its own recognizer restricted to the grammar of the
+    words expected in that state. A keyword is returned as soon as it is stable in the
+    partial results, without waiting for the end of the utterance.
+    """
+
+    def __init__(self, model, sample_rate=16000, grammars=GRAMMARS, stable_partials=2, state='idle'):
+        """
+        Initialize the decoder by building a recognizer for every state.
+
+        Args:
+            model (vosk.Model): The speech recognition model.
+            sample_rate (int, optional): The sample rate of the audio. Defaults to 16000.
+            grammars (dict, optional): The keywords of each state. Defaults to GRAMMARS.
+            stable_partials (int, optional): The number of consecutive partial results that must
+                contain a keyword before it is accepted. Defaults to 2.
+            state (str, optional): The initial state. Defaults to 'idle'.
+        """
+        from vosk import KaldiRecognizer
+        self.grammars = grammars
+        self.stable_partials = stable_partials
+        # '[unk]' absorbs the out-of-grammar words, so that they are not forced into a keyword
+        self.recognizers = {
+            name: KaldiRecognizer(model, sample_rate, json.dumps(words + ['[unk]']))
+            for name, words in grammars.items()
+        }
+        self.state = state
+        self._candidate = None
+        self._candidate_count = 0
+
+    def set_state(self, state):
+        """
+        Set the state of the dialogue, selecting the recognizer of its grammar.
+
+        Args:
+            state (str): The state of the dialogue, one of the keys of the grammars.
+        """
+        if state not in self.recognizers:
+            raise ValueError(f"Unknown dialogue state '{state}'")
+        self.state = state
+        self.reset()
+        return
+
+    def reset(self):
+        """
+        Discard the audio of the current utterance.
+        """
+        self.recognizers[self.state].Reset()
+        self._candidate = None
+        self._candidate_count = 0
+        return
+
+    def _find_keyword(self, text):
+        for word in text.split():
+            if word in self.grammars[self.state]:
+                return word
+        return None
+
+    def accept(self, data):
+        """
+        Feed audio to the recognizer of the current state.
+
+        Args:
+            data (bytes): The audio to be recognized.
+
+        Returns:
+            str or None: The spotted keyword, None if no keyword has been spotted yet.
+        """
+        recognizer = self.recognizers[self.state]
+        if recognizer.AcceptWaveform(data):
+            keyword = self._find_keyword(parse_result(recognizer.Result()))
+            self._candidate = None
+            self._candidate_count = 0
+            return keyword
+        keyword = self._find_keyword(parse_result(recognizer.PartialResult(), 'partial'))
+        if keyword is None or keyword != self._candidate:
+            self._candidate = keyword
+            self._candidate_count = 1 if keyword else 0
+            if keyword is None or self._candidate_count < self.stable_partials:
+                return None
+        else:
+            self._candidate_count += 1
+            if self._candidate_count < self.stable_partials:
+                return None
+        # the keyword is stable, act on it without waiting for the end of the utterance
+        self.reset()
+        return keyword
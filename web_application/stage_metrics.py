@@ -0,0 +1,227 @@
+# Import all the needed libraries
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def quantile(values, q):
+    """
+    Get a quantile of sorted values, with the nearest-rank method.
+
+    Args:
+        values (list): The values, sorted.
+        q (float): The quantile, between 0 and 1.
+
+    Returns:
+        float: The quantile, NaN if there are no values.
+    """
+    if not values:
+        return math.nan
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def format_value(value):
+    return 'NaN' if math.isnan(value) else repr(float(value))
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class StageMetrics:
+    """
+    Lightweight tracing of the stages of the dose sessions.
+
+    Every stage (the speech recognition, the speech synthesis and playback, the camera,
+    the OCR, the matching, the Telegram requests) is timed by a span or observed directly,
+    and its durations are kept in a rolling window, from which the quantiles are computed
+    only when the metrics are read. While a session is open the spans are also appended to
+    its trace, so that the time of a single dose can be inspected.
+    """
+
+    def __init__(self, window=1024, max_sessions=32, trace_folder=None):
+        """
+        Initialize the metrics.
+
+        Args:
+            window (int, optional): The number of recent durations kept for every stage. Defaults to 1024.
+            max_sessions (int, optional): The number of recent session traces kept. Defaults to 32.
+            trace_folder (str, optional): The folder where the trace of every closed session is
+                written as JSON. Defaults to None (the traces are kept only in memory).
+        """
+        self.window = window
+        self.max_sessions = max_sessions
+        self.trace_folder = trace_folder
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._counts = {}
+        self._sums = {}
+        self._errors = {}
+        self._traces = OrderedDict()
+        self._session = None
+
+    def observe(self, stage, seconds, error=False, **labels):
+        """
+        Record the duration of a stage.
+
+        Args:
+            stage (str): The name of the stage (e.g. 'ocr').
+            seconds (float): The duration in seconds.
+            error (bool, optional): Whether the stage failed. Defaults to False.
+            **labels: Any other information kept in the trace of the session (e.g. the medication).
+        """
+        now = time.time()
+        with self._lock:
+            if stage not in self._durations:
+                self._durations[stage] = deque(maxlen=self.window)
+                self._counts[stage] = 0
+                self._sums[stage] = 0.0
+                self._errors[stage] = 0
+            self._durations[stage].append(seconds)
+            self._counts[stage] += 1
+            self._sums[stage] += seconds
+            if error:
+                self._errors[stage] += 1
+            if self._session is not None:
+                trace = self._traces[self._session]
+                span = {'stage': stage, 'start': now - seconds - trace['started_at'], 'seconds': seconds}
+                if error:
+                    span['error'] = True
+                span.update(labels)
+                trace['spans'].append(span)
+        return
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """
+        Time the block of a with statement as a stage, a block raising an exception is recorded as failed.
+
+        Args:
+            stage (str): The name of the stage.
+            **labels: Any other information kept in the trace of the session.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(stage, time.perf_counter() - start, error=True, **labels)
+            raise
+        self.observe(stage, time.perf_counter() - start, **labels)
+
+    def open_session(self, session_id):
+        """
+        Start the trace of a session, the spans recorded from now on are appended to it.
+        Opening again the current session keeps its trace.
+
+        Args:
+            session_id (str): The session ID.
+        """
+        with self._lock:
+            if session_id == self._session:
+                return
+            self._session = session_id
+            self._traces[session_id] = {'session': session_id, 'started_at': time.time(), 'seconds': None, 'spans': []}
+            self._traces.move_to_end(session_id)
+            while len(self._traces) > self.max_sessions:
+                self._traces.popitem(last=False)
+        return
+
+    def close_session(self):
+        """
+        End the trace of the current session, writing it to the trace folder if any.
+
+        Returns:
+            dict or None: The trace, None if no session was open.
+        """
+        with self._lock:
+            if self._session is None or self._session not in self._traces:
+                self._session = None
+                return None
+            trace = self._traces[self._session]
+            trace['seconds'] = time.time() - trace['started_at']
+            self._session = None
+            trace = json.loads(json.dumps(trace))
+        if self.trace_folder is not None:
+            os.makedirs(self.trace_folder, exist_ok=True)
+            file_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in trace['session'])
+            with open(os.path.join(self.trace_folder, f'{file_name}.json'), 'w') as f:
+                json.dump(trace, f, indent=2)
+        return trace
+
+    def get_trace(self, session_id):
+        """
+        Get the trace of a recent session.
+
+        Args:
+            session_id (str): The session ID.
+
+        Returns:
+            dict or None: The 'session', its start time, its duration in 'seconds' (None while open)
+                and its 'spans', each with its 'stage', 'start' from the session start and 'seconds'.
+        """
+        with self._lock:
+            trace = self._traces.get(session_id)
+            return json.loads(json.dumps(trace)) if trace is not None else None
+
+    def sessions(self):
+        """
+        Get the IDs of the recent sessions, the oldest first.
+
+        Returns:
+            list: The session IDs.
+        """
+        with self._lock:
+            return list(self._traces)
+
+    def summary(self):
+        """
+        Get the statistics of every stage.
+
+        Returns:
+            dict: For every stage the 'count', 'sum' and 'errors' since the start and the
+                quantiles of the recent durations ('p50', 'p95', 'p99').
+        """
+        with self._lock:
+            stages = {
+                stage: (sorted(durations), self._counts[stage], self._sums[stage], self._errors[stage])
+                for stage, durations in self._durations.items()
+            }
+        summary = {}
+        for stage, (durations, count, total, errors) in sorted(stages.items()):
+            summary[stage] = {'count': count, 'sum': total, 'errors': errors}
+            for q in QUANTILES:
+                summary[stage][f'p{round(q * 100)}'] = quantile(durations, q)
+        return summary
+
+    def to_prometheus(self, prefix='kiosk'):
+        """
+        Format the statistics of every stage in the Prometheus text format, as a summary.
+
+        Args:
+            prefix (str, optional): The prefix of the metric names. Defaults to 'kiosk'.
+
+        Returns:
+            str: The metrics.
+        """
+        summary = self.summary()
+        lines = [
+            f'# HELP {prefix}_stage_seconds Duration of the stages of the dose sessions.',
+            f'# TYPE {prefix}_stage_seconds summary'
+        ]
+        for stage, stats in summary.items():
+            label = f'stage="{escape_label(stage)}"'
+            for q in QUANTILES:
+                lines.append(f'{prefix}_stage_seconds{{{label},quantile="{q}"}} {format_value(stats[f"p{round(q * 100)}"])}')
+            lines.append(f'{prefix}_stage_seconds_sum{{{label}}} {format_value(stats["sum"])}')
+            lines.append(f'{prefix}_stage_seconds_count{{{label}}} {stats["count"]}')
+        lines.append(f'# HELP {prefix}_stage_errors_total Failures of the stages of the dose sessions.')
+        lines.append(f'# TYPE {prefix}_stage_errors_total counter')
+        for stage, stats in summary.items():
+            lines.append(f'{prefix}_stage_errors_total{{stage="{escape_label(stage)}"}} {stats["errors"]}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,149 @@
+# Import all the needed libraries
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from memory_usage import rss_mb
+
+
+class StartupOrchestrator:
+    """
+    Loader of the components of the assistant.
+
+    Every component (a model, a device) is loaded by its own function in a pool of
+    background workers, so that the slow ones are loaded concurrently and the web
+    interface can be served while they load. The state of every component and the time
+    of the startup milestones (e.g. when the assistant starts listening) are kept to be
+    shown to the user, with the resident memory taken by every component: the growth of
+    the process while it was loaded, only if no other component was loading meanwhile,
+    otherwise the growth can not be attributed to it (e.g. with a single worker it always is).
+    """
+
+    def __init__(self, max_workers=4, on_change=None):
+        """
+        Initialize the orchestrator.
+
+        Args:
+            max_workers (int, optional): The number of components loaded at the same time, 1 loads
+                them one after another. Defaults to 4.
+            on_change (callable, optional): Called with the status every time it changes. Defaults to None.
+        """
+        self.started_at = time.monotonic()
+        self.on_change = on_change
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='startup')
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._components = {}
+        self._milestones = {}
+        self._loading = set()
+        self._overlapped = set()
+
+    def load(self, name, loader, *args):
+        """
+        Start loading a component in background.
+
+        Args:
+            name (str): The name of the component.
+            loader (callable): The function loading the component and returning it.
+            *args: The arguments of the loader.
+
+        Returns:
+            concurrent.futures.Future: The future of the component.
+        """
+        with self._lock:
+            self._components[name] = {'state': 'pending', 'seconds': None, 'rss_mb': None}
+            future = self._executor.submit(self._load, name, loader, *args)
+            self._futures[name] = future
+        self._notify()
+        return future
+
+    def _load(self, name, loader, *args):
+        self._set_state(name, 'loading')
+        with self._lock:
+            self._loading.add(name)
+            if len(self._loading) > 1:
+                # the memory taken by the components loaded concurrently is not told apart
+                self._overlapped.update(self._loading)
+        start = time.monotonic()
+        rss_before = rss_mb()
+        try:
+            component = loader(*args)
+        except Exception as e:
+            print(f"Error: Could not load {name}: {e}")
+            with self._lock:
+                self._loading.discard(name)
+            self._set_state(name, 'failed', time.monotonic() - start)
+            raise
+        rss_after = rss_mb()
+        with self._lock:
+            self._loading.discard(name)
+            attributable = name not in self._overlapped
+        rss = rss_after - rss_before if attributable and rss_before is not None and rss_after is not None else None
+        self._set_state(name, 'ready', time.monotonic() - start, rss)
+        return component
+
+    def _set_state(self, name, state, seconds=None, rss=None):
+        with self._lock:
+            self._components[name] = {'state': state, 'seconds': seconds, 'rss_mb': rss}
+        self._notify()
+
+    def get(self, name, timeout=None):
+        """
+        Get a component, waiting for it to be loaded.
+
+        Args:
+            name (str): The name of the component.
+            timeout (float, optional): The maximum number of seconds to wait. Defaults to None (no limit).
+
+        Returns:
+            object: The component, the exception of its loader is raised if the loading failed.
+        """
+        return self._futures[name].result(timeout)
+
+    def is_ready(self, name):
+        """
+        Check whether a component has been loaded.
+
+        Args:
+            name (str): The name of the component.
+
+        Returns:
+            bool: True if the component is ready, False otherwise.
+        """
+        with self._lock:
+            return self._components.get(name, {}).get('state') == 'ready'
+
+    def mark(self, milestone):
+        """
+        Record the time of a startup milestone, only the first time it is reached.
+
+        Args:
+            milestone (str): The name of the milestone.
+        """
+        with self._lock:
+            if milestone in self._milestones:
+                return
+            self._milestones[milestone] = time.monotonic() - self.started_at
+        self._notify()
+
+    def status(self):
+        """
+        Get the loading status.
+
+        Returns:
+            dict: Whether every component is 'ready', the 'state', loading 'seconds' and resident
+                memory ('rss_mb', None if loaded together with others) of every component, the seconds from the start to every milestone
+                and the resident memory of the whole process ('rss_mb').
+        """
+        with self._lock:
+            components = {name: dict(component) for name, component in self._components.items()}
+            milestones = dict(self._milestones)
+        return {
+            'ready': all(component['state'] == 'ready' for component in components.values()),
+            'components': components,
+            'milestones': milestones,
+            'rss_mb': rss_mb()
+        }
+
+    def _notify(self):
+        if self.on_change is not None:
+            self.on_change(self.status())
@@ -1,46 +1,118 @@
 /**
  * This script sets up the front-end behavior for updating time, 
- * displaying medication alerts, and handling background changes via Socket.IO events.
+ * displaying medication alerts pushed by the server, and handling background changes via Socket.IO events.
  */
 
 document.addEventListener('DOMContentLoaded', function () {
     
+    // Setup Socket.IO connection, in the room of the kiosk of the page
+    const kioskId = document.body.dataset.kiosk;
+    const socket = kioskId ? io({ query: { kiosk: kioskId } }) : io();
+
+    // Italian names of the days of the week, indexed as Date.getDay()
+    const italianDays = ['Domenica', 'Lunedì', 'Martedì', 'Mercoledì', 'Giovedì', 'Venerdì', 'Sabato'];
+
+    // Difference in milliseconds between the server clock and the local clock
+    let clockOffset = 0;
+
+    // Re-synchronize the local clock with the server every 10 minutes
+    const CLOCK_SYNC_INTERVAL = 10 * 60 * 1000;
+
     /**
-     * Fetches the current time and the next medication information from the server.
-     * Updates the relevant elements in the DOM with this information.
+     * Pads a number with a leading zero.
+     * @param {number} value - The number to be padded.
+     * @returns {string} The number as a two digits string.
      */
-    function updateTime() {
-        // Fetch current date and time
-        fetch('/current_time')
-            .then(response => response.json())
-            .then(data => {
-                document.getElementById('current-date').innerText = data.date;
-                document.getElementById('current-time').innerText = data.time;
-            });
+    function pad(value) {
+        return String(value).padStart(2, '0');
+    }
 
-        // Fetch next medication time and details
-        fetch('/next_medication')
-            .then(response => response.json())
-            .then(data => {
-                if (data.time && data.medications) {
-                    let alertText = `Prossimo farmaco alle ${data.time}: `;
-                    data.medications.forEach(medication => {
-                        alertText += `${medication[0]} (${medication[1]}), `;
-                    });
-                    alertText = alertText.slice(0, -2); // Remove the last comma and space
-                    document.getElementById('next-medication-alert').innerText = alertText;
-                } else {
-                    document.getElementById('next-medication-alert').innerText = "Nessun farmaco pianificato.";
-                }
-            });
+    /**
+     * Updates the date and time in the DOM using the local clock corrected by the server offset.
+     */
+    function updateTime() {
+        const now = new Date(Date.now() + clockOffset);
+        document.getElementById('current-date').innerText =
+            `${italianDays[now.getDay()]} - ${pad(now.getDate())}/${pad(now.getMonth() + 1)}/${now.getFullYear()}`;
+        document.getElementById('current-time').innerText =
+            `${pad(now.getHours())}:${pad(now.getMinutes())}:${pad(now.getSeconds())}`;
     }
 
-    // Initial call to update time and set an interval to update every 1 second
+    // Initial call to update time and set an interval to update every 1 second, no request is sent to the server
     updateTime();
     setInterval(updateTime, 1000);
+    setInterval(() => socket.emit('sync_time'), CLOCK_SYNC_INTERVAL);
+
+    /**
+     * Listener for 'current_time' event from Socket.IO.
+     * Synchronizes the local clock with the server clock.
+     * @param {Object} data - Contains the server time as milliseconds since the epoch.
+     */
+    socket.on('current_time', function (data) {
+        clockOffset = data.timestamp - Date.now();
+        updateTime();
+    });
+
+    /**
+     * Listener for 'next_medication' event from Socket.IO.
+     * The server emits it on connection and whenever the next medication changes.
+     * @param {Object} data - Contains the next medication time and the list of medications.
+     */
+    socket.on('next_medication', function (data) {
+        if (data.time && data.medications) {
+            let alertText = `Prossimo farmaco alle ${data.time}: `;
+            data.medications.forEach(medication => {
+                alertText += `${medication[0]} (${medication[1]}), `;
+            });
+            alertText = alertText.slice(0, -2); // Remove the last comma and space
+            document.getElementById('next-medication-alert').innerText = alertText;
+        } else {
+            document.getElementById('next-medication-alert').innerText = "Nessun farmaco pianificato.";
+        }
+    });
+
+    /**
+     * Listener for 'dose_due' event from Socket.IO.
+     * The server emits it when a dose of the patient of a kiosk without a local assistant is due.
+     * @param {Object} data - Contains the dose time and the list of medications.
+     */
+    socket.on('dose_due', function (data) {
+        const medications = data.medications.map(medication => `${medication[0]} (${medication[1]})`);
+        document.getElementById('next-medication-alert').innerText =
+            `È ora di prendere i farmaci delle ${data.time}: ${medications.join(', ')}`;
+    });
+
+    // Italian names of the modules loaded at startup
+    const moduleNames = {
+        patient: 'dati del paziente',
+        speech_recognition: 'riconoscimento vocale',
+        speech_synthesis: 'sintesi vocale',
+        camera: 'fotocamera',
+        ocr: 'riconoscimento delle scatole'
+    };
 
-    // Setup Socket.IO connection
-    const socket = io();
+    /**
+     * Listener for 'readiness' event from Socket.IO.
+     * The server emits it on connection and whenever a module changes its loading state.
+     * The status box is shown until the assistant is listening and every module is ready.
+     * @param {Object} data - Contains the state of every module and the startup milestones.
+     */
+    socket.on('readiness', function (data) {
+        const statusDiv = document.getElementById('startup-status');
+        if (data.ready && data.milestones.listening !== undefined) {
+            statusDiv.style.display = 'none';
+            return;
+        }
+        const loading = Object.keys(data.components)
+            .filter(name => data.components[name].state !== 'ready')
+            .map(name => `${moduleNames[name] || name}${data.components[name].state === 'failed' ? ' (errore)' : ''}`);
+        let statusText = data.milestones.listening !== undefined ? 'Ti sto ascoltando. ' : 'Avvio in corso. ';
+        if (loading.length > 0) {
+            statusText += `Caricamento: ${loading.join(', ')}`;
+        }
+        document.getElementById('startup-status-text').innerText = statusText;
+        statusDiv.style.display = '';
+    });
 
     /**
      * Listener for 'background_event_change' event from Socket.IO.
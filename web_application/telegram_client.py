@@ -0,0 +1,153 @@
+# Import all the needed libraries
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# the characters of the Markdown messages that start an entity
+MARKDOWN_SPECIAL = '_*`['
+
+
+def escape_markdown(text):
+    """
+    Escape the characters of a text that Telegram would parse as Markdown entities, so that free
+    text (e.g. the name read on a medication box) is sent as it is.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        str: The escaped text.
+    """
+    return ''.join('\\' + c if c in MARKDOWN_SPECIAL else c for c in str(text))
+
+
+class TelegramBotClient:
+    """
+    Client of the Telegram Bot API.
+
+    The bot token is loaded once and all the requests go through a single session, whose
+    pooled keep-alive connections are reused across messages. Failed requests are retried
+    with exponential backoff, and messages to several chats are sent concurrently.
+    """
+
+    def __init__(self, token=None, base_url=None, timeout=5.0, retries=3, backoff_factor=0.5, max_workers=8, on_call=None):
+        """
+        Initialize the client.
+
+        Args:
+            token (str, optional): The bot token. Defaults to the BOT_TOKEN environment variable.
+            base_url (str, optional): The URL of the Bot API. Defaults to the TELEGRAM_API_URL
+                environment variable, or 'https://api.telegram.org'.
+            timeout (float, optional): The timeout in seconds of every request. Defaults to 5.0.
+            retries (int, optional): The number of retries of a failed request. Defaults to 3.
+            backoff_factor (float, optional): The base of the exponential backoff between retries, in seconds. Defaults to 0.5.
+            max_workers (int, optional): The maximum number of messages sent concurrently. Defaults to 8.
+            on_call (callable, optional): Called with the method, the seconds taken and whether it failed
+                after every request (e.g. to collect metrics). Defaults to None.
+        """
+        self.token = token or os.getenv("BOT_TOKEN")
+        self.base_url = (base_url or os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")).rstrip('/')
+        self.timeout = timeout
+        self.on_call = on_call
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=True
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='telegram')
+
+    def call(self, method, **params):
+        """
+        Call a method of the Bot API, the parameters are sent URL-encoded in the query string.
+
+        Args:
+            method (str): The name of the method (e.g. 'sendMessage').
+            **params: The parameters of the method.
+
+        Returns:
+            dict: The response from the Telegram API.
+        """
+        url = f"{self.base_url}/bot{self.token}/{method}"
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+            result = response.json()
+        except Exception:
+            if self.on_call is not None:
+                self.on_call(method, time.perf_counter() - start, True)
+            raise
+        if self.on_call is not None:
+            self.on_call(method, time.perf_counter() - start, False)
+        return result
+
+    def send_message(self, chat_id, text):
+        """
+        Send a message to a Telegram chat.
+
+        Args:
+            chat_id (str): The chat ID to send the message to.
+            text (str): The message to be sent.
+
+        Returns:
+            dict: The response from the Telegram API.
+        """
+        return self.call('sendMessage', chat_id=chat_id, parse_mode='Markdown', text=text)
+
+    def send_message_async(self, chat_id, text):
+        """
+        Send a message to a Telegram chat without waiting for the response.
+
+        Args:
+            chat_id (str): The chat ID to send the message to.
+            text (str): The message to be sent.
+
+        Returns:
+            concurrent.futures.Future: Resolved with the response from the Telegram API.
+        """
+        return self._executor.submit(self.send_message, chat_id, text)
+
+    def broadcast(self, chat_ids, text):
+        """
+        Send the same message to several Telegram chats concurrently.
+
+        Args:
+            chat_ids (list): The chat IDs to send the message to.
+            text (str): The message to be sent.
+
+        Returns:
+            dict: A dictionary mapping each chat ID to the response from the Telegram API,
+                or to the exception raised while sending the message.
+        """
+        futures = {chat_id: self.send_message_async(chat_id, text) for chat_id in chat_ids}
+        results = {}
+        for chat_id, future in futures.items():
+            try:
+                results[chat_id] = future.result()
+            except Exception as e:
+                print(f"Error: Could not send message to chat {chat_id}: {e}")
+                results[chat_id] = e
+        return results
+
+    def get_updates(self, offset=None, limit=100):
+        """
+        Get the updates received by the bot.
+
+        Args:
+            offset (int, optional): The identifier of the first update to be returned. Defaults to None.
+            limit (int, optional): The maximum number of updates to be returned. Defaults to 100.
+
+        Returns:
+            dict: The response from the Telegram API.
+        """
+        params = {'limit': limit}
+        if offset is not None:
+            params['offset'] = offset
+        return self.call('getUpdates', **params)
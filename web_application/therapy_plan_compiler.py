@@ -0,0 +1,346 @@
+"""
+Compiler of the therapy plans.
+
+The therapy plans are written as one CSV file per day, with an 'hour' column and
+'medication_N' / 'quantity_medication_N' column pairs. The compiler validates the seven
+files of a folder and writes a single binary artifact of the whole week, in which the
+medication names and the quantities are interned in a string table and the hours are
+minute offsets, so that it is loaded without parsing any CSV.
+
+Usage (from the web_application folder):
+    python3 therapy_plan_compiler.py ../therapy_plan
+"""
+# Import all the needed libraries
+import argparse
+import csv
+import os
+import re
+import struct
+import sys
+import zlib
+
+DAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+ARTIFACT_NAME = 'therapy_plan.bin'
+CATALOG_NAME = 'medications.txt'
+MAGIC = b'TPLW'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHI') # magic, format version, CRC-32 of the payload
+HOUR_PATTERN = re.compile(r'^([01][0-9]|2[0-3]):([0-5][0-9])$')
+# limits of the artifact: column pairs of a day in a byte, strings and their UTF-8 bytes in 16 bits
+MAX_PAIRS = 255
+MAX_STRINGS = 65535
+MAX_STRING_BYTES = 65535
+
+
+class TherapyPlanError(ValueError):
+    """
+    Error raised when the therapy plans are not valid, with the list of all the problems found.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('\n'.join(errors))
+
+
+def hour_to_minute(hour):
+    """
+    Convert an 'HH:MM' string into the minute of the day.
+
+    Args:
+        hour (str): The time in 'HH:MM' format.
+
+    Returns:
+        int: The minute of the day (e.g. '08:30' -> 510).
+    """
+    hours, minutes = hour.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def minute_to_hour(minute):
+    """
+    Convert a minute of the day into an 'HH:MM' string.
+
+    Args:
+        minute (int): The minute of the day.
+
+    Returns:
+        str: The time in 'HH:MM' format (e.g. 510 -> '08:30').
+    """
+    return f'{minute // 60:02d}:{minute % 60:02d}'
+
+
+def plan_file_path(folder, day):
+    return os.path.join(folder, f'therapy_plan_{day}.csv')
+
+
+def load_catalog(folder):
+    """
+    Load the catalog of the known medications, from the folder of the therapy plans or from its parent.
+
+    Args:
+        folder (str): The folder of the therapy plans.
+
+    Returns:
+        set or None: The names of the known medications, None if there is no catalog.
+    """
+    for path in (os.path.join(folder, CATALOG_NAME), os.path.join(os.path.dirname(os.path.abspath(folder)), CATALOG_NAME)):
+        if os.path.exists(path):
+            with open(path, encoding='utf-8-sig') as f:
+                return {line.strip() for line in f if line.strip() and not line.startswith('#')}
+    return None
+
+
+def parse_day(file_path, catalog=None):
+    """
+    Parse and validate the therapy plan CSV file of a day.
+
+    Args:
+        file_path (str): The path of the CSV file.
+        catalog (set, optional): The known medications. Defaults to None (any medication).
+
+    Returns:
+        tuple: The number of medication column pairs, the (minute, [(medication, quantity)]) of
+            every dose sorted by minute, and the list of the errors found.
+    """
+    name = os.path.basename(file_path)
+    errors = []
+    with open(file_path, newline='', encoding='utf-8-sig') as f:
+        table = list(csv.reader(f))
+    if not table:
+        return 0, [], [f"{name}: the file is empty"]
+    header = [column.strip() for column in table[0]]
+    if not header or header[0] != 'hour':
+        errors.append(f"{name}:1: the first column must be 'hour'")
+    columns = header[1:]
+    if len(columns) % 2:
+        errors.append(f"{name}:1: the medication columns are not in pairs ({len(columns)} columns after 'hour')")
+    pairs = len(columns) // 2
+    if pairs > MAX_PAIRS:
+        errors.append(f"{name}:1: too many medication columns ({pairs} pairs, at most {MAX_PAIRS})")
+    for i in range(pairs):
+        expected = [f'medication_{i + 1}', f'quantity_medication_{i + 1}']
+        if columns[2 * i:2 * i + 2] != expected:
+            errors.append(f"{name}:1: columns {2 * i + 2} and {2 * i + 3} must be {expected[0]} and {expected[1]}")
+    doses = []
+    minutes = set()
+    for line, row in enumerate(table[1:], start=2):
+        if not any(value.strip() for value in row):
+            continue
+        values = [value.strip() for value in row] + [''] * (len(header) - len(row))
+        if len(values) > len(header) and any(values[len(header):]):
+            errors.append(f"{name}:{line}: more values than columns")
+        hour = values[0]
+        if not HOUR_PATTERN.match(hour):
+            errors.append(f"{name}:{line}: bad hour '{hour}', expected HH:MM")
+            continue
+        minute = hour_to_minute(hour)
+        if minute in minutes:
+            errors.append(f"{name}:{line}: the hour {hour} is repeated")
+        minutes.add(minute)
+        therapy = []
+        empty_pair = None
+        for i in range(pairs):
+            medication, quantity = values[1 + 2 * i], values[2 + 2 * i]
+            if not medication and not quantity:
+                empty_pair = empty_pair or i + 1
+                continue
+            if not medication or not quantity:
+                errors.append(f"{name}:{line}: medication_{i + 1} and quantity_medication_{i + 1} must be both set or both empty")
+                continue
+            if empty_pair is not None:
+                errors.append(f"{name}:{line}: medication_{i + 1} is set but medication_{empty_pair} is empty")
+            if catalog is not None and medication not in catalog:
+                errors.append(f"{name}:{line}: unknown medication '{medication}'")
+            for column, value in ((f'medication_{i + 1}', medication), (f'quantity_medication_{i + 1}', quantity)):
+                if len(value.encode('utf-8')) > MAX_STRING_BYTES:
+                    errors.append(f"{name}:{line}: {column} is too long (at most {MAX_STRING_BYTES} bytes)")
+            therapy.append((medication, quantity))
+        if therapy:
+            doses.append((minute, therapy))
+    doses.sort(key=lambda dose: dose[0])
+    return pairs, doses, errors
+
+
+def compile_week(folder, catalog=None):
+    """
+    Validate the therapy plans of a folder and compile them into the binary artifact of the week.
+    A day without a CSV file has no doses.
+
+    Args:
+        folder (str): The folder of the therapy plan CSV files.
+        catalog (set, optional): The known medications. Defaults to None (the catalog of the folder,
+            or of its parent, if any).
+
+    Returns:
+        bytes: The artifact.
+
+    Raises:
+        TherapyPlanError: If any of the files is not valid.
+    """
+    if catalog is None:
+        catalog = load_catalog(folder)
+    strings = {}
+    days = []
+    errors = []
+    for day in DAYS:
+        file_path = plan_file_path(folder, day)
+        if not os.path.exists(file_path):
+            days.append((0, []))
+            continue
+        pairs, doses, day_errors = parse_day(file_path, catalog)
+        errors.extend(day_errors)
+        days.append((pairs, doses))
+        for _, therapy in doses:
+            for medication, quantity in therapy:
+                strings.setdefault(medication, len(strings))
+                strings.setdefault(quantity, len(strings))
+    if len(strings) > MAX_STRINGS:
+        errors.append(f"{folder}: too many different medications and quantities ({len(strings)}, at most {MAX_STRINGS})")
+    if errors:
+        raise TherapyPlanError(errors)
+    payload = bytearray(struct.pack('<H', len(strings)))
+    for string in strings:
+        encoded = string.encode('utf-8')
+        payload += struct.pack('<H', len(encoded)) + encoded
+    for pairs, doses in days:
+        payload += struct.pack('<BH', pairs, len(doses))
+        for minute, therapy in doses:
+            payload += struct.pack('<HB', minute, len(therapy))
+            for medication, quantity in therapy:
+                payload += struct.pack('<HH', strings[medication], strings[quantity])
+    return HEADER.pack(MAGIC, FORMAT_VERSION, zlib.crc32(payload)) + bytes(payload)
+
+
+def load_week(data):
+    """
+    Load the binary artifact of the week.
+
+    Args:
+        data (bytes): The artifact.
+
+    Returns:
+        dict: The index of every day: the sorted minute slots, the 'HH:MM' hours, the medications
+            of each slot, the plan as a dict and the display table.
+
+    Raises:
+        TherapyPlanError: If the artifact is not valid.
+    """
+    if len(data) < HEADER.size:
+        raise TherapyPlanError(["The therapy plan artifact is truncated"])
+    magic, version, checksum = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise TherapyPlanError([f"The therapy plan artifact has an unknown format (version {version})"])
+    if zlib.crc32(data[HEADER.size:]) != checksum:
+        raise TherapyPlanError(["The therapy plan artifact is corrupted"])
+    try:
+        offset = HEADER.size
+        count, = struct.unpack_from('<H', data, offset)
+        offset += 2
+        strings = []
+        for _ in range(count):
+            length, = struct.unpack_from('<H', data, offset)
+            offset += 2
+            strings.append(sys.intern(data[offset:offset + length].decode('utf-8')))
+            offset += length
+        week = {}
+        for day in DAYS:
+            pairs, slots = struct.unpack_from('<BH', data, offset)
+            offset += 3
+            minutes, hours, medications = [], [], []
+            for _ in range(slots):
+                minute, size = struct.unpack_from('<HB', data, offset)
+                offset += 3
+                indexes = struct.unpack_from(f'<{2 * size}H', data, offset)
+                offset += 4 * size
+                minutes.append(minute)
+                hours.append(minute_to_hour(minute))
+                medications.append([(strings[indexes[i]], strings[indexes[i + 1]]) for i in range(0, 2 * size, 2)])
+            week[day] = build_day(pairs, minutes, hours, medications)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise TherapyPlanError([f"The therapy plan artifact is corrupted: {e}"])
+    return week
+
+
+def build_day(pairs, minutes, hours, medications):
+    """
+    Build the index of a day, with the table shown in the index page.
+
+    Args:
+        pairs (int): The number of medication column pairs.
+        minutes (list): The sorted minute slots.
+        hours (list): The 'HH:MM' hour of every slot.
+        medications (list): The (medication, quantity) of every slot.
+
+    Returns:
+        dict: The index of the day.
+    """
+    columns = ['Orario']
+    for i in range(1, pairs + 1):
+        columns += [f'Medicinale {i}', f'Quantità {i}']
+    rows = []
+    for hour, therapy in zip(hours, medications):
+        row = dict.fromkeys(columns, '')
+        row['Orario'] = hour
+        for i, (medication, quantity) in enumerate(therapy, start=1):
+            row[f'Medicinale {i}'] = medication
+            row[f'Quantità {i}'] = quantity
+        rows.append(row)
+    return {
+        'minutes': minutes,
+        'hours': hours,
+        'medications': medications,
+        'plan': dict(zip(hours, medications)),
+        'columns': columns,
+        'rows': rows
+    }
+
+
+def write_artifact(folder, data):
+    """
+    Write the artifact of a folder atomically, so that a reader never sees it half written.
+
+    Args:
+        folder (str): The folder of the therapy plans.
+        data (bytes): The artifact.
+
+    Returns:
+        str: The path of the artifact.
+    """
+    path = os.path.join(folder, ARTIFACT_NAME)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate and compile the therapy plans of a folder and of its patient folders")
+    parser.add_argument('folder', help="the folder of the therapy plans")
+    parser.add_argument('--check', action='store_true', help="only validate, without writing the artifacts")
+    args = parser.parse_args()
+    folders = [args.folder] + sorted(
+        os.path.join(args.folder, name) for name in os.listdir(args.folder)
+        if os.path.isdir(os.path.join(args.folder, name))
+    )
+    failed = False
+    for folder in folders:
+        if not any(os.path.exists(plan_file_path(folder, day)) for day in DAYS):
+            continue
+        try:
+            data = compile_week(folder)
+        except TherapyPlanError as e:
+            failed = True
+            print(f"{folder}: {len(e.errors)} errors")
+            for error in e.errors:
+                print(f"  {error}")
+            continue
+        if args.check:
+            print(f"{folder}: ok")
+        else:
+            print(f"{folder}: {write_artifact(folder, data)} ({len(data)} bytes)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+# Import all the needed libraries
+import bisect
+import os
+import threading
+import time
+from therapy_plan_compiler import (
+    ARTIFACT_NAME, DAYS, TherapyPlanError, build_day, compile_week, hour_to_minute, load_week, plan_file_path, write_artifact
+)
+
+
+def parse_empty_week():
+    """
+    Build the index of a week without therapy plans.
+
+    Returns:
+        dict: An index with no slots and an empty display table for every day.
+    """
+    return {day: build_day(0, [], [], []) for day in DAYS}
+
+
+class TherapyPlanStore:
+    """
+    In-memory index of the therapy plans of the whole week.
+
+    The plans are loaded from the compiled artifact of the week (see
+    `therapy_plan_compiler`) and kept as sorted arrays of minute-of-day slots, so that
+    looking up the next dose is a binary search. When a CSV file is newer than the
+    artifact, the week is compiled again first. The modification times are checked at
+    most once every `check_interval` seconds; plans that do not compile are reported
+    and the last valid ones are kept.
+    """
+
+    def __init__(self, folder='../therapy_plan', check_interval=5.0):
+        """
+        Initialize the store and load the therapy plans of all the days.
+
+        Args:
+            folder (str, optional): The folder containing the therapy plan CSV files. Defaults to '../therapy_plan'.
+            check_interval (float, optional): Seconds between two checks of the files modification times. Defaults to 5.0.
+        """
+        self.folder = folder
+        self.check_interval = check_interval
+        self.version = 0
+        self._days = parse_empty_week()
+        self._mtimes = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def _stat(self):
+        mtimes = []
+        for path in [os.path.join(self.folder, ARTIFACT_NAME)] + [plan_file_path(self.folder, day) for day in DAYS]:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _compile(self):
+        data = compile_week(self.folder)
+        try:
+            write_artifact(self.folder, data)
+        except OSError as e:
+            # e.g. a read-only folder, the compiled week is used without saving it
+            print(f"Error: Could not write the therapy plan artifact of {self.folder}: {e}")
+        return data
+
+    def refresh(self, force=False):
+        """
+        Reload the therapy plans if the artifact or a CSV file changed since the last load,
+        compiling them first if a CSV file is newer than the artifact.
+
+        Args:
+            force (bool, optional): If True the modification times are checked even if
+                `check_interval` has not elapsed yet. Defaults to False.
+
+        Returns:
+            bool: True if the week has been reloaded, False otherwise.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return False
+        with self._lock:
+            self._last_check = now
+            mtimes = self._stat()
+            if mtimes == self._mtimes:
+                return False
+            artifact_mtime, plan_mtimes = mtimes[0], [mtime for mtime in mtimes[1:] if mtime is not None]
+            try:
+                if plan_mtimes and (artifact_mtime is None or max(plan_mtimes) > artifact_mtime):
+                    data = self._compile()
+                    mtimes = self._stat()
+                elif artifact_mtime is not None:
+                    with open(os.path.join(self.folder, ARTIFACT_NAME), 'rb') as f:
+                        data = f.read()
+                else:
+                    data = None
+                days = load_week(data) if data is not None else parse_empty_week()
+            except TherapyPlanError as e:
+                print(f"Error: The therapy plans of {self.folder} are not valid, the previous ones are kept:\n{e}")
+                self._mtimes = mtimes
+                return False
+            self._days = days
+            self._mtimes = mtimes
+            self.version += 1
+            return True
+
+    def _get_day(self, day):
+        self.refresh()
+        return self._days[day]
+
+    def get_plan(self, day):
+        """
+        Get the therapy plan for a specific day.
+
+        Args:
+            day (str): The day of the week in lowercase (e.g., 'monday').
+
+        Returns:
+            dict: A dictionary mapping each 'HH:MM' hour to the list of (medication, quantity) to take.
+        """
+        return self._get_day(day)['plan']
+
+    def get_display(self, day):
+        """
+        Get the therapy plan for a specific day formatted for display.
+
+        Args:
+            day (str): The day of the week in lowercase (e.g., 'monday').
+
+        Returns:
+            tuple: A tuple containing the list of column names and the list of rows (as dicts).
+        """
+        day_plan = self._get_day(day)
+        return day_plan['columns'], day_plan['rows']
+
+    def get_medications(self):
+        """
+        Get all the medications of the week.
+
+        Returns:
+            list: The names of the medications, sorted and without duplicates.
+        """
+        self.refresh()
+        medications = set()
+        for day_plan in self._days.values():
+            for therapy in day_plan['medications']:
+                medications.update(medication for medication, _ in therapy)
+        return sorted(medications)
+
+    def next_dose(self, day, hour):
+        """
+        Get the first dose of the day strictly after the given time.
+
+        Args:
+            day (str): The day of the week in lowercase (e.g., 'monday').
+            hour (str): The time in 'HH:MM' format.
+
+        Returns:
+            tuple: A tuple containing the 'HH:MM' hour and the list of medications of the next dose,
+                or (None, None) if there are no more doses for the day.
+        """
+        day_plan = self._get_day(day)
+        index = bisect.bisect_right(day_plan['minutes'], hour_to_minute(hour))
+        if index == len(day_plan['minutes']):
+            return None, None
+        return day_plan['hours'][index], day_plan['medications'][index]
+
@@ -0,0 +1,138 @@
+# Import all the needed libraries
+import os
+import re
+import subprocess
+import wave
+from io import BytesIO
+
+
+class TTSBackend:
+    """
+    Interface of a text-to-speech engine.
+
+    A backend produces the audio of a text as a sequence of chunks, each of which can be
+    played on its own, so that playback can start as soon as the first chunk is ready.
+    """
+
+    name = 'base'
+    extension = 'bin'
+
+    def stream(self, text, lang='it'):
+        """
+        Synthesize the given text chunk by chunk.
+
+        Args:
+            text (str): The text to be synthesized.
+            lang (str, optional): The language of the text. Defaults to 'it'.
+
+        Yields:
+            bytes: The audio chunks, in playback order.
+        """
+        raise NotImplementedError
+
+    def join_chunks(self, chunks):
+        """
+        Join the audio chunks produced by `stream` into a single playable audio file.
+
+        Args:
+            chunks (list): The audio chunks.
+
+        Returns:
+            bytes: The whole audio.
+        """
+        return b''.join(chunks)
+
+    def synthesize(self, text, lang='it'):
+        """
+        Synthesize the given text as a single audio file.
+
+        Args:
+            text (str): The text to be synthesized.
+            lang (str, optional): The language of the text. Defaults to 'it'.
+
+        Returns:
+            bytes: The whole audio.
+        """
+        return self.join_chunks(list(self.stream(text, lang)))
+
+
+class GTTSBackend(TTSBackend):
+    """
+    Google Text-to-Speech backend, it needs network access and produces MP3 chunks.
+    """
+
+    name = 'gtts'
+    extension = 'mp3'
+
+    def stream(self, text, lang='it'):
+        from gtts import gTTS
+        # gTTS splits long texts in parts and yields the MP3 of each part as soon as it is received
+        for chunk in gTTS(text, lang=lang).stream():
+            yield chunk
+
+
+class EspeakBackend(TTSBackend):
+    """
+    Offline backend based on the espeak-ng command line synthesizer, it produces one WAV chunk per sentence.
+    """
+
+    name = 'espeak'
+    extension = 'wav'
+
+    def __init__(self, executable='espeak-ng', speed=150):
+        """
+        Initialize the backend.
+
+        Args:
+            executable (str, optional): The espeak-ng executable. Defaults to 'espeak-ng'.
+            speed (int, optional): The speaking rate in words per minute. Defaults to 150.
+        """
+        self.executable = executable
+        self.speed = speed
+
+    def stream(self, text, lang='it'):
+        # split after the punctuation so that the first sentence is ready as soon as possible
+        for sentence in re.split(r'(?<=[.;:?!])\s*', text):
+            if not sentence.strip():
+                continue
+            completed = subprocess.run(
+                [self.executable, '-v', lang, '-s', str(self.speed), '--stdout', sentence],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True
+            )
+            yield completed.stdout
+
+    def join_chunks(self, chunks):
+        # WAV files can not be simply concatenated, the frames are copied under a single header
+        output = BytesIO()
+        with wave.open(output, 'wb') as joined:
+            for i, chunk in enumerate(chunks):
+                with wave.open(BytesIO(chunk), 'rb') as part:
+                    if i == 0:
+                        joined.setparams(part.getparams())
+                    joined.writeframes(part.readframes(part.getnframes()))
+        return output.getvalue()
+
+
+TTS_BACKENDS = {
+    GTTSBackend.name: GTTSBackend,
+    EspeakBackend.name: EspeakBackend
+}
+
+
+def get_tts_backend(name=None):
+    """
+    Create the text-to-speech backend with the given name.
+
+    Args:
+        name (str, optional): The name of the backend. Defaults to the TTS_BACKEND environment variable, or 'gtts'.
+
+    Returns:
+        TTSBackend: The backend instance.
+    """
+    if name is None:
+        name = os.getenv("TTS_BACKEND", GTTSBackend.name)
+    if name not in TTS_BACKENDS:
+        raise ValueError(f"Unknown TTS backend '{name}', available backends: {', '.join(TTS_BACKENDS)}")
+    return TTS_BACKENDS[name]()
@@ -0,0 +1,164 @@
+# Import all the needed libraries
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class TTSCache:
+    """
+    Content-addressed cache of synthesized speech.
+
+    The audio is addressed by the hash of the backend, the language and the text. The most
+    recently used entries are kept in memory, while all the entries are persisted on disk,
+    so that a phrase synthesized once can be played again without any network access.
+    """
+
+    def __init__(self, backend, folder='../tts_cache', max_items=128):
+        """
+        Initialize the cache.
+
+        Args:
+            backend (TTSBackend): The text-to-speech backend used for the phrases not yet cached.
+            folder (str, optional): The folder where the audio files are persisted. Defaults to '../tts_cache'.
+            max_items (int, optional): The maximum number of entries kept in memory. Defaults to 128.
+        """
+        self.backend = backend
+        self.folder = folder
+        self.max_items = max_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, text, lang):
+        """
+        Compute the key of a phrase.
+
+        Args:
+            text (str): The text of the phrase.
+            lang (str): The language of the phrase.
+
+        Returns:
+            str: The hexadecimal SHA-256 digest of the backend name, the language and the text.
+        """
+        return hashlib.sha256(f'{self.backend.name}\n{lang}\n{text}'.encode('utf-8')).hexdigest()
+
+    def _file_path(self, key):
+        return os.path.join(self.folder, f'{key}.{self.backend.extension}')
+
+    def _remember(self, key, audio):
+        with self._lock:
+            self._memory[key] = audio
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+    def lookup(self, text, lang='it'):
+        """
+        Look up a phrase in memory and then on disk, without synthesizing it.
+
+        Args:
+            text (str): The text of the phrase.
+            lang (str, optional): The language of the phrase. Defaults to 'it'.
+
+        Returns:
+            bytes or None: The audio of the phrase, or None if it is not cached.
+        """
+        key = self.key(text, lang)
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                return audio
+        try:
+            with open(self._file_path(key), 'rb') as f:
+                audio = f.read()
+        except FileNotFoundError:
+            return None
+        self._remember(key, audio)
+        return audio
+
+    def store(self, text, audio, lang='it'):
+        """
+        Store the audio of a phrase in memory and on disk.
+
+        Args:
+            text (str): The text of the phrase.
+            audio (bytes): The audio of the phrase.
+            lang (str, optional): The language of the phrase. Defaults to 'it'.
+        """
+        key = self.key(text, lang)
+        file_path = self._file_path(key)
+        # write to a temporary file first so that a crash never leaves a truncated entry
+        tmp_path = f'{file_path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(audio)
+        os.replace(tmp_path, file_path)
+        self._remember(key, audio)
+        return
+
+    def get(self, text, lang='it'):
+        """
+        Get the audio of a phrase, synthesizing and storing it if it is not cached.
+
+        Args:
+            text (str): The text of the phrase.
+            lang (str, optional): The language of the phrase. Defaults to 'it'.
+
+        Returns:
+            bytes: The audio of the phrase.
+        """
+        audio = self.lookup(text, lang)
+        if audio is None:
+            audio = self.backend.synthesize(text, lang)
+            self.store(text, audio, lang)
+        return audio
+
+    def stream(self, text, lang='it'):
+        """
+        Get the audio of a phrase chunk by chunk.
+
+        A cached phrase is returned as a single chunk, otherwise the chunks are yielded as
+        soon as the backend produces them and the whole audio is stored once complete.
+
+        Args:
+            text (str): The text of the phrase.
+            lang (str, optional): The language of the phrase. Defaults to 'it'.
+
+        Yields:
+            bytes: The audio chunks, in playback order.
+        """
+        audio = self.lookup(text, lang)
+        if audio is not None:
+            yield audio
+            return
+        chunks = []
+        for chunk in self.backend.stream(text, lang):
+            chunks.append(chunk)
+            yield chunk
+        self.store(text, self.backend.join_chunks(chunks), lang)
+        return
+
+    def warm_up(self, texts, lang='it'):
+        """
+        Pre-render the given phrases, synthesizing only the ones missing on disk.
+
+        Args:
+            texts (list): The texts of the phrases.
+            lang (str, optional): The language of the phrases. Defaults to 'it'.
+
+        Returns:
+            int: The number of phrases that had to be synthesized.
+        """
+        synthesized = 0
+        for text in texts:
+            key = self.key(text, lang)
+            if os.path.exists(self._file_path(key)):
+                continue
+            try:
+                self.store(text, self.backend.synthesize(text, lang), lang)
+                synthesized += 1
+            except Exception as e:
+                # keep warming up the other phrases, the missing one will be synthesized when spoken
+                print(f"Error: Could not pre-render phrase '{text}': {e}")
+        return synthesized